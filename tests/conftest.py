@@ -0,0 +1,62 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import stub_tenant
+
+# base ontology of the user spaces of the app tests (stands in for data/dimd.ttl)
+DIMD_TTL = """
+@prefix dimd: <https://www.sap.com/products/data-intelligence#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+dimd:Table rdfs:subClassOf dimd:Dataset .
+dimd:column rdfs:domain dimd:Dataset ; rdfs:range dimd:Column .
+dimd:lineage rdfs:subPropertyOf dimd:related .
+"""
+
+
+@pytest.fixture
+def tenant():
+    """
+    Stub tenant with a container of 5 datasets: server, base url
+    """
+    server, url = stub_tenant.start(num_datasets=5, num_columns=3)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app_user(tenant, tmp_path, monkeypatch):
+    """
+    Test client logged in to a user space of the stub tenant (user spaces in tmp_path, no CSRF tokens needed):
+    client, user id
+    """
+    import thhsparql
+    server, url = tenant
+    (tmp_path / 'dimd.ttl').write_text(DIMD_TTL)
+    monkeypatch.setattr(thhsparql, 'USERS_SPACE', str(tmp_path / 'users'))
+    monkeypatch.setattr(thhsparql, 'DIMD', str(tmp_path / 'dimd.ttl'))
+    monkeypatch.setitem(thhsparql.app.config, 'WTF_CSRF_ENABLED', False)
+    user_id = thhsparql.init_user_space('user', url, 'default', 'password')
+    thhsparql.configs[user_id]['loading'].result()
+    client = thhsparql.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+    yield client, user_id
+    thhsparql.graph_store.close_graph(os.path.join(thhsparql.USERS_SPACE, user_id), thhsparql.configs[user_id]['store'])
+    thhsparql.configs.pop(user_id)
+    thhsparql.verified_users.invalidate(user_id)
+
+
+def import_container(user_id, import_new=True, refresh_annotations=False):
+    """
+    Imports the container of the stub tenant into a user space of the app tests
+    """
+    import thhsparql
+    config = thhsparql.configs[user_id]
+    job = thhsparql.jobs.Job(user_id, 'import', 'STUB' + stub_tenant.CONTAINER)
+    return thhsparql.run_import(job, user_id, import_new, config['host'], 'default', 'user', 'password', 'STUB',
+                                stub_tenant.CONTAINER, refresh_annotations)
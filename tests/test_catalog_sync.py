@@ -0,0 +1,169 @@
+from rdflib import ConjunctiveGraph, Literal, Namespace
+
+from utils import catalog_sync, di_json2rdf, stub_tenant
+
+INSTANCE = Namespace('https://example.com/default/')
+TABLE = {i: INSTANCE[f"TABLES%2FTABLE_{i}"] for i in range(5)}
+
+
+def sync(graph, url, manifest, progress=None, refresh_annotations=False):
+    return catalog_sync.sync_catalog(graph, url, 'default', stub_tenant.MD_API, 'user', 'password', 'STUB',
+                                     stub_tenant.CONTAINER, INSTANCE, manifest, progress=progress,
+                                     deductive_closure=False, refresh_annotations=refresh_annotations)
+
+
+def set_lineage(monkeypatch, lineage):
+    """
+    Lineage of the stub datasets: dict of dataset number -> (input numbers, output numbers[, computation type])
+    """
+    def synthetic_lineage(qualified_name):
+        if not qualified_name or int(qualified_name[-1]) not in lineage:
+            return None
+        inputs, outputs, *computation_type = lineage[int(qualified_name[-1])]
+        return stub_tenant.computation([f"TABLES/TABLE_{i}" for i in inputs],
+                                       [f"TABLES/TABLE_{i}" for i in outputs], *computation_type)
+
+    monkeypatch.setattr(stub_tenant, 'synthetic_lineage', synthetic_lineage)
+
+
+def lineage_of(i, o, computation_type='TRANSFORM'):
+    return {(TABLE[i], di_json2rdf.DIMD_LINEAGE, TABLE[o]), (TABLE[o], di_json2rdf.DIMD_IMPACT, TABLE[i]),
+            (TABLE[i], di_json2rdf.DIMD_COMPUTATION_TYPE, Literal(computation_type))}
+
+
+def lineage(graph):
+    return {t for t in graph if t[1] in di_json2rdf.LINEAGE_PREDICATES}
+
+
+def dataset_subjects(graph, name):
+    return {s for s in graph.subjects() if name in str(s)}
+
+
+def test_first_sync_imports_all_datasets(tenant):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    stats = sync(graph, url, manifest)
+    assert stats['datasets'] == 5 and stats['changed'] == 5 and stats['deleted'] == 0
+    assert stats['triples_added'] == len(graph) > 0
+    assert len(manifest) == 5
+    assert all(entry['etag'] for entry in manifest.values())
+
+
+def test_unchanged_datasets_are_not_converted_again(tenant):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    sync(graph, url, manifest)
+    num_triples = len(graph)
+    stats = sync(graph, url, manifest)
+    # the factsheets are answered with 304
+    assert stats['changed'] == 0 and stats['triples_removed'] == 0 and stats['triples_added'] == 0
+    assert len(graph) == num_triples
+
+
+def test_unchanged_datasets_cost_one_request(tenant):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    sync(graph, url, manifest)
+    requests = server.requests
+    sync(graph, url, manifest)
+    # listing and a conditional factsheet request per dataset
+    assert server.requests - requests == 1 + 5
+    requests = server.requests
+    assert sync(graph, url, manifest, refresh_annotations=True)['changed'] == 0
+    assert server.requests - requests == 1 + 3 * 5
+
+
+def test_changed_tags_of_unchanged_factsheet(tenant, monkeypatch):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    sync(graph, url, manifest)
+    entry = dict(manifest['/TABLES/TABLE_2'])
+    tags = stub_tenant.synthetic_tags
+
+    def changed_tags(qualified_name):
+        if qualified_name.endswith('TABLE_2'):
+            return {'tagsOnDataset': [], 'tagsOnAttribute': []}
+        return tags(qualified_name)
+
+    monkeypatch.setattr(stub_tenant, 'synthetic_tags', changed_tags)
+    # tags are only checked on request
+    assert sync(graph, url, manifest)['changed'] == 0
+    stats = sync(graph, url, manifest, refresh_annotations=True)
+    assert stats['changed'] == 1
+    assert manifest['/TABLES/TABLE_2']['annotations'] != entry['annotations']
+    assert manifest['/TABLES/TABLE_2']['etag'] == entry['etag']
+    assert not list(graph.objects(TABLE[2], di_json2rdf.DIMD_TAG))
+    assert sync(graph, url, manifest, refresh_annotations=True)['changed'] == 0
+
+
+def test_changed_lineage_is_retracted(tenant, monkeypatch):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    set_lineage(monkeypatch, {1: ([0], [1])})
+    sync(graph, url, manifest)
+    assert lineage(graph) == lineage_of(0, 1)
+
+    set_lineage(monkeypatch, {1: ([2], [1])})
+    assert sync(graph, url, manifest, refresh_annotations=True)['changed'] == 1
+    assert lineage(graph) == lineage_of(2, 1)
+
+    set_lineage(monkeypatch, dict())
+    assert sync(graph, url, manifest, refresh_annotations=True)['changed'] == 1
+    assert lineage(graph) == set()
+
+
+def test_lineage_shared_by_datasets(tenant, monkeypatch):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    set_lineage(monkeypatch, {0: ([0], [1]), 1: ([0], [1])})
+    sync(graph, url, manifest)
+    shared = lineage(graph)
+    assert shared == lineage_of(0, 1)
+
+    # the lineage of dataset 1 on dataset 0 and the impact on dataset 1 are kept while dataset 0 contributes them
+    set_lineage(monkeypatch, {0: ([0], [1])})
+    sync(graph, url, manifest, refresh_annotations=True)
+    assert lineage(graph) == shared
+    server.num_datasets = 1
+    assert sync(graph, url, manifest)['deleted'] == 4
+    assert lineage(graph) == shared
+    set_lineage(monkeypatch, dict())
+    sync(graph, url, manifest, refresh_annotations=True)
+    assert lineage(graph) == set()
+
+
+def test_incremental_sync_equals_full_import(tenant, monkeypatch):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    set_lineage(monkeypatch, {0: ([0], [1, 2]), 3: ([2], [3]), 4: ([3, 1], [4])})
+    sync(graph, url, manifest)
+    set_lineage(monkeypatch, {0: ([0], [2]), 3: ([1], [3], 'COPY'), 4: ([3], [4])})
+    server.num_datasets = 4
+    sync(graph, url, manifest, refresh_annotations=True)
+
+    full = ConjunctiveGraph()
+    sync(full, url, dict())
+    assert lineage(graph) == lineage_of(0, 2) | lineage_of(1, 3, 'COPY')
+    assert set(graph) == set(full)
+
+
+def test_deleted_datasets_are_retracted(tenant):
+    server, url = tenant
+    graph, manifest = ConjunctiveGraph(), dict()
+    sync(graph, url, manifest)
+    assert dataset_subjects(graph, 'TABLE_4')
+    server.num_datasets = 3
+    stats = sync(graph, url, manifest)
+    assert stats['deleted'] == 2 and stats['changed'] == 0 and stats['triples_removed'] > 0
+    assert sorted(manifest) == ['/TABLES/TABLE_0', '/TABLES/TABLE_1', '/TABLES/TABLE_2']
+    assert not dataset_subjects(graph, 'TABLE_3') and not dataset_subjects(graph, 'TABLE_4')
+    assert dataset_subjects(graph, 'TABLE_2')
+
+
+def test_progress_reports_final_statistics(tenant):
+    server, url = tenant
+    reported = list()
+    stats = sync(ConjunctiveGraph(), url, dict(), progress=lambda s: reported.append(dict(s)))
+    assert reported[-1]['processed'] == reported[-1]['fetched'] == 5
+    assert reported[-1]['changed'] == stats['changed'] == 5
+    assert reported[-1]['triples_new'] == stats['triples_new']
@@ -0,0 +1,96 @@
+import csv
+import functools
+import gzip
+import io
+import json
+import threading
+
+import thhsparql
+from conftest import import_container
+from utils import result_export
+
+TABLES = 'SELECT ?t ?label WHERE { ?t a <https://www.sap.com/products/data-intelligence#Table> ; rdfs:label ?label } ' \
+         'ORDER BY ?label'
+DATASETS = 'SELECT ?t WHERE { ?t a <https://www.sap.com/products/data-intelligence#Dataset> }'
+
+
+def export(client, headers=None, **params):
+    response = client.get('/export', query_string=params, headers=headers or dict())
+    response.get_data()  # the stream ends with the request context
+    return response
+
+
+def test_export_formats(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+
+    response = export(client, query=TABLES)
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=results.csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ['t', 'label'] and [row[1] for row in rows[1:]] == [f"TABLE_{i}" for i in range(5)]
+
+    lines = export(client, query=TABLES, format='tsv').get_data(as_text=True).splitlines()
+    assert lines[0] == '?t\t?label' and lines[1].endswith('\t"TABLE_0"')
+
+    results = json.loads(export(client, query=TABLES, format='json').get_data(as_text=True))
+    assert results['head']['vars'] == ['t', 'label']
+    assert results['results']['bindings'][0]['label'] == {'type': 'literal', 'value': 'TABLE_0'}
+    assert results['results']['bindings'][0]['t']['type'] == 'uri'
+
+    lines = export(client, query=TABLES, format='ndjson').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['label']['value'] for line in lines] == [f"TABLE_{i}" for i in range(5)]
+
+
+def test_export_negotiation_and_gzip(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+    response = export(client, headers={'Accept': 'application/x-ndjson'}, query=TABLES)
+    assert response.mimetype == 'application/x-ndjson'
+
+    response = export(client, headers={'Accept-Encoding': 'gzip'}, query=TABLES)
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()).decode('utf-8') == export(client, query=TABLES).get_data(as_text=True)
+
+
+def test_export_of_stored_query_without_inferred_triples(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+    thhsparql.configs[user_id]['stored_queries'] = {'datasets': DATASETS}
+    assert len(export(client, name='datasets').get_data(as_text=True).splitlines()) == 6
+    assert len(export(client, name='datasets', inferred='false').get_data(as_text=True).splitlines()) == 1
+
+
+def test_export_errors(app_user):
+    client, user_id = app_user
+    assert export(client).status_code == 400
+    assert export(client, name='unknown').status_code == 404
+    assert export(client, query=TABLES, format='xlsx').status_code == 400
+    assert export(client, query='SELECT ?s WHERE {').status_code == 400
+    assert export(client, query='ASK { ?s ?p ?o }').status_code == 400
+    assert export(client, query='INSERT DATA { <urn:a> <urn:b> <urn:c> }').status_code == 400
+    # api endpoints answer 401 instead of redirecting to the login page
+    assert thhsparql.app.test_client().get('/export', query_string={'query': TABLES}).status_code == 401
+
+
+def test_stalled_export_does_not_block_changes(app_user, monkeypatch):
+    client, user_id = app_user
+    import_container(user_id)
+    monkeypatch.setattr(result_export, 'buffered', functools.partial(result_export.buffered, size=1))
+    # the client has received the first row and reads no further
+    response = client.get('/export', query_string={'query': TABLES}, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+
+    def change():
+        with thhsparql.changing_user_space(user_id) as graph:
+            thhsparql.update_user_graph(user_id, graph, 'INSERT DATA { <urn:example:a> rdfs:label "TABLE_5" }')
+
+    changer = threading.Thread(target=change, daemon=True)
+    changer.start()
+    changer.join(5)
+    assert not changer.is_alive()
+    # the export shows the graph before the change
+    rows = list(csv.reader(io.StringIO((first + b''.join(chunks)).decode('utf-8'))))
+    assert [row[1] for row in rows[1:]] == [f"TABLE_{i}" for i in range(5)]
+    response.close()
@@ -0,0 +1,62 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import export_catalog, stub_tenant
+
+
+def test_ordered_map_keeps_order_and_window():
+    submitted = []
+    lock = threading.Lock()
+
+    def work(i):
+        with lock:
+            submitted.append(i)
+        time.sleep(random.random() / 100)
+        return i * i
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = []
+        for result in export_catalog.ordered_map(executor, work, iter(range(50)), window=5):
+            results.append(result)
+            # never more than window items requested ahead of the consumer
+            assert len(submitted) <= len(results) + 5
+    assert results == [i * i for i in range(50)]
+
+
+def test_iter_catalog_requests_in_parallel():
+    server, url = stub_tenant.start(num_datasets=8, num_columns=2, latency=0.1)
+    try:
+        start = time.monotonic()
+        datasets = list(export_catalog.iter_catalog(url, 'default', stub_tenant.MD_API, 'user', 'password', 'conn',
+                                                    stub_tenant.CONTAINER, max_workers=8))
+        elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert [ds['metadata']['name'] for ds in datasets] == [f"TABLE_{i}" for i in range(8)]
+    assert all('tags' in ds for ds in datasets)
+    # 1 listing + 3 requests per dataset, serially at least 2.5s
+    assert server.requests == 1 + 3 * 8
+    assert elapsed < 1.5
+
+
+def test_iter_catalog_retries_throttled_requests():
+    server, url = stub_tenant.start(num_datasets=6, num_columns=2, throttle=4)
+    try:
+        datasets = list(export_catalog.iter_catalog(url, 'default', stub_tenant.MD_API, 'user', 'password', 'conn',
+                                                    stub_tenant.CONTAINER, max_workers=2))
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(datasets) == 6
+    assert server.requests > 1 + 3 * 6
+
+
+def test_session_is_shared_per_tenant():
+    connection = {'url': 'http://tenant.invalid/api', 'auth': ('default\\user', 'password')}
+    session = export_catalog.get_session(connection, 4)
+    assert export_catalog.get_session(connection, 2) is session
+    # a larger pool replaces the session
+    assert export_catalog.get_session(connection, 8) is not session
@@ -0,0 +1,165 @@
+import os
+
+import pytest
+from rdflib import Namespace
+from rdflib.graph import ModificationException
+from rdflib.namespace import RDF, RDFS
+
+import thhsparql
+from conftest import DIMD_TTL, import_container
+from utils import graph_store, snapshot
+
+DIMD = Namespace('https://www.sap.com/products/data-intelligence#')
+EX = Namespace('urn:example:')
+
+
+@pytest.fixture
+def base_files(tmp_path):
+    (tmp_path / 'dimd.ttl').write_text(DIMD_TTL)
+    return [str(tmp_path / 'dimd.ttl')]
+
+
+def user_graph(base_files):
+    """
+    Graph with a table imported, its inferred type and a triple both asserted and inferred
+    """
+    graph = graph_store.new_graph(base_files)
+    graph.get_context(graph_store.import_graph('STUB/TABLES')).add((EX.t, RDF.type, DIMD.Table))
+    graph.get_context(graph_store.INFERRED).add((EX.t, RDF.type, DIMD.Dataset))
+    graph.add((EX.t, RDFS.label, EX.label))
+    graph.get_context(graph_store.INFERRED).add((EX.t, RDFS.label, EX.label))
+    return graph
+
+
+def test_union_view_leaves_out_inferred_triples(base_files):
+    graph = user_graph(base_files)
+    assert (EX.t, RDF.type, DIMD.Dataset) in graph
+    assert (DIMD.Table, RDFS.subClassOf, DIMD.Dataset) in graph
+    assert (DIMD.Table, RDF.type, RDFS.Resource) in graph
+
+    asserted = graph_store.UnionView(graph, inferred=False)
+    assert (EX.t, RDF.type, DIMD.Dataset) not in asserted
+    # the ontology is asserted, its closure is inferred; a triple asserted as well is kept
+    assert (DIMD.Table, RDFS.subClassOf, DIMD.Dataset) in asserted
+    assert (DIMD.Table, RDF.type, RDFS.Resource) not in asserted
+    assert (EX.t, RDFS.label, EX.label) in asserted
+    assert len(asserted) == len(set(asserted.triples((None, None, None)))) < len(graph)
+
+    query = 'SELECT ?c WHERE { <urn:example:t> a ?c }'
+    assert {row.c for row in graph.query(query)} == {DIMD.Table, DIMD.Dataset}
+    assert {row.c for row in asserted.query(query)} == {DIMD.Table}
+
+
+def test_dropped_import_graph_leaves_the_other_graphs(base_files):
+    graph = user_graph(base_files)
+    graph.remove_context(graph.get_context(graph_store.import_graph('STUB/TABLES')))
+    assert (EX.t, RDF.type, DIMD.Table) not in graph
+    assert (EX.t, RDFS.label, EX.label) in graph
+    assert (DIMD.Table, RDFS.subClassOf, DIMD.Dataset) in graph
+
+
+
+def snapshot_graph(user_folder):
+    graph = graph_store.new_graph()
+    snapshot.load(graph, str(user_folder / graph_store.REPO_SNAPSHOT))
+    return graph
+
+
+def test_shared_ontology_is_loaded_once_and_read_only(base_files):
+    graph, other = user_graph(base_files), graph_store.new_graph(base_files)
+    assert graph.base_graphs is other.base_graphs is graph_store.shared_ontology(base_files)
+    assert (DIMD.Table, RDFS.subClassOf, DIMD.Dataset) in other
+    with pytest.raises(ModificationException):
+        graph.get_context(graph_store.ONTOLOGY).add((EX.a, EX.p, EX.b))
+    # the ontology is neither in the store nor in its snapshot
+    ontology = set(graph.get_context(graph_store.ONTOLOGY))
+    assert not ontology & set(graph.stored_triples())
+    assert len(graph) == len(set(graph.stored_triples()) | ontology | set(graph.get_context(
+        graph_store.ONTOLOGY_INFERRED)))
+
+
+def test_stored_copies_of_the_ontology_are_dropped(base_files, tmp_path):
+    user_folder = tmp_path / 'user'
+    user_folder.mkdir()
+    graph = user_graph(base_files)
+    # the ontology stored in the snapshot by older versions
+    older = graph_store.new_graph()
+    graph_store.copy_graph(graph, older)
+    older.get_context(graph_store.ONTOLOGY).add((DIMD.Table, RDFS.subClassOf, DIMD.Dataset))
+    snapshot.save(older, str(user_folder / graph_store.REPO_SNAPSHOT))
+
+    opened = graph_store.open_graph(str(user_folder), base_files=base_files)
+    try:
+        assert set(opened.stored_triples()) == set(graph.stored_triples())
+        assert len(snapshot_graph(user_folder)) == len(set(graph.stored_triples()))
+    finally:
+        graph_store.close_graph(str(user_folder))
+
+
+def open_user_graphs(tmp_path, num_users, num_triples=10):
+    """
+    Graphs of user spaces with committed triples, used in the order of the user spaces: user folders
+    """
+    user_folders = list()
+    for i in range(num_users):
+        user_folder = str(tmp_path / f"user{i}")
+        os.mkdir(user_folder)
+        graph = graph_store.open_graph(user_folder)
+        for k in range(num_triples):
+            graph.add((EX[f"s{k}"], EX.p, EX[f"user{i}"]))
+        graph_store.commit_graph(graph, user_folder)
+        with graph_store.pinned(user_folder):
+            pass
+        user_folders.append(user_folder)
+    return user_folders
+
+
+def test_least_recently_used_graphs_are_unloaded(tmp_path):
+    user_folders = open_user_graphs(tmp_path, 3)
+    try:
+        size = 10 * graph_store.TRIPLE_SIZE
+        assert list(graph_store.resident_sizes().items())[-3:] == [(folder, size) for folder in user_folders]
+        with graph_store.pinned(user_folders[0]):
+            pass
+        unloaded = list()
+        # user1 is used least recently, user2 is in use
+        with graph_store.pinned(user_folders[2]):
+            assert graph_store.unload_idle(size, unloaded.append) == size
+        assert unloaded == user_folders[1:2] + user_folders[:1]
+        assert set(graph_store.resident_sizes()) & set(user_folders) == {user_folders[2]}
+
+        graph = graph_store.open_graph(user_folders[1])
+        assert set(graph.objects(EX.s0, EX.p)) == {EX.user1}
+    finally:
+        for user_folder in user_folders:
+            graph_store.close_graph(user_folder)
+
+
+def test_unloaded_user_graph_is_loaded_by_its_next_use(app_user, monkeypatch):
+    client, user_id = app_user
+    import_container(user_id)
+    num_triples = len(thhsparql.user_graph(user_id))
+    version = thhsparql.configs[user_id]['version']
+    monkeypatch.setattr(thhsparql, 'GRAPH_MEMORY_BUDGET', 0)
+    thhsparql.unload_idle_graphs()
+    assert thhsparql.configs[user_id]['graph'] is None
+    assert client.get('/memory').get_json()['loaded'] is False
+    with thhsparql.using_user_space(user_id) as graph:
+        # a graph in use is not unloaded
+        thhsparql.unload_idle_graphs()
+        assert thhsparql.configs[user_id]['graph'] is graph and len(graph) == num_triples
+    assert thhsparql.configs[user_id]['version'] > version
+    memory = client.get('/memory').get_json()
+    assert memory['loaded'] and memory['user'] == graph_store.resident_size(graph) > 0
+
+
+@pytest.mark.parametrize('memory_limit, workers, budget', [('512M', '2', 128 * 1024 ** 2),
+                                                           ('1G', None, 512 * 1024 ** 2),
+                                                           ('', '4', 64 * 1024 ** 2)])
+def test_graph_memory_budget_is_split_among_the_workers(monkeypatch, memory_limit, workers, budget):
+    monkeypatch.setenv('MEMORY_LIMIT', memory_limit)
+    if workers:
+        monkeypatch.setenv('WEB_CONCURRENCY', workers)
+    else:
+        monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    assert thhsparql.graph_memory_budget() == budget
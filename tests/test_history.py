@@ -0,0 +1,82 @@
+import json
+
+from utils import history
+
+
+def test_navigation():
+    h = history.History(None, None, 3)
+    for i in range(5):
+        h.append(i)
+    assert list(h) == [2, 3, 4]
+    assert [h.back(), h.back(), h.back()] == [3, 2, 2]
+    assert [h.forward(), h.forward(), h.forward()] == [3, 4, 4]
+
+
+def test_append_again_moves_item_to_end(tmp_path):
+    filename = str(tmp_path / 'history.jsonl')
+    h = history.History(filename)
+    for item in ['a', 'b', 'c', 'a']:
+        h.append(item)
+    h.update('b', runtime=0.5)
+    assert list(h) == ['b', 'c', 'a'] and h.pointer_value() == 'a'
+
+    reloaded = history.History(filename)
+    assert list(reloaded) == ['b', 'c', 'a']
+    assert reloaded.pointer_value() == 'a'
+    assert reloaded.back() == 'c' and reloaded.back() == 'b'
+    assert reloaded.pointer_entry()['runtime'] == 0.5
+
+
+def test_legacy_file(tmp_path):
+    filename = tmp_path / 'history.jsonl'
+    filename.write_text(json.dumps({'0': 'a', '1': 'b'}))
+    h = history.History(str(filename))
+    h.append('c')
+    assert list(history.History(str(filename))) == ['a', 'b', 'c']
+
+
+def test_refresh_reads_lines_of_other_process(tmp_path):
+    filename = str(tmp_path / 'history.jsonl')
+    h1, h2 = history.History(filename), history.History(filename)
+    h1.append('a')
+    assert h2.refresh() and list(h2) == ['a']
+    assert not h2.refresh()
+    with open(filename, 'a') as fp:
+        # line still being written
+        fp.write('{"item": "b", "ti')
+    h2.refresh()
+    assert list(h2) == ['a']
+    with open(filename, 'a') as fp:
+        fp.write('me": 1.0}\n')
+    assert h2.refresh() and list(h2) == ['a', 'b']
+
+
+def test_compaction_drops_stale_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, 'COMPACT_MIN_LINES', 5)
+    filename = str(tmp_path / 'history.jsonl')
+    h = history.History(filename, max_index=3)
+    for i in range(20):
+        h.append(i % 4)
+    with open(filename) as fp:
+        assert len(fp.readlines()) <= 2 * 3 + 5 + 1
+    assert list(h) == [1, 2, 3]
+    assert list(history.History(filename, max_index=3)) == [1, 2, 3]
+
+
+def test_compaction_keeps_lines_of_other_process(tmp_path):
+    filename = str(tmp_path / 'history.jsonl')
+    h1, h2 = history.History(filename), history.History(filename)
+    h1.append('a')
+    h1.append('b')
+    h2.append('c')
+    h1.append('a')
+    h1.compact()
+    assert list(h1) == ['b', 'c', 'a']
+    assert list(history.History(filename)) == ['b', 'c', 'a']
+    with open(filename) as fp:
+        assert len(fp.readlines()) == 3
+
+    # the other process reads the compacted file and appends to it
+    h2.append('d')
+    assert h2.refresh() and list(h2) == ['b', 'c', 'a', 'd']
+    assert h1.refresh() and list(h1) == ['b', 'c', 'a', 'd']
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+from rdflib import Namespace
+from rdflib.namespace import RDF
+
+import thhsparql
+from conftest import import_container
+from utils import catalog_sync, graph_store, jobs, reasoner, stub_tenant
+
+DIMD = Namespace('https://www.sap.com/products/data-intelligence#')
+IMPORT_NAME = 'STUB' + stub_tenant.CONTAINER
+
+
+def form_data(**data):
+    return dict({'di_connection': 'STUB', 'di_container': stub_tenant.CONTAINER, 'selected_query': 'Last Query'},
+                **data)
+
+
+def last_job(user_id):
+    job = thhsparql.job_manager.user_jobs(user_id)[-1]
+    job.future.result()
+    return job
+
+
+def tables(user_id, inferred=False):
+    graph = graph_store.UnionView(thhsparql.configs[user_id]['graph'], inferred)
+    return set(graph.subjects(RDF.type, DIMD.Dataset if inferred else DIMD.Table))
+
+
+def test_import_job_of_form(app_user):
+    client, user_id = app_user
+    thhsparql.configs[user_id]['stored_queries'] = {'Last Query': 'SELECT * { ?s ?p ?o }'}
+    response = client.post('/', data=form_data(submit_import_new='New', di_host=thhsparql.configs[user_id]['host'],
+                                               di_tenant='default', di_user='user', di_pwd='password'))
+    assert response.status_code == 200
+    job = last_job(user_id)
+    assert job.kind == 'import' and job.status == jobs.DONE and job.result['changed'] == 5
+    assert thhsparql.configs[user_id]['imports'] == [IMPORT_NAME]
+    assert len(tables(user_id)) == 5
+    # the closure is maintained in the inferred graph
+    assert tables(user_id, inferred=True) == tables(user_id)
+    assert b'5 new or changed' in client.get(f'/jobs/{job.id}/result').data
+
+
+def test_cancelled_add_import_keeps_applied_datasets(app_user, tenant, monkeypatch):
+    client, user_id = app_user
+    server, url = tenant
+    import_container(user_id)
+    server.num_datasets = 10
+    # the import waits for the lineage of dataset 7 until it has been cancelled
+    release = threading.Event()
+
+    def synthetic_lineage(qualified_name):
+        if qualified_name.endswith('_7'):
+            release.wait(5)
+        return None
+
+    monkeypatch.setattr(stub_tenant, 'synthetic_lineage', synthetic_lineage)
+    job = thhsparql.job_manager.submit(user_id, 'import', IMPORT_NAME, thhsparql.run_import, user_id, False, url,
+                                       'default', 'user', 'password', 'STUB', stub_tenant.CONTAINER)
+    deadline = time.monotonic() + 5
+    while not job.progress.startswith('7/') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    thhsparql.job_manager.cancel(job)
+    release.set()
+    job.future.result()
+    assert job.status == jobs.CANCELLED
+    assert len(tables(user_id)) == 7
+    manifest = catalog_sync.load_manifest(catalog_sync.import_manifest_file(
+        os.path.join(thhsparql.USERS_SPACE, user_id), IMPORT_NAME))
+    assert len(manifest) == 7
+
+    stats = import_container(user_id, import_new=False)
+    assert stats['changed'] == 3 and len(tables(user_id)) == 10
+
+
+def test_drop_import_job_retracts_inferred_triples(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+    thhsparql.configs[user_id]['stored_queries'] = {'Last Query': 'SELECT * { ?s ?p ?o }'}
+    client.post('/imports/drop', data={'drop_import': IMPORT_NAME})
+    job = last_job(user_id)
+    assert job.kind == 'drop' and job.status == jobs.DONE
+    assert job.result[0] > 0 and job.result[1] > 0
+    assert thhsparql.configs[user_id]['imports'] == []
+    assert not tables(user_id) and not tables(user_id, inferred=True)
+    assert client.post('/imports/drop', data={'drop_import': IMPORT_NAME}).status_code == 404
+
+
+def test_reasoning_job_switches_to_owlrl(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+    thhsparql.configs[user_id]['stored_queries'] = {'Last Query': 'SELECT * { ?s ?p ?o }'}
+    client.post('/', data=form_data(submit_reasoning='Reasoning'))
+    job = last_job(user_id)
+    assert job.kind == 'reasoning' and job.status == jobs.DONE
+    assert thhsparql.configs[user_id]['reasoning'] == reasoner.OWLRL_PROFILE
+    assert job.result == len(thhsparql.configs[user_id]['graph'])
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+import pytest
+from rdflib import BNode, ConjunctiveGraph, Literal, Namespace
+from rdflib.namespace import XSD
+
+from utils import jobs
+
+EX = Namespace('urn:example:')
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def looping(job, started):
+    started.set()
+    while True:
+        job.check()
+        time.sleep(0.01)
+
+
+def test_job_result_and_failure():
+    manager = jobs.JobManager(max_workers=2)
+    job = manager.submit('u', 'query', 'sum', lambda job, a, b: a + b, 1, 2, params={'x': 1})
+    job.future.result()
+    assert job.status == jobs.DONE and job.result == 3 and job.params == {'x': 1}
+    job = manager.submit('u', 'query', 'fails', lambda job: 1 / 0)
+    job.future.result()
+    assert job.status == jobs.FAILED and 'division' in job.error
+    assert manager.get(job.id, 'u') is job and manager.get(job.id, 'other') is None
+
+
+def test_cancel_running_and_queued_jobs():
+    manager = jobs.JobManager(max_workers=1, max_jobs_per_user=2)
+    started = threading.Event()
+    running = manager.submit('u', 'query', 'loop', looping, started)
+    queued = manager.submit('u', 'query', 'queued', lambda job: 'never')
+    started.wait(5)
+    manager.cancel(queued)
+    assert queued.status == jobs.CANCELLED
+    manager.cancel(running)
+    running.future.result()
+    assert running.status == jobs.CANCELLED and running.finished
+
+
+def test_jobs_per_user_are_limited():
+    manager = jobs.JobManager(max_workers=2, max_jobs_per_user=1)
+    started = threading.Event()
+    job = manager.submit('u', 'query', 'loop', looping, started)
+    with pytest.raises(jobs.JobLimitExceeded):
+        manager.submit('u', 'query', 'second', lambda job: None)
+    # other users are not limited by the jobs of u
+    manager.submit('v', 'query', 'other', lambda job: None).future.result()
+    manager.cancel(job)
+    job.future.result()
+    job = manager.submit('u', 'query', 'second', lambda job: 2)
+    job.future.result()
+    assert job.result == 2
+
+
+def test_cancellable_graph_stops_query(monkeypatch):
+    graph = ConjunctiveGraph()
+    for i in range(200):
+        graph.add((EX[f"s{i}"], EX.p, EX[f"o{i}"]))
+    manager = jobs.JobManager(max_workers=1)
+    lookups = list()
+
+    def query(job):
+        cancellable = jobs.CancellableGraph(graph, job)
+        for row in cancellable.query('SELECT * WHERE { ?s ?p ?o . ?o ?q ?x }'):
+            pass
+
+    def count(job):
+        lookups.append(1)
+        if len(lookups) == 50:
+            manager.cancel(job)
+        return original(job)
+
+    original = jobs.Job.check
+    monkeypatch.setattr(jobs.Job, 'check', count)
+    job = manager.submit('u', 'query', 'join', query)
+    job.future.result()
+    assert job.status == jobs.CANCELLED
+    assert len(lookups) < 200
+
+
+def test_finished_jobs_expire():
+    manager = jobs.JobManager(ttl=0)
+    job = manager.submit('u', 'query', 'done', lambda job: 1)
+    job.future.result()
+    wait_until(lambda: job.finished)
+    time.sleep(0.01)
+    manager.cleanup()
+    assert manager.get(job.id, 'u') is None
+
+
+def test_result_is_written_as_json_when_another_process_fetches_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'FETCH_INTERVAL', 0.01)
+    # two worker processes sharing the job folder
+    owner, other = jobs.JobManager(folder=str(tmp_path)), jobs.JobManager(folder=str(tmp_path))
+    rows = [(EX.a, Literal('Haus', lang='de')), (BNode('b1'), Literal(42, datatype=XSD.integer)), (EX.c, None)]
+    job = owner.submit('u', 'query', 'select', lambda job: (['s', 'o'], rows), params={'unquote': True})
+    job.future.result()
+    assert not os.path.isfile(tmp_path / f"{job.id}.result")
+
+    remote = other.get(job.id, 'u')
+    assert isinstance(remote, jobs.RemoteJob) and not remote.active()
+    assert remote.status == jobs.DONE and remote.params == {'unquote': True}
+    assert remote.result == [['s', 'o'], [list(row) for row in rows]]
+    assert os.path.isfile(tmp_path / f"{job.id}.result") and not os.path.isfile(tmp_path / f"{job.id}.fetch")
+    assert other.get(job.id, 'other') is None
+
+    # jobs without result are not requested
+    job = owner.submit('u', 'update', 'insert', lambda job: None)
+    job.future.result()
+    assert other.get(job.id, 'u').result is None
+    assert not os.path.isfile(tmp_path / f"{job.id}.fetch")
+
+
+def test_job_is_cancelled_and_limited_by_another_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'CANCEL_CHECK_INTERVAL', 0.01)
+    owner = jobs.JobManager(max_jobs_per_user=1, folder=str(tmp_path))
+    other = jobs.JobManager(max_jobs_per_user=1, folder=str(tmp_path))
+    started = threading.Event()
+    job = owner.submit('u', 'query', 'loop', looping, started)
+    started.wait(5)
+    with pytest.raises(jobs.JobLimitExceeded):
+        other.submit('u', 'query', 'second', lambda job: None)
+    assert [remote.id for remote in other.user_jobs('u')] == [job.id]
+
+    other.cancel(other.get(job.id, 'u'))
+    job.future.result()
+    assert job.status == jobs.CANCELLED
+    wait_until(lambda: not other.get(job.id, 'u').active())
+    other.submit('u', 'query', 'second', lambda job: 2).future.result()
@@ -0,0 +1,49 @@
+from rdflib import ConjunctiveGraph, Literal, Namespace, URIRef
+
+from utils import journal
+
+EX = Namespace('urn:example:')
+NAMED = URIRef('urn:example:graph')
+
+
+def journaled_graph(filename):
+    graph = ConjunctiveGraph(store=journal.JournalMemory())
+    graph.store.open_journal(filename)
+    return graph
+
+
+def test_replay_applies_added_and_removed_triples(tmp_path):
+    filename = str(tmp_path / 'repo.journal')
+    graph = journaled_graph(filename)
+    graph.get_context(NAMED).add((EX.a, EX.p, Literal('a', lang='en')))
+    graph.add((EX.b, EX.p, EX.c))
+    graph.add((EX.c, EX.p, EX.d))
+    graph.remove((EX.c, EX.p, EX.d))
+    graph.commit()
+
+    replayed = ConjunctiveGraph()
+    num_changes, offset = journal.replay(replayed, filename)
+    assert num_changes == 4 and offset == graph.store.journal_offset
+    assert set(replayed.quads()) == set(graph.quads())
+
+
+def test_replay_stops_at_truncated_last_line(tmp_path):
+    filename = str(tmp_path / 'repo.journal')
+    graph = journaled_graph(filename)
+    graph.add((EX.a, EX.p, EX.b))
+    graph.commit()
+    complete = graph.store.journal_offset
+    graph.store.close_journal()
+    with open(filename, 'a', encoding='utf-8') as fp:
+        # last change cut off by a crash
+        fp.write(journal.journal_line(journal.ADDED, (EX.c, EX.p, EX.d), graph.default_context)[:20])
+
+    replayed = ConjunctiveGraph()
+    assert journal.replay(replayed, filename) == (1, complete)
+    assert set(replayed) == {(EX.a, EX.p, EX.b)}
+
+    # the rest of the line is applied by the next replay from the returned offset
+    with open(filename, 'a', encoding='utf-8') as fp:
+        fp.write(journal.journal_line(journal.ADDED, (EX.c, EX.p, EX.d), graph.default_context)[20:])
+    assert journal.replay(replayed, filename, complete)[0] == 1
+    assert set(replayed) == {(EX.a, EX.p, EX.b), (EX.c, EX.p, EX.d)}
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from markupsafe import escape
+from rdflib import Literal
+
+import thhsparql
+from conftest import import_container
+from utils import jobs
+
+COLUMNS = 'SELECT ?c ?label WHERE { ?c a <https://www.sap.com/products/data-intelligence#Column> ; ' \
+          'rdfs:label ?label } ORDER BY ?c ?label'
+
+
+def run_query(client, user_id, statement):
+    thhsparql.configs[user_id]['stored_queries'] = {'Last Query': statement}
+    client.post('/', data={'submit_run': 'Run', 'textarea_cmd': statement, 'selected_query': 'Last Query',
+                           'check_use_namespaces': 'y', 'check_unquote': 'y', 'check_inferred': 'y'})
+    job = thhsparql.job_manager.user_jobs(user_id)[-1]
+    job.future.result()
+    return job
+
+
+def test_result_pages(app_user, monkeypatch):
+    client, user_id = app_user
+    import_container(user_id)
+    monkeypatch.setattr(thhsparql, 'RESULT_PAGE_SIZE', 4)
+    job = run_query(client, user_id, COLUMNS)
+    rows = job.result[1]
+    # 3 columns of 5 tables, the first one with an alternative label
+    assert len(rows) == 20
+
+    page = client.get(f'/jobs/{job.id}/result?page=2').get_data(as_text=True)
+    assert 'Number of results: 20' in page and 'Page 2 of 5' in page
+    graph = thhsparql.user_graph(user_id)
+    for row in thhsparql.format_results(graph, rows[4:8], True, True):
+        assert f'<td>{escape(row[0])}</td>' in page
+    for row in thhsparql.format_results(graph, rows[8:], True, True):
+        assert f'<td>{escape(row[0])}</td>' not in page
+    # pages out of range show the last or first page
+    assert 'Page 5 of 5' in client.get(f'/jobs/{job.id}/result?page=9').get_data(as_text=True)
+    assert 'Page 1 of 5' in client.get(f'/jobs/{job.id}/result?page=0').get_data(as_text=True)
+
+
+def test_stream_shows_rows_while_job_runs(app_user):
+    client, user_id = app_user
+    rows = list()
+    job = jobs.Job(user_id, 'query', 'SELECT ?x', params={'use_namespaces': False, 'unquote': False})
+    job.status = jobs.RUNNING
+    job.partial = (['x'], rows)
+    thhsparql.job_manager.jobs[job.id] = job
+
+    def fetch():
+        for i in range(30):
+            rows.append((Literal(f"row {i}"),))
+            time.sleep(0.005)
+        job.result = job.partial
+        job.status = jobs.DONE
+
+    threading.Thread(target=fetch).start()
+    page = client.get(f'/jobs/{job.id}/stream').get_data(as_text=True)
+    assert job.status == jobs.DONE
+    assert [f'<td>row {i}</td>' in page for i in range(30)] == [True] * 30
+    assert page.count('<tr>') == 31
+    assert client.get('/jobs/unknown/stream').status_code == 404
@@ -0,0 +1,153 @@
+import os
+import random
+
+import owlrl
+import pytest
+from rdflib import ConjunctiveGraph, Graph, Literal, Namespace, URIRef
+from rdflib.namespace import RDF, RDFS, OWL
+
+from utils import di_json2rdf, reasoner, stub_tenant
+
+EX = Namespace('urn:example:')
+CLASSES = [EX[f'C{i}'] for i in range(5)]
+PROPERTIES = [EX[f'p{i}'] for i in range(4)]
+INDIVIDUALS = [EX[f'x{i}'] for i in range(8)]
+INFERRED = URIRef('urn:example:inferred')
+
+
+def random_triple(rnd):
+    k = rnd.random()
+    if k < 0.15:
+        return rnd.choice(CLASSES), RDFS.subClassOf, rnd.choice(CLASSES)
+    if k < 0.25:
+        return rnd.choice(PROPERTIES), RDFS.subPropertyOf, rnd.choice(PROPERTIES)
+    if k < 0.32:
+        return rnd.choice(PROPERTIES), rnd.choice([RDFS.domain, RDFS.range]), rnd.choice(CLASSES)
+    if k < 0.36:
+        return rnd.choice(PROPERTIES), RDF.type, rnd.choice([OWL.SymmetricProperty, OWL.TransitiveProperty,
+                                                             OWL.FunctionalProperty])
+    if k < 0.40:
+        return rnd.choice(INDIVIDUALS), OWL.sameAs, rnd.choice(INDIVIDUALS)
+    if k < 0.44:
+        return rnd.choice(CLASSES), OWL.equivalentClass, rnd.choice(CLASSES)
+    if k < 0.60:
+        return rnd.choice(INDIVIDUALS), RDF.type, rnd.choice(CLASSES)
+    return rnd.choice(INDIVIDUALS), rnd.choice(PROPERTIES), rnd.choice(INDIVIDUALS)
+
+
+def closed_graph(asserted, profile):
+    """
+    Graph of the asserted triples (default graph) and their closure (named graph INFERRED): graph, reasoner
+    """
+    graph = ConjunctiveGraph()
+    for triple in asserted:
+        graph.add(triple)
+    graph_reasoner = reasoner.Reasoner(graph, graph.get_context(INFERRED), profile)
+    graph_reasoner.closure()
+    return graph, graph_reasoner
+
+
+@pytest.mark.parametrize('profile', [reasoner.RDFS_PROFILE, reasoner.OWLRL_PROFILE])
+def test_add_and_remove_maintain_the_closure(profile):
+    rnd = random.Random(25)
+    for trial in range(6):
+        asserted = {random_triple(rnd) for _ in range(25)}
+        graph, user_reasoner = closed_graph(asserted, profile)
+        for step in range(6):
+            if rnd.random() < 0.5:
+                new = [t for t in {random_triple(rnd) for _ in range(3)} if t not in asserted]
+                for triple in new:
+                    graph.add(triple)
+                    asserted.add(triple)
+                user_reasoner.add(new)
+            else:
+                old = rnd.sample(sorted(asserted), 3)
+                for triple in old:
+                    graph.default_context.remove(triple)
+                    asserted.discard(triple)
+                user_reasoner.remove(old)
+            expected = set(closed_graph(asserted, profile)[0])
+            assert set(graph) == expected, f"trial {trial}, step {step}"
+            assert set(graph.get_context(INFERRED)) - asserted == expected - asserted, f"trial {trial}, step {step}"
+
+
+def test_staged_changes_are_applied_at_once():
+    graph = Graph()
+    graph.add((EX.a, EX.p, EX.b))
+    staged = reasoner.StagedChanges(graph)
+    staged.add((EX.c, EX.p, EX.d))
+    staged.remove((EX.a, EX.p, EX.b))
+    assert set(graph) == {(EX.a, EX.p, EX.b)}
+    assert set(staged.triples((None, None, None))) == {(EX.c, EX.p, EX.d)}
+    staged.apply()
+    assert set(graph) == {(EX.c, EX.p, EX.d)}
+    assert staged.added == [(EX.c, EX.p, EX.d)] and staged.removed == [(EX.a, EX.p, EX.b)]
+
+
+# ontology in the style of dimd.ttl, with the constructs the OWL-RL rules apply to
+ONTOLOGY = """
+@prefix dimd: <https://www.sap.com/products/data-intelligence#> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+@prefix owl: <http://www.w3.org/2002/07/owl#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+dimd:Dataset a owl:Class .
+dimd:Table rdfs:subClassOf dimd:Dataset .
+dimd:View rdfs:subClassOf dimd:Dataset ; owl:equivalentClass dimd:VirtualTable .
+dimd:Column a owl:Class .
+dimd:column a owl:ObjectProperty ; rdfs:domain dimd:Dataset ; rdfs:range dimd:Column .
+dimd:primaryKey rdfs:subPropertyOf dimd:column .
+dimd:lineage a owl:ObjectProperty, owl:TransitiveProperty ; owl:inverseOf dimd:impact .
+dimd:tag rdfs:range dimd:Tag .
+dimd:length a owl:DatatypeProperty ; rdfs:range xsd:integer .
+dimd:KeyedDataset owl:onProperty dimd:primaryKey ; owl:someValuesFrom dimd:Column .
+dimd:DatasetWithColumns owl:onProperty dimd:column ; owl:someValuesFrom dimd:Column .
+"""
+VOCABULARY = (str(RDF), str(RDFS), str(OWL), 'http://www.w3.org/2001/XMLSchema#')
+# objects of the triples owlrl derives from its axiomatic triples
+AXIOMATIC = {OWL.Thing, RDFS.Resource, RDFS.Class, RDFS.Literal}
+
+
+def sample_import():
+    """
+    Triples of the sample ontology and a stub import with tags and lineage
+    """
+    dimd = Namespace('https://www.sap.com/products/data-intelligence#')
+    instance = Namespace('https://example.com/default/')
+    graph = Graph().parse(data=ONTOLOGY, format='turtle')
+    for dataset in stub_tenant.synthetic_datasets(3):
+        qualified_name = dataset['remoteObjectReference']['qualifiedName']
+        factsheet = stub_tenant.synthetic_factsheet(qualified_name, 3)
+        factsheet['tags'] = stub_tenant.synthetic_tags(qualified_name)
+        for triple in di_json2rdf.dataset_triples(factsheet, instance):
+            graph.add(triple)
+    graph.add((instance['TABLES%2FTABLE_0'], dimd.lineage, instance['TABLES%2FTABLE_1']))
+    return set(graph)
+
+
+def data_triples(triples):
+    """
+    :return: triples not about the RDF, RDFS, OWL or XSD vocabulary, literals or a resource being the same as itself
+    """
+    return {t for t in triples if not isinstance(t[0], Literal) and not str(t[0]).startswith(VOCABULARY)
+            and not (t[1] == OWL.sameAs and t[0] == t[2])}
+
+
+@pytest.mark.parametrize('profile, semantics', [(reasoner.RDFS_PROFILE, owlrl.RDFS_Semantics),
+                                                (reasoner.OWLRL_PROFILE, owlrl.RDFS_OWLRL_Semantics)])
+@pytest.mark.parametrize('source', ['sample', 'data/dimd.ttl'])
+def test_closure_agrees_with_owlrl(profile, semantics, source):
+    if source == 'sample':
+        asserted = sample_import()
+    elif os.path.isfile(source):
+        asserted = set(Graph().parse(source, format='turtle'))
+    else:
+        pytest.skip(f"{source} not found")
+    ours = data_triples(closed_graph(asserted, profile)[0])
+    graph = Graph()
+    for triple in asserted:
+        graph.add(triple)
+    owlrl.DeductiveClosure(semantics).expand(graph)
+    theirs = data_triples(graph)
+    # owlrl omits rdfs4a/b for RDFS, all other triples agree up to the omitted rules (see reasoner.OWLRL_RULES)
+    assert {t for t in ours - theirs if t[1:] != (RDF.type, RDFS.Resource)} == set()
+    assert {t for t in theirs - ours if t[2] not in AXIOMATIC} == set()
@@ -0,0 +1,65 @@
+import thhsparql
+from conftest import import_container
+from utils import cache
+
+SELECT = 'SELECT ?table WHERE { ?table a <https://www.sap.com/products/data-intelligence#Table> }'
+
+
+def run(client, user_id, statement, inferred=True):
+    """
+    Runs a query with the Run button: response, job
+    """
+    data = {'submit_run': 'Run', 'textarea_cmd': statement, 'selected_query': 'Last Query'}
+    if inferred:
+        data['check_inferred'] = 'y'
+    response = client.post('/', data=data)
+    job = thhsparql.job_manager.user_jobs(user_id)[-1]
+    if job.future:
+        job.future.result()
+    return response, job
+
+
+def test_normalize_query_keeps_literals_and_iris():
+    assert thhsparql.normalize_query(' SELECT  ?s\n WHERE {\t?s ?p  "a  b" }  ') == 'SELECT ?s WHERE { ?s ?p "a  b" }'
+    assert thhsparql.normalize_query("SELECT * { ?s ?p 'x\\'  y' }") == "SELECT * { ?s ?p 'x\\'  y' }"
+    assert thhsparql.normalize_query('SELECT * { <urn:a> ?p ?o }') == 'SELECT * { <urn:a> ?p ?o }'
+
+
+def test_lru_cache_is_bounded_by_size():
+    lru = cache.LRUCache(maxsize=10, sizeof=len)
+    lru.set('a', 'xxxx')
+    lru.set('b', 'xxxx')
+    assert lru.get('a') == 'xxxx'
+    lru.set('c', 'xxxx')
+    # b is the least recently used entry
+    assert 'b' not in lru and 'a' in lru and lru.size == 8
+    lru.set('d', 'x' * 11)
+    assert 'd' not in lru
+    assert lru.stats()['hits'] == 1
+
+
+def test_select_results_are_cached_per_version(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+    thhsparql.configs[user_id]['stored_queries'] = {'Last Query': SELECT}
+
+    response, job = run(client, user_id, SELECT)
+    assert job.status == 'done' and not job.params.get('cached')
+    assert len(job.result[1]) == 5
+
+    # same query with other whitespace: served from the cache
+    response, cached = run(client, user_id, SELECT.replace(' ', '  '))
+    assert response.status_code == 302 and cached.params.get('cached')
+    assert cached.result == job.result
+
+    # the inferred triples are part of the key
+    response, job = run(client, user_id, SELECT, inferred=False)
+    assert not job.params.get('cached')
+
+    # a change of the graph drops the cached results
+    version = thhsparql.configs[user_id]['version']
+    run(client, user_id, 'INSERT DATA { <urn:t> a <https://www.sap.com/products/data-intelligence#Table> }')
+    assert thhsparql.configs[user_id]['version'] > version
+    assert len(thhsparql.configs[user_id]['results']) == 0
+    response, job = run(client, user_id, SELECT)
+    assert not job.params.get('cached') and len(job.result[1]) == 6
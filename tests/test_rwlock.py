@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from utils.rwlock import RWLock
+
+
+def run(func):
+    """
+    Runs func in a thread: thread, event set when func has returned
+    """
+    done = threading.Event()
+
+    def target():
+        func()
+        done.set()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread, done
+
+
+def test_readers_share_the_lock_and_a_writer_waits_for_them():
+    lock = RWLock()
+    inside = threading.Barrier(3, timeout=5)
+    release = threading.Event()
+
+    def reader():
+        with lock.read():
+            inside.wait()
+            release.wait(5)
+
+    def writer():
+        with lock.write():
+            pass
+
+    readers = [run(reader) for _ in range(2)]
+    inside.wait()
+    writer_thread, written = run(writer)
+    assert not written.wait(0.1)
+    release.set()
+    assert written.wait(5)
+    assert all(done.wait(5) for thread, done in readers)
+
+
+def test_waiting_writer_goes_before_new_readers():
+    lock = RWLock()
+    order = list()
+    reading = threading.Event()
+    release = threading.Event()
+
+    def first_reader():
+        with lock.read():
+            reading.set()
+            release.wait(5)
+
+    def writer():
+        with lock.write():
+            order.append('writer')
+
+    def second_reader():
+        with lock.read():
+            order.append('reader')
+
+    run(first_reader)
+    reading.wait(5)
+    writer_thread, written = run(writer)
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+    reader_thread, read = run(second_reader)
+    assert not read.wait(0.1)
+    release.set()
+    assert written.wait(5) and read.wait(5)
+    assert order == ['writer', 'reader']
+
+
+def test_locks_are_reentrant_and_not_upgraded():
+    lock = RWLock()
+    with lock.write():
+        with lock.write() as locked:
+            assert locked
+        with lock.read():
+            pass
+    with lock.read():
+        with lock.read():
+            pass
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+        # other threads cannot write while a thread reads
+        results = list()
+        thread, done = run(lambda: results.append(lock.acquire_write(blocking=False)))
+        assert done.wait(5) and results == [False]
+    assert lock.acquire_write(blocking=False)
+    lock.release_write()
@@ -0,0 +1,36 @@
+from rdflib import BNode, ConjunctiveGraph, Graph, Literal, Namespace, URIRef
+from rdflib.namespace import XSD
+
+from utils import snapshot
+
+EX = Namespace('urn:example:')
+
+
+def test_round_trip_with_named_graphs(tmp_path):
+    filename = str(tmp_path / 'repo.snap')
+    graph = ConjunctiveGraph()
+    graph.bind('ex', EX)
+    blank = BNode()
+    graph.add((EX.a, EX.label, Literal('Haus', lang='de')))
+    graph.add((EX.a, EX.size, Literal(42, datatype=XSD.integer)))
+    graph.add((EX.a, EX.part, blank))
+    named = graph.get_context(URIRef('urn:example:graph'))
+    named.add((blank, EX.label, Literal('part')))
+    named.add((EX.a, EX.label, Literal('Haus', lang='de')))
+
+    assert snapshot.save(graph, filename) == 5
+    loaded = ConjunctiveGraph()
+    assert snapshot.load(loaded, filename) == 5
+    assert set(loaded.quads()) == set(graph.quads())
+    assert ('ex', URIRef(EX)) in set(loaded.namespaces())
+
+
+def test_round_trip_of_graph(tmp_path):
+    filename = str(tmp_path / 'repo.snap')
+    graph = Graph()
+    for i in range(100):
+        graph.add((EX[f's{i % 7}'], EX.p, Literal(i)))
+    snapshot.save(graph, filename)
+    loaded = Graph()
+    snapshot.load(loaded, filename)
+    assert set(loaded) == set(graph)
@@ -0,0 +1,116 @@
+import csv
+import io
+import re
+
+import pytest
+from rdflib import Graph, URIRef
+
+import thhsparql
+from conftest import import_container
+
+TABLES = 'SELECT ?t ?label WHERE { ?t a <https://www.sap.com/products/data-intelligence#Table> ; rdfs:label ?label } ' \
+         'ORDER BY ?label'
+INSERT = 'INSERT DATA { <urn:example:a> <urn:example:p> <urn:example:b> }'
+ASK = 'ASK { <urn:example:a> <urn:example:p> <urn:example:b> }'
+
+
+@pytest.fixture
+def api(app_user):
+    """
+    Test client of a tool sending the api token of the user space: request function, session client, user id
+    """
+    client, user_id = app_user
+    import_container(user_id)
+    token = client.post('/token').get_json()['token']
+    tool = thhsparql.app.test_client()
+
+    def request(method='GET', headers=None, **kwargs):
+        headers = dict({'Authorization': f"Bearer {token}"}, **(headers or dict()))
+        response = tool.open('/sparql', method=method, headers=headers, **kwargs)
+        response.get_data()  # the stream ends with the request context
+        return response
+
+    yield request, client, user_id
+
+
+def ask(request, statement=ASK):
+    return request(query_string={'query': statement}).get_json()['boolean']
+
+
+def test_select_formats(api):
+    request, client, user_id = api
+    response = request(query_string={'query': TABLES})
+    assert response.mimetype == 'application/sparql-results+json'
+    bindings = response.get_json()['results']['bindings']
+    assert [b['label']['value'] for b in bindings] == [f"TABLE_{i}" for i in range(5)]
+
+    response = request(query_string={'query': TABLES}, headers={'Accept': 'text/csv'})
+    assert response.mimetype == 'text/csv'
+    assert len(list(csv.reader(io.StringIO(response.get_data(as_text=True))))) == 6
+
+    # POST as form and as body
+    assert request('POST', data={'query': TABLES}).get_json()['head']['vars'] == ['t', 'label']
+    response = request('POST', data=TABLES, content_type='application/sparql-query')
+    assert len(response.get_json()['results']['bindings']) == 5
+
+
+def test_ask_and_construct(api):
+    request, client, user_id = api
+    assert ask(request, 'ASK { ?t a <https://www.sap.com/products/data-intelligence#Dataset> }')
+    response = request(query_string={'query': 'ASK { ?t a <https://www.sap.com/products/data-intelligence#Dataset> }',
+                                     'inferred': 'false'})
+    assert response.get_json() == {'head': {}, 'boolean': False}
+
+    construct = 'CONSTRUCT { ?t <urn:example:label> ?label } WHERE { ?t rdfs:label ?label ; ' \
+                'a <https://www.sap.com/products/data-intelligence#Table> }'
+    response = request(query_string={'query': construct})
+    assert response.mimetype == 'text/turtle'
+    assert len(Graph().parse(data=response.get_data(as_text=True), format='turtle')) == 5
+    response = request(query_string={'query': construct}, headers={'Accept': 'application/n-triples'})
+    assert response.mimetype == 'application/n-triples'
+    assert len(response.get_data(as_text=True).splitlines()) == 5
+
+
+def test_update_with_api_token(api):
+    request, client, user_id = api
+    version = thhsparql.configs[user_id]['version']
+    assert request('POST', data={'update': INSERT}).status_code == 204
+    assert thhsparql.configs[user_id]['version'] > version
+    assert ask(request)
+    assert (URIRef('urn:example:a'), URIRef('urn:example:p'), URIRef('urn:example:b')) in \
+        thhsparql.configs[user_id]['graph']
+    assert request('POST', data=INSERT, content_type='application/sparql-update').status_code == 204
+
+
+def test_rejected_requests(api):
+    request, client, user_id = api
+    assert request().status_code == 400
+    assert request(query_string={'query': INSERT}).status_code == 400
+    assert request('POST', data={'update': TABLES}).status_code == 400
+    assert request(query_string={'query': TABLES, 'default-graph-uri': 'urn:example:g'}).status_code == 400
+    assert request(query_string={'query': 'SELECT ?s WHERE {'}).status_code == 400
+    assert request(headers={'Authorization': 'Bearer wrong'}, query_string={'query': TABLES}).status_code == 401
+
+    # a new token replaces the previous one
+    token = client.post('/token').get_json()['token']
+    assert request(query_string={'query': TABLES}).status_code == 401
+    assert request(headers={'Authorization': f"Bearer {token}"}, query_string={'query': TABLES}).status_code == 200
+
+
+def test_session_requests_need_csrf_token(api, monkeypatch):
+    request, client, user_id = api
+    monkeypatch.setitem(thhsparql.app.config, 'WTF_CSRF_ENABLED', True)
+    # a form of another site posted with the session cookie of the user
+    assert client.post('/sparql', data={'update': INSERT}).status_code == 400
+    assert client.post('/export', data={'query': TABLES}).status_code == 400
+    assert not ask(request)
+    # queries by GET and requests with the api token need no CSRF token
+    response = client.get('/sparql', query_string={'query': TABLES})
+    response.get_data()
+    assert response.status_code == 200
+    assert request('POST', data={'update': INSERT}).status_code == 204
+
+    csrf_token = re.search(r'name="csrf_token" value="([^"]+)"', client.get('/').get_data(as_text=True)).group(1)
+    response = client.post('/sparql', data={'update': INSERT.replace(':b', ':c')}, headers={'X-CSRFToken': csrf_token})
+    assert response.status_code == 204
+    assert ask(request, ASK.replace(':b', ':c'))
@@ -0,0 +1,72 @@
+import itertools
+
+import pytest
+from rdflib import ConjunctiveGraph, Literal, Namespace, URIRef
+
+from utils import sqlite_store
+
+EX = Namespace('urn:example:')
+NAMED = URIRef('urn:example:graph')
+
+
+@pytest.fixture
+def graphs(tmp_path, monkeypatch):
+    """
+    Graph in a SQLite store paging through a few triples at a time, and the same graph in memory
+    """
+    monkeypatch.setattr(sqlite_store, 'PAGE_SIZE', 7)
+    graph = ConjunctiveGraph(store=sqlite_store.SQLiteStore())
+    graph.open(str(tmp_path / 'store'), create=True)
+    expected = ConjunctiveGraph()
+    for g in (graph, expected):
+        for i in range(60):
+            g.add((EX[f's{i % 5}'], EX[f'p{i % 3}'], Literal(i % 11)))
+        for i in range(20):
+            g.get_context(NAMED).add((EX[f's{i % 5}'], EX[f'p{i % 3}'], Literal(i % 11)))
+            g.get_context(NAMED).add((EX[f's{i}'], EX.q, EX[f's{i + 1}']))
+    graph.commit()
+    yield graph, expected
+    graph.close()
+
+
+def quads(graph):
+    default = graph.default_context.identifier
+    return sorted((s, p, o, None if c.identifier == default else c.identifier) for s, p, o, c in graph.quads())
+
+
+def patterns():
+    terms = {'s': [None, EX.s1], 'p': [None, EX.p2], 'o': [None, Literal(4)]}
+    return list(itertools.product(terms['s'], terms['p'], terms['o']))
+
+
+@pytest.mark.parametrize('pattern', patterns())
+def test_pages_of_union(graphs, pattern):
+    graph, expected = graphs
+    assert sorted(graph.triples(pattern)) == sorted(expected.triples(pattern))
+
+
+@pytest.mark.parametrize('pattern', patterns())
+def test_pages_of_named_graph(graphs, pattern):
+    graph, expected = graphs
+    assert sorted(graph.get_context(NAMED).triples(pattern)) == \
+        sorted(expected.get_context(NAMED).triples(pattern))
+
+
+def test_graphs_of_triples_and_length(graphs):
+    graph, expected = graphs
+    assert len(graph) == len(expected)
+    assert len(graph.get_context(NAMED)) == len(expected.get_context(NAMED))
+    assert quads(graph) == quads(expected)
+
+
+def test_remove_and_reopen(graphs, tmp_path):
+    graph, expected = graphs
+    for g in (graph, expected):
+        g.remove((EX.s1, None, None))
+    graph.commit()
+    graph.close()
+    reopened = ConjunctiveGraph(store=sqlite_store.SQLiteStore())
+    reopened.open(str(tmp_path / 'store'), create=False)
+    assert len(quads(reopened)) == len(quads(expected))
+    assert sorted(reopened.triples((None, None, None))) == sorted(expected.triples((None, None, None)))
+    reopened.close()
@@ -0,0 +1,62 @@
+import json
+import os
+
+from rdflib import Graph, Namespace
+
+import thhsparql
+from conftest import import_container
+from utils import di_json2rdf, stub_tenant, ttl2csn
+
+INSTANCE = Namespace('https://example.com/default/')
+PREFIXES = 'PREFIX dimd: <https://www.sap.com/products/data-intelligence#> ' \
+           'PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#> '
+DEFAULT_QUERIES = {
+    'GET_TABLES': PREFIXES + 'SELECT ?url ?label ?comment WHERE { ?url a dimd:Table . ?url rdfs:label ?label . '
+                             '?url rdfs:comment ?comment . }',
+    'GET_TABLE_COLUMNS': PREFIXES + 'SELECT ?url ?label ?comment WHERE { <TABLE> dimd:column ?url . '
+                                    '?url rdfs:label ?label . ?url rdfs:comment ?comment . }',
+    'GET_COLUMN_ATTRIBUTES': 'SELECT ?pred ?obj WHERE { <COLUMN> ?pred ?obj . }'}
+
+
+def write_queries(filename, queries):
+    with open(filename, 'w') as fp:
+        fp.write('#name,query\n')
+        for name, statement in queries.items():
+            fp.write(f'{name},"{statement}"\n')
+
+
+def catalog_graph(num_datasets=4, num_columns=3):
+    g = Graph()
+    for ds in stub_tenant.synthetic_datasets(num_datasets):
+        qualified_name = ds['remoteObjectReference']['qualifiedName']
+        dataset = stub_tenant.synthetic_factsheet(qualified_name, num_columns)
+        dataset['tags'] = stub_tenant.synthetic_tags(qualified_name)
+        for triple in di_json2rdf.dataset_triples(dataset, INSTANCE):
+            g.add(triple)
+    return g
+
+
+def test_graph_export_equals_default_queries(tmp_path):
+    write_queries(tmp_path / 'queries.csv', DEFAULT_QUERIES)
+    g = catalog_graph()
+    csn_json = ttl2csn.ttl2json(g, None, 'model')
+    assert csn_json == ttl2csn.ttl2json(g, str(tmp_path / 'queries.csv'), 'model')
+    definitions = json.loads(csn_json)['definitions']
+    assert sorted(definitions) == [f"TABLE_{i}" for i in range(4)]
+    # the alternative label of a column is a label of its own
+    assert sorted(definitions['TABLE_0']['elements']) == ['COLUMN_0', 'COLUMN_1', 'COLUMN_2', 'ID']
+
+
+def test_csn_button_uses_queries_of_user(app_user):
+    client, user_id = app_user
+    import_container(user_id)
+    thhsparql.configs[user_id]['stored_queries'] = {'Last Query': 'SELECT ?s WHERE { ?s ?p ?o }'}
+    data = {'submit_csn_json': 'To CSN/JSON', 'selected_query': 'Last Query'}
+    definitions = json.loads(client.post('/', data=data).get_data(as_text=True))['definitions']
+    assert len(definitions) == 5
+
+    queries = dict(DEFAULT_QUERIES, GET_TABLES=DEFAULT_QUERIES['GET_TABLES'].replace(
+        '. }', '. FILTER(?label = \'TABLE_1\') }'))
+    write_queries(os.path.join(thhsparql.USERS_SPACE, user_id, thhsparql.QUERY_CSN_JSON_FILE), queries)
+    definitions = json.loads(client.post('/', data=data).get_data(as_text=True))['definitions']
+    assert list(definitions) == ['TABLE_1']
@@ -0,0 +1,59 @@
+import os
+
+import yaml
+
+import thhsparql
+from utils import cache
+
+USER_ID = 'stub-user'
+
+
+def test_ttl_cache_keeps_negative_results_shorter():
+    verified = cache.TTLCache(ttl=60, negative_ttl=0)
+    verified.set('a', True)
+    verified.set('b', False)
+    assert verified.get('a') is True
+    assert verified.get('b') is None
+    verified.invalidate('a')
+    assert 'a' not in verified
+
+
+def test_verify_is_cached_until_config_is_saved(tenant, tmp_path, monkeypatch):
+    server, url = tenant
+    monkeypatch.setattr(thhsparql, 'USERS_SPACE', str(tmp_path))
+    (tmp_path / USER_ID).mkdir()
+    monkeypatch.setitem(thhsparql.configs, USER_ID, {'host': url, 'tenant': 'default', 'user': 'user',
+                                                     'password': 'password', 'imports': [], 'store': 'Memory',
+                                                     'api_token': None, 'reasoning': 'RDFS', 'files': dict()})
+    thhsparql.verified_users.invalidate(USER_ID)
+    user = thhsparql.User(USER_ID)
+
+    assert user.verify()
+    requests = server.requests
+    assert user.verify()
+    assert server.requests == requests
+
+    # changed credentials are checked again
+    thhsparql.configs[USER_ID]['password'] = 'wrong'
+    thhsparql.save_user_config(USER_ID)
+    assert not user.verify()
+    assert server.requests == requests + 1
+    thhsparql.verified_users.invalidate(USER_ID)
+
+
+def test_verify_is_repeated_when_another_process_saves_the_config(app_user, tenant):
+    client, user_id = app_user
+    server, url = tenant
+    user = thhsparql.User(user_id)
+    assert user.verify()
+    requests = server.requests
+
+    config_file = os.path.join(thhsparql.USERS_SPACE, user_id, 'config.yaml')
+    with open(config_file) as fp:
+        config = yaml.safe_load(fp)
+    config['password'] = 'wrong'
+    with open(config_file, 'w') as fp:
+        yaml.dump(config, fp)
+    thhsparql.sync_user_space(user_id)
+    assert not user.verify()
+    assert server.requests == requests + 1
@@ -6,14 +6,23 @@ import re
 import io
 import zipfile
 import json
-from urllib.parse import urljoin, unquote
+import time
+import hashlib
+import secrets
+import shutil
+import functools
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urljoin, unquote, urlparse
 import requests
 
 import pyparsing
-from datetime import datetime
 
-from flask import Flask, render_template, send_file, redirect, url_for, flash
-from flask_login import login_user, LoginManager, UserMixin, login_required, current_user
+from flask import Flask, render_template, send_file, redirect, url_for, flash, jsonify, abort, request, Response, \
+    stream_with_context
+from flask_login import login_user, logout_user, LoginManager, UserMixin, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
@@ -22,26 +31,49 @@ from wtforms import SubmitField, TextAreaField, StringField, SelectField, Boolea
 from flask_wtf.file import FileField, FileAllowed
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from rdflib import Graph, Namespace
+from rdflib import Namespace
 from rdflib.namespace import RDF, RDFS, XSD, OWL
-from owlrl import RDFS_Semantics, DeductiveClosure, OWLRL_Semantics
 import yaml
 
-from utils import export_catalog, ttl2csn, di_json2rdf, history
+from utils import catalog_sync, ttl2csn, history, cache, query_cache, graph_store, jobs, result_export, reasoner
 
 # STATIC Variables
 MAX_HISTORY = 100
-REPO = 'repo.ttl'
 STORED_QUERY_FILE = 'query.json'
-QUERY_HISTORY_FILE = 'query_history.json'
-IMPORT_HISTORY_FILE = 'import_history.json'
-QUERY_CSN_JSON_FILE = 'ttl2csn_queries.csv'
+QUERY_HISTORY_FILE = 'query_history.jsonl'
+IMPORT_HISTORY_FILE = 'import_history.jsonl'
+QUERY_CSN_JSON_FILE = 'ttl2csn_queries.csv'  # custom queries of a user space for the CSN export
 EXPORTED_CATALOG = 'data/catalog.json'
 UPLOAD_FOLDER = 'data/uploads'
 DIMD = 'data/dimd.ttl'
 MD_API = '/app/datahub-app-metadata/api/v1'
 MD_API_RUNTIME = '/app/datahub-app-metadata/api/v1/version'
 USERS_SPACE = 'data/users'
+JOB_FOLDER = 'data/jobs'  # job records shared by the worker processes (only used with several of them)
+CONFIG_KEYS = ['host', 'tenant', 'user', 'password', 'imports', 'store', 'api_token', 'reasoning']
+GRAPH_STORE = graph_store.MEMORY  # default store of new user spaces: 'Memory', 'SQLite' or 'BerkeleyDB'
+INFERRED_FOLDER = 'inferred'  # folder of the inferred triples of older versions (moved into the inferred graph)
+REASONING = reasoner.RDFS_PROFILE  # closure maintained in new user spaces (the Reasoning button switches to OWL-RL)
+VERIFY_TTL = 300  # seconds a successful DI authentication check is reused
+VERIFY_NEGATIVE_TTL = 30  # seconds a failed DI authentication check is reused
+RESULT_CACHE_SIZE = 16 * 1024 * 1024  # bytes of cached SELECT results per user
+GRAPH_MEMORY_SHARE = 0.5  # part of the memory limit of the instance (MEMORY_LIMIT) for user graphs
+GRAPH_MEMORY_TOTAL = 256 * 1024 * 1024  # bytes for user graphs if the instance has no MEMORY_LIMIT
+WEB_WORKERS = 1  # worker processes sharing the instance unless WEB_CONCURRENCY is set (see Procfile)
+LOADER_WORKERS = 2  # user graphs loaded in parallel in the background after login
+TERM_OVERHEAD = 80  # estimated bytes of a term object besides its string
+ROW_OVERHEAD = 64  # estimated bytes of a result row
+JOB_WORKERS = 4  # queries run in parallel
+MAX_JOBS_PER_USER = 2  # queued or running queries of a user
+PROGRESS_ROWS = 1000  # result rows between progress updates of a query job
+RESULT_PAGE_SIZE = 100  # rows of a result page
+STREAM_POLL = 0.05  # seconds between checks for new rows of a streamed query job
+EXPORT_FORMAT = 'csv'  # result format of /export if neither format nor Accept header selects one
+SPARQL_RESULT_FORMAT = 'json'  # result format of /sparql for SELECT queries if the Accept header selects none
+SPARQL_GRAPH_FORMAT = 'turtle'  # result format of /sparql for CONSTRUCT and DESCRIBE queries
+API_ENDPOINTS = ['sparql', 'export', 'memory']  # endpoints answering 401 instead of redirecting to the login page
+TOKEN_ENDPOINTS = ['sparql', 'export']  # endpoints without CSRF check for requests with an api token
+JOB_LABELS = {'query': 'Query', 'update': 'Insert', 'import': 'Import', 'reasoning': 'Reasoning', 'drop': 'Drop'}
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -59,10 +91,25 @@ app = Flask(__name__)
 csrf = CSRFProtect(app)
 app.config['SECRET_KEY'] = "mySec_Key_be_rational"
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # session cookie not sent with forms posted by other sites
 bootstrap = Bootstrap(app)
 moment = Moment(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
+verified_users = cache.TTLCache(ttl=VERIFY_TTL, negative_ttl=VERIFY_NEGATIVE_TTL)
+
+
+def web_workers():
+    """
+    :return: number of worker processes of the deployment (WEB_CONCURRENCY, see Procfile)
+    """
+    return max(1, int(os.environ.get('WEB_CONCURRENCY', WEB_WORKERS)))
+
+
+job_manager = jobs.JobManager(max_workers=JOB_WORKERS, max_jobs_per_user=MAX_JOBS_PER_USER,
+                              folder=JOB_FOLDER if web_workers() > 1 else None)
+api_tokens = dict()  # sha256 of api token -> user id
+graph_loader = ThreadPoolExecutor(max_workers=LOADER_WORKERS, thread_name_prefix='load')
 
 
 # LOGIN
@@ -71,17 +118,23 @@ class User(UserMixin):
         self.id = user_id
 
     def verify(self):
-        if self.id in configs:
-            r = requests.get(urljoin(configs[self.id]['host'], MD_API_RUNTIME),
-                             headers={'X-Requested-With': 'XMLHttpRequest'},
-                             auth=(configs[self.id]['tenant']+'\\'+configs[self.id]['user'],
-                                   configs[self.id]['password']))
-            if r.status_code != 200:
-                return True
-            else:
-                return False
-        else:
+        if self.id not in configs:
             return False
+        verified = verified_users.get(self.id)
+        if verified is None:
+            try:
+                r = requests.get(urljoin(configs[self.id]['host'], MD_API_RUNTIME),
+                                 headers={'X-Requested-With': 'XMLHttpRequest'},
+                                 auth=(configs[self.id]['tenant']+'\\'+configs[self.id]['user'],
+                                       configs[self.id]['password']),
+                                 timeout=10)
+                verified = r.status_code == 200
+            except requests.exceptions.RequestException as e:
+                logging.error(f"DI authentication check failed: {e}")
+                verified = False
+            verified_users.set(self.id, verified)
+            logging.info(f"DI authentication check for {self.id}: {verified}")
+        return verified
 
     def get_id(self):
         return self.id
@@ -89,23 +142,155 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
+    """
+    Loads the user of a session. The user space is brought up to date with the changes of the other worker
+    processes, or opened from its saved config if the user has logged in with another worker process.
+    """
+    if user_id in configs:
+        sync_user_space(user_id)
+    elif path.isfile(path.join(USERS_SPACE, user_id, 'config.yaml')):
+        restore_user_space(user_id)
     user = User(user_id)
     if user.verify():
         return user
     else:
-        None
+        return None
+
+
+@login_manager.request_loader
+def load_user_from_token(req):
+    """
+    Authenticates requests of tools by the api token of a user: 'Authorization: Bearer <token>'. The user space is
+    opened from its saved config if the user has not logged in since the start of the server. Tokens created by
+    other worker processes are read from the saved configs.
+    """
+    auth = req.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    api_token = token_hash(auth[len('Bearer '):].strip())
+    if api_token not in api_tokens:
+        load_api_tokens()
+    user_id = api_tokens.get(api_token)
+    if user_id is None:
+        return None
+    user = load_user(user_id)
+    if user is None or configs[user_id]['api_token'] != api_token:
+        # replaced by a new token in another worker process
+        return None
+    return user
+
+
+@app.before_request
+def protect_token_endpoints():
+    """
+    The endpoints of TOKEN_ENDPOINTS are exempt from the CSRF check only for tools sending an api token (a form of
+    another site cannot send an Authorization header). Requests authenticated by the session cookie are checked.
+    """
+    if request.endpoint in TOKEN_ENDPOINTS and app.config['WTF_CSRF_ENABLED'] and \
+            not request.headers.get('Authorization', '').startswith('Bearer '):
+        csrf.protect()
 
 
 @login_manager.unauthorized_handler
 def unauthorized_callback():
+    if request.endpoint in API_ENDPOINTS or request.headers.get('Authorization'):
+        return Response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
     return redirect('/login')
 
 
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def load_api_tokens():
+    """
+    Reads the hashes of the api tokens of all user spaces
+    """
+    if not path.isdir(USERS_SPACE):
+        return
+    for user_id in os.listdir(USERS_SPACE):
+        configs_file = path.join(USERS_SPACE, user_id, 'config.yaml')
+        if path.isfile(configs_file):
+            with open(configs_file) as uc:
+                api_token = (yaml.safe_load(uc) or dict()).get('api_token')
+            if api_token:
+                api_tokens[api_token] = user_id
+
+
+load_api_tokens()
+
+
 # INIT
+def save_user_config(user_id):
+    """
+    Saves the persistent part of the user config. Invalidates the cached DI authentication check because
+    host or credentials might have changed.
+    :param user_id: user id
+    """
+    verified_users.invalidate(user_id)
+    config_file = path.join(USERS_SPACE, user_id, 'config.yaml')
+    # replaced at once, so other threads and processes never read a partly written config
+    with open(f"{config_file}.{os.getpid()}.{threading.get_ident()}.tmp", 'w') as uc:
+        yaml.dump({k: configs[user_id][k] for k in CONFIG_KEYS}, uc)
+    os.replace(uc.name, config_file)
+    file_changed(user_id, 'config.yaml')
+
+
+def save_stored_queries(user_id):
+    with open(path.join(USERS_SPACE, user_id, STORED_QUERY_FILE), 'w') as qr:
+        json.dump(configs[user_id]['stored_queries'], qr, indent=4)
+    file_changed(user_id, STORED_QUERY_FILE)
+
+
+def file_changed(user_id, filename):
+    """
+    True if a file of the user space has been written since the last call, e.g. by another worker process
+    """
+    stat = graph_store.file_stat(path.join(USERS_SPACE, user_id, filename))
+    changed = configs[user_id]['files'].get(filename) != stat
+    configs[user_id]['files'][filename] = stat
+    return changed
+
+
+def load_history(user_id, filename):
+    h_file = path.join(USERS_SPACE, user_id, filename)
+    legacy_file = path.splitext(h_file)[0] + '.json'
+    if not path.isfile(h_file) and path.isfile(legacy_file):
+        # history of older versions, read by History as well
+        os.replace(legacy_file, h_file)
+    return history.History(filename=h_file, max_index=MAX_HISTORY)
+
+
+def history_position(h):
+    """
+    Position in a history with the time of the current entry and the runtime of its query
+    """
+    entry = h.pointer_entry() or dict()
+    info = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time']))] if 'time' in entry else []
+    if 'runtime' in entry:
+        info.append(f"{entry['runtime']}s")
+    if 'rows' in entry:
+        info.append(f"{entry['rows']} rows")
+    return h.pointer_str() + (f" ({', '.join(info)})" if info else "")
+
+
+def load_stored_queries(user_id):
+    file_changed(user_id, STORED_QUERY_FILE)
+    sq_file = path.join(USERS_SPACE, user_id, STORED_QUERY_FILE)
+    if not path.isfile(sq_file):
+        return dict()
+    with open(sq_file, 'r') as fp:
+        return json.load(fp)
+
+
 def init_user_space(user, host, tenant, password):
     seps = re.match(r'.+vsystem\.ingress\.([\w-]+)\.([\w-]+).+', host)
-    user_id = seps.group(1) + '.' + seps.group(2) + '-' + tenant + '-' + user
+    if seps:
+        user_id = seps.group(1) + '.' + seps.group(2) + '-' + tenant + '-' + user
+    else:
+        user_id = re.sub(r'[^\w.-]', '_', urlparse(host).netloc) + '-' + tenant + '-' + user
     user_folder = path.join(USERS_SPACE, user_id)
+    os.makedirs(user_folder, exist_ok=True)
 
     configs_file = path.join(user_folder, 'config.yaml')
     if path.isfile(configs_file):
@@ -113,41 +298,298 @@ def init_user_space(user, host, tenant, password):
             configs[user_id] = yaml.safe_load(uc)
     else:
         configs[user_id] = {'host': host, 'tenant': tenant, 'user': user, 'password': password, 'imports': []}
-        with open(configs_file, 'w') as uc:
-            yaml.dump(configs[user_id], uc)
+    configs[user_id].setdefault('store', GRAPH_STORE)
+    configs[user_id].setdefault('api_token', None)
+    configs[user_id].setdefault('reasoning', REASONING)
+    configs[user_id].update({'host': host, 'tenant': tenant, 'user': user, 'password': password})
+    configs[user_id]['files'] = dict()
+    configs[user_id]['load_lock'] = threading.Lock()
+    save_user_config(user_id)
+
+    configs[user_id]['version'] = 0
+    configs[user_id]['results'] = cache.LRUCache(maxsize=RESULT_CACHE_SIZE, sizeof=result_size)
+    configs[user_id]['graph'] = None
+    prefetch_user_graph(user_id)
+    configs[user_id]['history_import'] = load_history(user_id, IMPORT_HISTORY_FILE)
+    configs[user_id]['history_query'] = load_history(user_id, QUERY_HISTORY_FILE)
+    configs[user_id]['stored_queries'] = load_stored_queries(user_id)
+    return user_id
 
-    g = Graph()
+
+def open_user_graph(user_id):
+    """
+    Opens the graph of a user space (see graph_store.open_graph)
+    :param user_id: user id
+    :return: graph
+    """
+    user_folder = path.join(USERS_SPACE, user_id)
+    g = graph_store.open_graph(user_folder, configs[user_id]['store'], base_files=[DIMD])
+    g, _ = graph_store.refresh_graph(g, user_folder)  # opened before by this process
     g.bind("dimd", dimd)
     g.bind("xsd", XSD)
     g.bind("rdf", RDF)
     g.bind("rdfs", RDFS)
     g.bind("owl", OWL)
-    g.parse(DIMD)
+    g.commit()
+    return g
 
-    configs[user_id]['graph'] = g
-    if path.isfile(path.join(user_folder, REPO)):
-        g.parse(path.join(user_folder, REPO))
 
-    i_file = path.join(user_folder, IMPORT_HISTORY_FILE)
-    if path.isfile(i_file):
-        configs[user_id]['history_import'] = history.History(filename=i_file)
-    else:
-        configs[user_id]['history_import'] = history.History()
+def user_graph(user_id):
+    """
+    Graph of a user space, loaded by its first use (or prefetched, see prefetch_user_graph) and again if it has been
+    unloaded while idle (see unload_idle_graphs). Within using_user_space it is not unloaded meanwhile.
+    :param user_id: user id
+    :return: graph
+    """
+    graph = configs[user_id]['graph']
+    if graph is not None:
+        return graph
+    with graph_store.pinned(path.join(USERS_SPACE, user_id)):
+        with configs[user_id]['load_lock']:
+            if configs[user_id]['graph'] is None:
+                start_time = time.perf_counter()
+                configs[user_id]['graph'] = open_user_graph(user_id)
+                migrate_inferred(user_id)
+                bump_version(user_id)
+                logging.info(f"Graph of {user_id} loaded in {time.perf_counter() - start_time:.2f}s")
+            graph = configs[user_id]['graph']
+        unload_idle_graphs()
+    return graph
 
-    q_file = path.join(user_folder, QUERY_HISTORY_FILE)
-    if path.isfile(q_file):
-        configs[user_id]['history_query'] = history.History(filename=q_file)
-    else:
-        configs[user_id]['history_query'] = history.History()
 
-    sq_file = path.join(user_folder, STORED_QUERY_FILE)
-    if path.isfile(sq_file):
-        with open(sq_file, 'r') as fp:
-            configs[user_id]['stored_queries'] = json.load(fp)
-    else:
-        configs[user_id]['stored_queries'] = dict()
+def prefetch_user_graph(user_id):
+    """
+    Loads the graph of a user space in the background, e.g. after login, so login does not wait for it. A request
+    needing the graph before it is loaded waits for it (see user_graph).
+    :param user_id: user id
+    """
+    def load():
+        try:
+            user_graph(user_id)
+        except Exception as e:
+            logging.error(f"Loading the graph of {user_id} failed: {e}")
+            raise
 
-    return user_id
+    configs[user_id]['loading'] = graph_loader.submit(load)
+
+
+def user_space_loading(user_id):
+    """
+    True while the graph of a user space is prefetched
+    """
+    return configs[user_id]['graph'] is None and not configs[user_id]['loading'].done()
+
+
+def unload_user_graph(user_folder):
+    """
+    Forgets the graph of a user space closed by graph_store.unload_idle, and the results cached for it
+    """
+    user_id = path.basename(user_folder)
+    if user_id in configs:
+        configs[user_id]['graph'] = None
+        configs[user_id]['results'].invalidate()
+
+
+def graph_memory_budget():
+    """
+    Estimated bytes of user graphs kept in memory by this worker process: its part of GRAPH_MEMORY_SHARE of the
+    memory limit of the instance (e.g. MEMORY_LIMIT=512M on Cloud Foundry) or of GRAPH_MEMORY_TOTAL
+    """
+    total = GRAPH_MEMORY_TOTAL
+    limit = re.fullmatch(r'(\d+)([KMG]?)B?', os.environ.get('MEMORY_LIMIT', '').strip().upper())
+    if limit:
+        total = int(GRAPH_MEMORY_SHARE * int(limit.group(1)) * 1024 ** ' KMG'.index(limit.group(2) or ' '))
+    return total // web_workers()
+
+
+GRAPH_MEMORY_BUDGET = graph_memory_budget()  # estimated bytes of user graphs kept in memory (idle ones are unloaded)
+
+
+def unload_idle_graphs():
+    """
+    Unloads the least recently used graphs of the user spaces that are not in use until the graphs kept in memory
+    fit into GRAPH_MEMORY_BUDGET. They are loaded again by their next use (see user_graph).
+    """
+    graph_store.unload_idle(GRAPH_MEMORY_BUDGET, unloaded=unload_user_graph)
+
+
+def sync_user_space(user_id, wait=False):
+    """
+    Catches up with the changes other worker processes have saved to a user space: the graph (see
+    graph_store.refresh_graph), the config, the histories and the stored queries are read again if they have changed
+    :param user_id: user id
+    :param wait: wait for the writers and readers of the graph (before a change)
+    """
+    with graph_store.pinned(path.join(USERS_SPACE, user_id)):
+        # an unloaded graph is up to date when it is loaded again
+        graph = configs[user_id]['graph']
+        if graph is not None:
+            graph, changed = graph_store.refresh_graph(graph, path.join(USERS_SPACE, user_id), wait)
+            if changed:
+                configs[user_id]['graph'] = graph
+                bump_version(user_id)
+    if file_changed(user_id, 'config.yaml'):
+        with open(path.join(USERS_SPACE, user_id, 'config.yaml')) as uc:
+            saved_config = yaml.safe_load(uc)
+        configs[user_id].update({k: saved_config[k] for k in CONFIG_KEYS if k in saved_config})
+        # host or credentials might have been changed by another process
+        verified_users.invalidate(user_id)
+    configs[user_id]['history_import'].refresh()
+    configs[user_id]['history_query'].refresh()
+    if file_changed(user_id, STORED_QUERY_FILE):
+        configs[user_id]['stored_queries'] = load_stored_queries(user_id)
+
+
+@contextmanager
+def using_user_space(user_id):
+    """
+    Context using the graph of a user space: it is loaded again if it has been unloaded, and it is not unloaded until
+    the context is left
+    :return: context yielding the graph of the user space
+    """
+    with graph_store.pinned(path.join(USERS_SPACE, user_id)):
+        yield user_graph(user_id)
+
+
+@contextmanager
+def writing_user_space(user_id):
+    """
+    Context of a writer of a user space: holds its write lock, so the other writers (threads and worker processes)
+    wait, and catches up with their changes first. The queries of this process go on; the graph is changed in
+    applying_change only, e.g. after an import has fetched its changes.
+    :return: context yielding the graph of the user space
+    """
+    with using_user_space(user_id), graph_store.write_lock(path.join(USERS_SPACE, user_id)):
+        sync_user_space(user_id, wait=True)
+        yield configs[user_id]['graph']
+    # the graph may have grown
+    unload_idle_graphs()
+
+
+@contextmanager
+def applying_change(user_id):
+    """
+    Context changing the graph of a user space within writing_user_space: waits until the running queries of this
+    process are done, new queries wait until the change is applied
+    :return: context yielding the graph of the user space
+    """
+    with graph_store.space_lock(path.join(USERS_SPACE, user_id)).write():
+        yield configs[user_id]['graph']
+
+
+@contextmanager
+def changing_user_space(user_id):
+    """
+    Context of a change of a user space: holds its write lock and excludes the queries for the whole change
+    :return: context yielding the graph of the user space
+    """
+    with writing_user_space(user_id), applying_change(user_id) as graph:
+        yield graph
+
+
+@contextmanager
+def reading_user_space(user_id):
+    """
+    Context of a query of the graph of a user space: queries run in parallel, a change waits until they are done,
+    so a query sees the graph either before or after a change
+    :return: context yielding the graph of the user space
+    """
+    with using_user_space(user_id), graph_store.space_lock(path.join(USERS_SPACE, user_id)).read():
+        yield configs[user_id]['graph']
+
+
+def reading_rows(user_id, run_query):
+    """
+    Rows of a SELECT query of a user space to be streamed. A thread evaluates the query within reading_user_space
+    and queues the rows, so the read lock is released as soon as the query is done, not when a (slow) client has
+    received the last row. Closing the generator of the rows (e.g. when the client disconnects) stops the query.
+    :param user_id: user id
+    :param run_query: function of the graph returning the result of the query
+    :return: variables, generator of rows
+    """
+    rows = queue.Queue()
+    stopped = threading.Event()
+    end = object()
+
+    def fetch():
+        try:
+            with reading_user_space(user_id) as graph:
+                results = run_query(graph)
+                rows.put(results.vars)
+                for row in results:
+                    if stopped.is_set():
+                        break
+                    rows.put(tuple(row))
+        except Exception as e:
+            rows.put(e)
+        finally:
+            rows.put(end)
+
+    def queued_rows():
+        try:
+            while True:
+                row = rows.get()
+                if row is end:
+                    return
+                if isinstance(row, Exception):
+                    raise row
+                yield row
+        finally:
+            stopped.set()
+
+    threading.Thread(target=fetch, name='rows', daemon=True).start()
+    variables = rows.get()
+    if isinstance(variables, Exception):
+        raise variables
+    return variables, queued_rows()
+
+
+def changes_user_space(func):
+    """
+    Decorator of a job function func(job, user_id, ...) changing a user space (see changing_user_space)
+    """
+    @functools.wraps(func)
+    def wrapper(job, user_id, *args, **kwargs):
+        with changing_user_space(user_id):
+            return func(job, user_id, *args, **kwargs)
+    return wrapper
+
+
+def migrate_inferred(user_id):
+    """
+    Moves the inferred triples kept in a separate graph by older versions from the default graph into the inferred
+    graph
+    :param user_id: user id
+    """
+    user_folder = path.join(USERS_SPACE, user_id)
+    inferred_folder = path.join(user_folder, INFERRED_FOLDER)
+    if not path.isdir(inferred_folder):
+        return
+    with graph_store.write_lock(user_folder), graph_store.space_lock(user_folder).write():
+        if not path.isdir(inferred_folder):
+            return
+        g = configs[user_id]['graph']
+        inferred = g.get_context(graph_store.INFERRED)
+        old_inferred = graph_store.open_graph(inferred_folder, configs[user_id]['store'])
+        triples = list(old_inferred.triples((None, None, None)))
+        graph_store.close_graph(inferred_folder, configs[user_id]['store'])
+        for triple in triples:
+            g.default_context.remove(triple)
+            inferred.add(triple)
+        graph_store.commit_graph(g, user_folder)
+        shutil.rmtree(inferred_folder)
+    logging.info(f"Moved {len(triples)} inferred triples of {user_id} into {graph_store.INFERRED}")
+
+
+def restore_user_space(user_id):
+    """
+    Opens the user space of a user that is not logged in with the credentials of its saved config
+    :param user_id: user id
+    """
+    with open(path.join(USERS_SPACE, user_id, 'config.yaml')) as uc:
+        user_config = yaml.safe_load(uc)
+    init_user_space(user=user_config['user'], host=user_config['host'], tenant=user_config['tenant'],
+                    password=user_config['password'])
 
 
 def parse_rdf_file(graph, file):
@@ -156,10 +598,294 @@ def parse_rdf_file(graph, file):
     file_extension = os.path.splitext(file.filename)[1].lower()
     logging.info(f'Add: {file.filename}')
     if file_extension == '.rdf':
-        graph.parse(file_path, format='xml')
+        graph_store.parse(graph, file_path, format='xml')
+    else:
+        graph_store.parse(graph, file_path)
+
+
+def bump_version(user_id):
+    """
+    Increments the version of the user graph after a change. Results cached for older versions are dropped.
+    :param user_id: user id
+    """
+    configs[user_id]['version'] += 1
+    configs[user_id]['results'].invalidate()
+
+
+def get_reasoner(user_id, graph=None, profile=None, job=None, cancellable=True):
+    """
+    Reasoner maintaining the closure of the graph of a user space in its inferred graph
+    :param user_id: user id
+    :param graph: graph (default: graph of user space)
+    :param profile: reasoning profile (default: profile of user space)
+    :param job: job showing the progress
+    :param cancellable: the job can be cancelled while reasoning
+    :return: reasoner
+    """
+    def progress(stats):
+        if cancellable:
+            job.check()
+        job.progress = f"Reasoning: {stats['processed']} triples processed, {stats['inferred']} inferred"
+
+    graph = configs[user_id]['graph'] if graph is None else graph
+    return reasoner.Reasoner(graph, graph.get_context(graph_store.INFERRED), profile or configs[user_id]['reasoning'],
+                             progress=progress if job else None)
+
+
+def close_new_graph(user_id, graph, job=None):
+    """
+    Materializes the closure of a new graph (see graph_store.new_graph) for a user space. The RDFS closure of the
+    shared ontology is inferred already, so with RDFS only the triples of the store are propagated.
+    :return: number of inferred triples
+    """
+    user_reasoner = get_reasoner(user_id, graph, job=job)
+    if configs[user_id]['reasoning'] == reasoner.RDFS_PROFILE:
+        return user_reasoner.closure(graph.stored_triples())
+    return user_reasoner.closure()
+
+
+def commit_user_graph(user_id):
+    """
+    Makes the changes of the graph of a user space durable
+    """
+    graph_store.commit_graph(configs[user_id]['graph'], path.join(USERS_SPACE, user_id))
+
+
+def replace_user_graph(user_id, graph):
+    """
+    Replaces the graph of a user space (see graph_store.replace_graph)
+    """
+    configs[user_id]['graph'] = graph_store.replace_graph(configs[user_id]['graph'], graph,
+                                                          path.join(USERS_SPACE, user_id))
+
+
+def update_user_graph(user_id, graph, statement):
+    """
+    Runs a SPARQL update and maintains the closure of the changed triples
+    :param user_id: user id
+    :param graph: graph of the user space or a wrapper of it (e.g. CancellableGraph)
+    :param statement: SPARQL update
+    """
+    recorder = reasoner.ChangeRecorder(graph)
+    try:
+        query_cache.update(recorder, statement)
+    finally:
+        user_reasoner = get_reasoner(user_id)
+        user_reasoner.remove(recorder.removed)
+        user_reasoner.add(recorder.added)
+        commit_user_graph(user_id)
+        bump_version(user_id)
+
+
+def normalize_query(statement):
+    """
+    Query text with whitespace outside of literals and IRIs collapsed, used as result cache key
+    """
+    return re.sub(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|<[^>\s]*>)|\s+',
+                  lambda m: m.group(1) or ' ', statement).strip()
+
+
+def result_size(result):
+    """
+    Estimated memory size of a cached query result in bytes
+    """
+    header, rows = result
+    return sum(sum(len(t) + TERM_OVERHEAD for t in row if t is not None) for row in rows) + len(rows) * ROW_OVERHEAD
+
+
+def format_row(graph, row, use_namespaces, unquote_url):
+    """
+    Converts a result row to the strings displayed in the result table
+    :param graph: graph (namespaces)
+    :param row: result row as tuple of terms
+    :param use_namespaces: use prefixes of graph
+    :param unquote_url: unquote urls
+    :return: list of strings
+    """
+    def to_str(term):
+        if term is None:
+            return ''
+        value = term.n3(graph.namespace_manager) if use_namespaces else term
+        return unquote(value) if unquote_url else value
+
+    return [to_str(t) for t in row]
+
+
+def format_results(graph, rows, use_namespaces, unquote_url):
+    return [format_row(graph, row, use_namespaces, unquote_url) for row in rows]
+
+
+# QUERY JOBS
+def run_select(job, user_id, statement, result_key, inferred=True):
+    """
+    Job function of a SELECT query. The rows fetched so far are the partial result of the job, the complete result
+    is cached. Results of a single variable are distinct and without unbound values.
+    :param inferred: query the inferred triples as well
+    :return: variable names, rows
+    """
+    with reading_user_space(user_id) as graph:
+        results = query_cache.query(jobs.CancellableGraph(graph, job, inferred), statement)
+        rows = list()
+        distinct = set() if len(results.vars) == 1 else None
+        job.partial = query_results = ([str(v) for v in results.vars], rows)
+        for row in results:
+            row = tuple(row)
+            if distinct is not None:
+                if row[0] is None or row in distinct:
+                    continue
+                distinct.add(row)
+            rows.append(row)
+            if len(rows) % PROGRESS_ROWS == 0:
+                job.check()
+                job.progress = f"{len(rows)} rows"
+    configs[user_id]['results'].set(result_key, query_results)
+    configs[user_id]['history_query'].update(statement, runtime=round(job.runtime(), 3), rows=len(rows))
+    return query_results
+
+
+@changes_user_space
+def run_update(job, user_id, statement):
+    """
+    Job function of an INSERT statement
+    """
+    update_user_graph(user_id, jobs.CancellableGraph(configs[user_id]['graph'], job), statement)
+    configs[user_id]['history_query'].update(statement, runtime=round(job.runtime(), 3))
+
+
+# IMPORT AND REASONING JOBS
+def run_import(job, user_id, import_new, host, tenant, user, password, connection_id, container,
+               refresh_annotations=False):
+    """
+    Job function of a catalog import into the named graph of the container. The queries go on while the catalog is
+    fetched: a new graph is built apart, the changes of an added import are staged (see reasoner.StagedChanges).
+    :param job: job
+    :param user_id: user id
+    :param import_new: replace the graph by the container (otherwise add it)
+    :param host: di system url
+    :param tenant: tenant
+    :param user: user
+    :param password: password
+    :param connection_id: connection id
+    :param container: container
+    :param refresh_annotations: check tags and lineage of unchanged datasets of an added import as well
+    :return: statistics of import or None if container has no datasets
+    """
+    with writing_user_space(user_id):
+        return import_catalog(job, user_id, import_new, host, tenant, user, password, connection_id, container,
+                              refresh_annotations)
+
+
+def import_catalog(job, user_id, import_new, host, tenant, user, password, connection_id, container,
+                   refresh_annotations=False):
+    """
+    Imports a catalog container holding the write lock of the user space (see run_import)
+    """
+    global instance
+    user_folder = path.join(USERS_SPACE, user_id)
+    import_name = connection_id + container
+    manifest_file = catalog_sync.manifest_file(user_folder, connection_id, container)
+    if import_new:
+        g = graph_store.new_graph(base_files=[DIMD])
+        sync_graph = g.get_context(graph_store.import_graph(import_name))
+        manifest = dict()
     else:
-        graph.parse(file)
-    graph.serialize(destination=REPO)
+        g = configs[user_id]['graph']
+        sync_graph = reasoner.StagedChanges(g.get_context(graph_store.import_graph(import_name)))
+        manifest = catalog_sync.load_manifest(manifest_file)
+
+    def progress(stats):
+        job.check()
+        job.progress = f"{stats['processed']}/{stats['fetched']} datasets fetched, {stats['changed']} new or changed"
+        if stats.get('triples_new'):
+            job.progress += f", {stats['triples_new']} new triples added"
+
+    instance = Namespace(host + '/' + tenant + '/')
+    try:
+        stats = catalog_sync.sync_catalog(sync_graph, host, tenant, MD_API, user, password, connection_id,
+                                          container, instance, manifest, progress=progress, deductive_closure=False,
+                                          refresh_annotations=refresh_annotations)
+    finally:
+        if not import_new:
+            # the changes fetched so far are applied with their closure and committed with the manifest, also if
+            # the import has been cancelled or has failed
+            with applying_change(user_id):
+                sync_graph.apply()
+                user_reasoner = get_reasoner(user_id)
+                user_reasoner.remove(sync_graph.removed)
+                user_reasoner.add(sync_graph.added)
+                if manifest and import_name not in configs[user_id]['imports']:
+                    configs[user_id]['imports'].append(import_name)
+                if manifest or path.isfile(manifest_file):
+                    catalog_sync.save_manifest(manifest_file, manifest)
+                commit_user_graph(user_id)
+                bump_version(user_id)
+            save_user_config(user_id)
+    if not stats:
+        logging.warning(f"No dataset found for {connection_id} - {container}")
+        return None
+    if import_new:
+        close_new_graph(user_id, g, job=job)
+        catalog_sync.clear_manifests(user_folder)
+        catalog_sync.save_manifest(manifest_file, manifest)
+        configs[user_id]['imports'] = [import_name]
+    configs[user_id]['history_import'].append(','.join([connection_id, container]))
+
+    configs[user_id]['host'] = host
+    configs[user_id]['tenant'] = tenant
+    configs[user_id]['user'] = user
+    configs[user_id]['password'] = password
+    if import_new:
+        with applying_change(user_id):
+            replace_user_graph(user_id, g)
+            commit_user_graph(user_id)
+            bump_version(user_id)
+    save_user_config(user_id)
+    return stats
+
+
+@changes_user_space
+def run_drop_import(job, user_id, import_name):
+    """
+    Job function dropping the named graph of an import. The inferred triples depending on it are retracted, the
+    other imports are not read again. Once the named graph is removed the job cannot be cancelled, so the closure
+    is consistent with the imports when the drop is committed.
+    :return: number of dropped triples, number of retracted inferred triples
+    """
+    g = configs[user_id]['graph']
+    context = g.get_context(graph_store.import_graph(import_name))
+    triples = list(context)
+    job.check()
+    try:
+        g.remove_context(context)
+        num_retracted = get_reasoner(user_id, job=job, cancellable=False).remove(triples)
+    finally:
+        configs[user_id]['imports'].remove(import_name)
+        manifest_file = catalog_sync.import_manifest_file(path.join(USERS_SPACE, user_id), import_name)
+        if path.isfile(manifest_file):
+            os.remove(manifest_file)
+        commit_user_graph(user_id)
+        bump_version(user_id)
+        save_user_config(user_id)
+    return len(triples), num_retracted
+
+
+@changes_user_space
+def run_reasoning(job, user_id):
+    """
+    Job function extending the closure of the graph to OWL-RL. From then on the OWL-RL closure is maintained with
+    each change, so the job only runs once per user space.
+    :return: number of triples of graph
+    """
+    if configs[user_id]['reasoning'] != reasoner.OWLRL_PROFILE:
+        logging.info(f"Start OWL-RL closure of {user_id}")
+        try:
+            get_reasoner(user_id, profile=reasoner.OWLRL_PROFILE, job=job).closure()
+            configs[user_id]['reasoning'] = reasoner.OWLRL_PROFILE
+            save_user_config(user_id)
+        finally:
+            commit_user_graph(user_id)
+            bump_version(user_id)
+    return len(configs[user_id]['graph'])
 
 
 class MainForm(FlaskForm):
@@ -174,6 +900,8 @@ class MainForm(FlaskForm):
     submit_import_forward = SubmitField('\u2192')
     submit_import_new = SubmitField("New")
     submit_import_add = SubmitField("Add")
+    check_annotations = BooleanField(label='Tags/Lineage: ', description="Check tags and lineage of unchanged datasets",
+                                     default=False)
     file_field_rdf = FileField('', validators=[FileAllowed(['ttl', 'turtle', 'rdf'], 'ttl-only')])
     submit_new = SubmitField('New')
     submit_add = SubmitField('Add')
@@ -191,6 +919,7 @@ class MainForm(FlaskForm):
     submit_reasoning = SubmitField('Reasoning')
     check_use_namespaces = BooleanField(label='Use Namespaces: ', description="Use Namespaces", default=True)
     check_unquote = BooleanField(label='Unquote URL: ', description="Unquote URL", default=True)
+    check_inferred = BooleanField(label='Inferred Triples: ', description="Query inferred triples", default=True)
 
 
 class LoginForm(FlaskForm):
@@ -202,6 +931,21 @@ class LoginForm(FlaskForm):
     submit_login = SubmitField("Login")
 
 
+def prefill_form(form, user_id):
+    """
+    Sets the connection fields of the main form to the values of the user config and import history
+    """
+    form.di_host.data = configs[user_id]['host']
+    form.di_user.data = configs[user_id]['user']
+    form.di_tenant.data = configs[user_id]['tenant']
+    form.di_pwd.data = configs[user_id]['password']
+    if configs[user_id]['history_import'].pointer_value():
+        form.di_connection.data, form.di_container.data = \
+            configs[user_id]['history_import'].pointer_value().split(',')
+    else:
+        form.di_connection.data, form.di_container.data = "", ""
+
+
 def delete_user_space(user_id):
     os.remove(path.join(USERS_SPACE, user_id))
     logging.info(f"User space deleted: {user_id}")
@@ -224,23 +968,24 @@ def login():
     return render_template('login.html', form=form)
 
 
+@app.route('/logout')
+@login_required
+def logout():
+    verified_users.invalidate(current_user.id)
+    logout_user()
+    return redirect(url_for('login'))
+
+
 @app.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
-    global instance
     ui = current_user.id
     g = configs[ui]['graph']
     form = MainForm()
     form.selected_query.choices = list(configs[ui]['stored_queries'].keys())
-    form.di_host.data = configs[ui]['host']
-    form.di_user.data = configs[ui]['user']
-    form.di_tenant.data = configs[ui]['tenant']
-    form.di_pwd.data = configs[ui]['password']
-    if configs[ui]['history_import'].pointer_value():
-        form.di_connection.data, form.di_container.data = configs[ui]['history_import'].pointer_value().split(',')
-    else:
-        form.di_connection.data, form.di_container.data = "", ""
-    status = ""
+    if not form.is_submitted():
+        prefill_form(form, ui)
+    status = "Loading repository ..." if user_space_loading(ui) else ""
     if form.validate_on_submit():
         # Buttons: ADD, NEW, SAVE IMPORT
         if form.submit_new.data or form.submit_add.data or form.submit_save.data or form.submit_download.data or \
@@ -251,60 +996,34 @@ def index():
                 logging.info(f"Back import history")
                 form.di_connection.data, form.di_container.data = configs[ui]['history_import'].back().split(',')
                 return render_template('main.html', form=form,
-                                       rdflist_header=['Imports'], rdflist_body=configs['imports'],
+                                       rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
                                        result_header=[], result_body=[],
                                        status=f"Forward in import history: {configs[ui]['history_import'].pointer_str()}")
             elif form.submit_import_forward.data:
                 logging.info(f"Forward import history")
                 form.di_connection.data, form.di_container.data = configs[ui]['history_import'].forward().split(',')
                 return render_template('main.html', form=form,
-                                       rdflist_header=['Imports'], rdflist_body=configs['imports'],
+                                       rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
                                        result_header=[], result_body=[],
                                         status=f"Forward in import history: {configs[ui]['history_import'].pointer_str()}")
 
             # Import Catalog Container
             elif form.submit_import_new.data or form.submit_import_add.data:
                 logging.info("Export Process started")
-                render_template('main.html', form=form,
-                                rdflist_header=['Imports'], rdflist_body=configs['imports'],
-                                result_header=[], result_body=[],
-                                status=f"Exporting catalog started ...")
-                catalog_data = export_catalog.export_catalog(form.di_host.data, form.di_tenant.data,
-                                                             MD_API,
-                                                             form.di_user.data, form.di_pwd.data,
-                                                             form.di_connection.data, form.di_container.data)
-                if len(catalog_data) == 0:
-                    logging.warning("No dataset found for {form.di_connection.data} - {form.di_container.data}")
-                    status = "No dataset found for {form.di_connection.data} - {form.di_container.data}"
+                import_name = form.di_connection.data + form.di_container.data
+                try:
+                    job = job_manager.submit(ui, 'import', import_name, run_import, ui,
+                                             bool(form.submit_import_new.data), form.di_host.data,
+                                             form.di_tenant.data, form.di_user.data, form.di_pwd.data,
+                                             form.di_connection.data, form.di_container.data,
+                                             bool(form.check_annotations.data), params={'import_name': import_name})
+                except jobs.JobLimitExceeded as le:
+                    status = str(le)
+                else:
                     return render_template('main.html', form=form,
                                            rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
-                                           result_header=[], result_body=[],
-                                           status=status)
-
-                configs[ui]['history_import'].forward(','.join([form.di_connection.data, form.di_container.data]))
-
-                configs[ui]['host'] = form.di_host.data
-                configs[ui]['tenant'] = form.di_tenant.data
-                configs[ui]['user'] = form.di_user.data
-                configs[ui]['password'] = form.di_pwd.data
-
-                base_url = configs[ui]['host'] + '/' + configs[ui]['tenant'] + '/'
-                instance = Namespace(base_url)
-                logging.info("RDF Conversion started")
-                g_new = di_json2rdf.to_rdf(catalog_data, instance)
-                if form.submit_import_new.data:
-                    g = Graph()
-                    g.parse(DIMD)
-                    g = g + g_new
-                    configs[ui]['imports'] = [form.di_connection.data + form.di_container.data]
-                    configs[ui]['graph'] = g
-                else:
-                    g = g + g_new
-                    configs[ui]['imports'].append(form.di_connection.data + form.di_container.data)
-                    configs[ui]['graph'] = g
-                with open(path.join(USERS_SPACE, ui, 'config.yaml'), 'w') as cf:
-                    yaml.dump(configs[ui], cf)
-                configs[ui]['graph'].serialize(destination=REPO)
+                                           result_header=[], result_body=[], job=job.to_dict(),
+                                           status=f"Import job {job.status}")
 
             elif form.submit_new.data:
                 if not form.file_field_rdf.data:
@@ -312,39 +1031,55 @@ def index():
                 else:
                     filename = form.file_field_rdf.data.filename
                     logging.info(f'New: {filename}')
-                    g = Graph()
-                    g.parse(DIMD)
+                    g = graph_store.new_graph(base_files=[DIMD])
                     g.bind("dimd", dimd)
-                    parse_rdf_file(g, form.file_field_rdf.data)
-                    configs['imports'] = [filename]
-                    configs[ui]['graph'] = g
-                    with open(path.join(USERS_SPACE, ui, 'config.yaml'), 'w') as cf:
-                        yaml.dump(configs[ui], cf)
+                    parse_rdf_file(g.get_context(graph_store.import_graph(filename)), form.file_field_rdf.data)
+                    close_new_graph(ui, g)
+                    with changing_user_space(ui):
+                        catalog_sync.clear_manifests(path.join(USERS_SPACE, ui))
+                        configs[ui]['imports'] = [filename]
+                        replace_user_graph(ui, g)
+                        bump_version(ui)
+                        save_user_config(ui)
                     status = f"New RDF graph: {filename}. Query history deleted. "
             elif form.submit_add.data:
                 if not form.file_field_rdf.data:
                     status = "Select file first!"
                 else:
                     filename = form.file_field_rdf.data.filename
-                    parse_rdf_file(g, form.file_field_rdf.data)
-                    configs[ui]['imports'].append(filename)
-                    with open(path.join(USERS_SPACE, ui, 'config.yaml'), 'w') as cf:
-                        yaml.dump(configs[ui], cf)
+                    with writing_user_space(ui) as g:
+                        recorder = reasoner.StagedChanges(g.get_context(graph_store.import_graph(filename)))
+                        parse_rdf_file(recorder, form.file_field_rdf.data)
+                        with applying_change(ui):
+                            recorder.apply()
+                            get_reasoner(ui).add(recorder.added)
+                            commit_user_graph(ui)
+                            bump_version(ui)
+                        if filename not in configs[ui]['imports']:
+                            configs[ui]['imports'].append(filename)
+                        save_user_config(ui)
                     status = f"Added RDF graph: {filename}"
             elif form.submit_save.data:
-                configs[ui]['graph'].serialize(destination=REPO)
+                # the graph is only read: the queries go on
+                with writing_user_space(ui) as g:
+                    graph_store.save_graph(g, path.join(USERS_SPACE, ui))
                 status = f"Saved graph to repo!"
             elif form.submit_download.data:
-                configs[ui]['graph'].serialize(destination=REPO)
+                with reading_user_space(ui) as g:
+                    repo_file = graph_store.export_graph(g, path.join(USERS_SPACE, ui))
                 logging.info(f"Downloaded graph")
                 graph_io = io.BytesIO()
                 with zipfile.ZipFile(graph_io, mode='w') as z:
-                    z.write(path.join(USERS_SPACE, ui, REPO))
+                    z.write(repo_file)
                 graph_io.seek(0)
                 return send_file(graph_io, as_attachment=True, download_name='repo.zip', mimetype='application/zip')
             elif form.submit_csn_json.data:
-                name = os.path.splitext(configs[ui]['imports'])[0]
-                csn_json = ttl2csn.ttl2json(configs[ui]['graph'], path.join(USERS_SPACE, ui, QUERY_CSN_JSON_FILE), name)
+                name = re.sub(r'[^\w.-]', '_', os.path.splitext(configs[ui]['imports'][-1])[0]) \
+                    if configs[ui]['imports'] else 'repo'
+                query_file = path.join(USERS_SPACE, ui, QUERY_CSN_JSON_FILE)
+                with reading_user_space(ui) as g:
+                    # the queries of the user if there are any, otherwise the one-pass export of the default queries
+                    csn_json = ttl2csn.ttl2json(g, query_file if path.isfile(query_file) else None, name)
                 filename = os.path.join(path.join(USERS_SPACE, ui, name + '_ER_Model.json'))
                 with open(filename, mode='w') as js:
                     js.write(csn_json)
@@ -368,7 +1103,7 @@ def index():
         return render_template('main.html', form=form,
                                rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
                                result_header=[], result_body=[],
-                               status=f"Back in query history: {configs[ui]['history_query'].pointer_str()}")
+                               status=f"Back in query history: {history_position(configs[ui]['history_query'])}")
     # forward query history
     elif form.submit_forward.data:
         logging.info(f"Forward query history")
@@ -376,7 +1111,7 @@ def index():
         return render_template('main.html', form=form,
                                rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
                                result_header=[], result_body=[],
-                               status=f"Forward in query history: {configs[ui]['history_query'].pointer_str()}")
+                               status=f"Forward in query history: {history_position(configs[ui]['history_query'])}")
     # Copy Query
     elif form.submit_use_query.data:
         logging.info(f"Copy query to SPARQL-field")
@@ -387,92 +1122,386 @@ def index():
                                status='Copied query')
     # Run Query
     elif form.submit_run.data:
-        logging.info(f'Query: {form.textarea_cmd.data}')
-        configs[ui]['history_query'].append(str(form.textarea_cmd.data))
+        statement = form.textarea_cmd.data
+        logging.info(f'Query: {statement}')
+        configs[ui]['history_query'].append(str(statement))
+        params = {'use_namespaces': form.check_use_namespaces.data, 'unquote': form.check_unquote.data,
+                  'inferred': form.check_inferred.data}
         try:
-            render_template('main.html', form=form,
-                            rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
-                            result_header=[], result_body=[],
-                            status='Query running...')
-            start_time = datetime.now()
-            statement = form.textarea_cmd.data
-            logging.info(f"Query: {statement}")
             if re.match(r'\s*INSERT\s+.+', statement):
-                query_results = configs[ui]['graph'].update(statement)
-                query_statement = False
+                query_cache.prepare(user_graph(ui), statement)
+                job = job_manager.submit(ui, 'update', statement, run_update, ui, statement, params=params)
             elif re.match(r'\s*SELECT\s+.+', statement):
-                query_results = configs[ui]['graph'].query(statement)
-                query_statement = True
+                result_key = (normalize_query(statement), configs[ui]['version'], form.check_inferred.data)
+                query_results = configs[ui]['results'].get(result_key)
+                if query_results is not None:
+                    job = job_manager.add_result(ui, 'query', statement, query_results,
+                                                 params=dict(params, cached=True))
+                    return redirect(url_for('job_result', job_id=job.id))
+                query_cache.prepare(user_graph(ui), statement)
+                job = job_manager.submit(ui, 'query', statement, run_select, ui, statement, result_key,
+                                         form.check_inferred.data, params=params)
             else:
                 logging.error(f'Unknown query? {statement}')
                 raise pyparsing.exceptions.ParseException(f'Unknown query (not implemented)?')
-            run_time = (datetime.now() - start_time).total_seconds()
+        except jobs.JobLimitExceeded as le:
+            status = str(le)
         except Exception as pe:
             logging.error(pe)
+            status = f"Parsing error: {pe}"
+        else:
             return render_template('main.html', form=form,
                                    rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
-                                   result_header=[], result_body=[],
-                                   status=f"Parsing error: {pe}")
-        else:
-            if query_statement:
-                if len(query_results.vars) > 1:
-                    if form.check_use_namespaces.data:
-                        if form.check_unquote.data:
-                            result_body = [
-                                [unquote(r[v].n3(configs[ui]['graphs'].namespace_manager)) for v in query_results.vars
-                                 if r[v]] for r in query_results]
-                        else:
-                            result_body = [
-                                [r[v].n3(configs[ui]['graphs'].namespace_manager) for v in query_results.vars
-                                 if r[v]] for r in query_results]
-
-                    else:
-                        if form.check_unquote.data:
-                            result_body = [[unquote(r[v]) for v in query_results.vars if r[v]] for r in query_results]
-                        else:
-                            result_body = [[r[v] for v in query_results.vars if r[v]] for r in query_results]
-                else:
-                    var = query_results.vars[0]
-                    if form.check_use_namespaces.data:
-                        if form.check_unquote.data:
-                            result_body = [[unquote(i)] for i in set([r[var].n3(configs[ui]['graphs'].namespace_manager)
-                                                                      for r in query_results])]
-                        else:
-                            result_body = [[i] for i in set([r[var].n3(configs[ui]['graphs'].namespace_manager)
-                                                             for r in query_results])]
-                    else:
-                        if form.check_unquote.data:
-                            result_body = [unquote(i) for i in set([r[var] for r in query_results])]
-                        else:
-                            result_body = [i for i in set([r[var] for r in query_results])]
-
-                return render_template('main.html', form=form,
-                                       rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
-                                       result_header=query_results.vars, result_body=result_body,
-                                       status=f'Query runtime: {run_time}')
-            else:
-                return render_template('main.html', form=form,
-                                       rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
-                                       result_header=[], result_body=[],
-                                       status=f'Insert runtime: {run_time}')
+                                   result_header=[], result_body=[], job=job.to_dict(),
+                                   status=f"Query job {job.status}")
+        return render_template('main.html', form=form,
+                               rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
+                               result_header=[], result_body=[],
+                               status=status)
 
     # Save Query
     elif form.submit_save_query.data:
         logging.info(f'Query saved: {form.textarea_cmd.data}')
-        configs[ui]['stored_queries'][form.save_text.data] = form.textarea_cmd.data
-        with open(path.join(USERS_SPACE, ui, STORED_QUERY_FILE, 'w')) as qr:
-            json.dump(configs[ui]['stored_queries'], qr, indent=4)
+        with writing_user_space(ui):
+            configs[ui]['stored_queries'][form.save_text.data] = form.textarea_cmd.data
+            save_stored_queries(ui)
 
     elif form.submit_reasoning.data:
-        logging.info(f'Start Deductive Closure ("RDFS_Semantics","OWLRL_Semantics")')
-        DeductiveClosure(RDFS_Semantics).expand(configs[ui]['graphs'])
-        DeductiveClosure(OWLRL_Semantics).expand(configs[ui]['graphs'])
+        try:
+            job = job_manager.submit(ui, 'reasoning', 'RDFS and OWL-RL closure', run_reasoning, ui)
+        except jobs.JobLimitExceeded as le:
+            status = str(le)
+        else:
+            return render_template('main.html', form=form,
+                                   rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
+                                   result_header=[], result_body=[], job=job.to_dict(),
+                                   status=f"Reasoning job {job.status}")
 
     return render_template('main.html', form=form,
                            rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
                            result_header=[], result_body=[],
+                           status=status, loading=user_space_loading(ui))
+
+
+@app.route('/space')
+@login_required
+def space_status():
+    """
+    State of the user space polled by the main page while its graph is loaded
+    """
+    ui = current_user.id
+    loading = configs[ui]['loading']
+    error = loading.exception() if loading.done() else None
+    return jsonify({'loading': user_space_loading(ui), 'loaded': configs[ui]['graph'] is not None,
+                    'error': str(error) if error else None})
+
+
+# IMPORTS
+@app.route('/imports/drop', methods=['POST'])
+@login_required
+def drop_import():
+    """
+    Drops the named graph of an import of the repository list in a background job (see run_drop_import)
+    """
+    ui = current_user.id
+    import_name = request.form.get('drop_import')
+    if import_name not in configs[ui]['imports']:
+        abort(404)
+    form = MainForm()
+    form.selected_query.choices = list(configs[ui]['stored_queries'].keys())
+    job = None
+    try:
+        job = job_manager.submit(ui, 'drop', import_name, run_drop_import, ui, import_name)
+    except jobs.JobLimitExceeded as le:
+        status = str(le)
+    else:
+        status = f"Drop job {job.status}"
+    return render_template('main.html', form=form,
+                           rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
+                           result_header=[], result_body=[], job=job.to_dict() if job else None,
                            status=status)
 
 
+# JOBS
+@app.route('/jobs')
+@login_required
+def list_jobs():
+    return jsonify([job.to_dict() for job in job_manager.user_jobs(current_user.id)])
+
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = job_manager.get(job_id, current_user.id)
+    if not job:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = job_manager.get(job_id, current_user.id)
+    if not job:
+        abort(404)
+    job_manager.cancel(job)
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/result')
+@login_required
+def job_result(job_id):
+    ui = current_user.id
+    job = job_manager.get(job_id, ui)
+    if not job:
+        abort(404)
+    form = MainForm()
+    form.selected_query.choices = list(configs[ui]['stored_queries'].keys())
+    prefill_form(form, ui)
+    if job.kind in ('query', 'update'):
+        form.textarea_cmd.data = job.description
+        form.check_use_namespaces.data = job.params.get('use_namespaces', True)
+        form.check_unquote.data = job.params.get('unquote', True)
+        form.check_inferred.data = job.params.get('inferred', True)
+    result_header, result_body, result_count, pages = [], [], None, None
+    cache_stats = query_cache.stats()
+    label = JOB_LABELS[job.kind]
+    if job.status == jobs.DONE and job.kind == 'query':
+        result_header, rows = job.result
+        result_count = len(rows)
+        pages = {'job_id': job.id, 'count': max(1, -(-result_count // RESULT_PAGE_SIZE))}
+        pages['page'] = min(max(1, request.args.get('page', 1, type=int)), pages['count'])
+        offset = (pages['page'] - 1) * RESULT_PAGE_SIZE
+        result_body = format_results(user_graph(ui), rows[offset:offset + RESULT_PAGE_SIZE],
+                                     form.check_use_namespaces.data, form.check_unquote.data)
+        if job.params.get('cached'):
+            status = f"Query runtime: {job.runtime()} (cached result)"
+        else:
+            status = f"Query runtime: {job.runtime()} (prepared queries: {cache_stats['hits']} hits, " \
+                     f"{cache_stats['misses']} misses)"
+    elif job.status == jobs.DONE and job.kind == 'update':
+        status = f"Insert runtime: {job.runtime()} (prepared queries: {cache_stats['hits']} hits, " \
+                 f"{cache_stats['misses']} misses)"
+    elif job.status == jobs.DONE and job.kind == 'import':
+        stats = job.result
+        status = f"Imported {job.description}: {stats['changed']} new or changed, {stats['deleted']} deleted " \
+                 f"of {stats['datasets']} datasets" if stats else f"No dataset found for {job.description}"
+    elif job.status == jobs.DONE and job.kind == 'drop':
+        status = f"Dropped {job.description}: {job.result[0]} triples, {job.result[1]} inferred triples retracted"
+    elif job.status == jobs.DONE:
+        status = f"Reasoning runtime: {job.runtime():.3f}s ({job.result} triples)"
+    elif job.status == jobs.FAILED:
+        status = f"{label} failed: {job.error}"
+    elif job.status == jobs.CANCELLED:
+        status = f"{label} cancelled after {job.runtime():.3f}s"
+    else:
+        status = f"{label} job {job.status}"
+    return render_template('main.html', form=form,
+                           rdflist_header=['Imports'], rdflist_body=configs[ui]['imports'],
+                           result_header=result_header, result_body=result_body, result_count=result_count,
+                           pages=pages, job=job.to_dict() if job.active() else None, status=status)
+
+
+@app.route('/jobs/<job_id>/stream')
+@login_required
+def job_stream(job_id):
+    """
+    Streams the rows of a query job as HTML table while they are fetched, so the first rows are shown as soon as
+    they are available whatever the size of the result
+    """
+    ui = current_user.id
+    job = job_manager.get(job_id, ui)
+    if not job or job.kind != 'query':
+        abort(404)
+    while not (job.result or job.partial) and job.active():
+        time.sleep(STREAM_POLL)
+    result_header, rows = job.result or job.partial or ([], [])
+    graph = user_graph(ui)
+
+    def result_body():
+        i = 0
+        while i < len(rows) or job.active():
+            if i < len(rows):
+                yield format_row(graph, rows[i], job.params.get('use_namespaces', True),
+                                 job.params.get('unquote', True))
+                i += 1
+            else:
+                time.sleep(STREAM_POLL)
+
+    context = {'description': job.description, 'result_header': result_header, 'result_body': result_body()}
+    app.update_template_context(context)
+    return Response(stream_with_context(app.jinja_env.get_template('results.html').generate(context)))
+
+
+# EXPORT
+@app.route('/export', methods=['GET', 'POST'])
+@csrf.exempt
+@login_required
+def export():
+    """
+    Runs a SELECT query and streams the result row by row as CSV, TSV, SPARQL JSON or NDJSON, gzip compressed if
+    the client accepts it. Parameters (query string or form):
+        query: SPARQL query, or
+        name: name of a stored query
+        format: csv, tsv, json or ndjson (default: Accept header or EXPORT_FORMAT)
+        inferred: false to leave out the inferred triples (default: true)
+    """
+    ui = current_user.id
+    statement = request.values.get('query')
+    name = request.values.get('name')
+    if not statement and name:
+        statement = configs[ui]['stored_queries'].get(name)
+        if statement is None:
+            abort(404, description=f"No stored query: {name}")
+    if not statement:
+        abort(400, description="Parameter 'query' or 'name' missing")
+    result_format = request.values.get('format') or \
+        result_export.negotiate(request.accept_mimetypes, result_export.FORMATS) or EXPORT_FORMAT
+    if result_format not in result_export.FORMATS:
+        abort(400, description=f"Unknown format: {result_format} (one of {', '.join(result_export.FORMATS)})")
+    if query_cache.is_update(statement):
+        abort(400, description="Only SELECT queries can be exported")
+    try:
+        query_type = query_cache.prepare(user_graph(ui), statement).algebra.name
+    except Exception as pe:
+        logging.error(pe)
+        abort(400, description=f"Parsing error: {pe}")
+    if query_type != 'SelectQuery':
+        abort(400, description="Only SELECT queries can be exported")
+    logging.info(f"Export ({result_format}): {statement}")
+    inferred = inferred_param()
+
+    variables, rows = reading_rows(ui, lambda graph: query_cache.query(graph_store.UnionView(graph, inferred),
+                                                                       statement))
+    mimetype, extension, _ = result_export.FORMATS[result_format]
+    return stream_response(result_export.serialize(result_format, variables, rows), mimetype,
+                           headers={'Content-Disposition': f"attachment; filename=results.{extension}"})
+
+
+def inferred_param():
+    """
+    Parameter 'inferred' of an api request: false, 0 or no leave out the inferred triples
+    """
+    return request.values.get('inferred', 'true').lower() not in ('false', '0', 'no')
+
+
+def stream_response(chunks, mimetype, headers=None):
+    """
+    Response streaming text chunks, gzip compressed if the client accepts it
+    """
+    chunks = result_export.buffered(chunks)
+    headers = dict(headers or dict(), Vary='Accept-Encoding')
+    if 'gzip' in request.accept_encodings:
+        chunks = result_export.gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+# SPARQL PROTOCOL
+def sparql_request():
+    """
+    Reads the operation of a SPARQL 1.1 Protocol request: query via GET, query or update via POST as url-encoded
+    form or directly as body (application/sparql-query, application/sparql-update)
+    :return: statement, True if it is an update
+    """
+    if request.args.get('default-graph-uri') or request.args.get('named-graph-uri') or \
+            request.values.get('using-graph-uri') or request.values.get('using-named-graph-uri'):
+        abort(400, description="Only the graph of the user space can be queried (no dataset parameters)")
+    if request.method == 'GET':
+        return request.args.get('query'), False
+    if request.mimetype == 'application/sparql-query':
+        return request.get_data(as_text=True), False
+    if request.mimetype == 'application/sparql-update':
+        return request.get_data(as_text=True), True
+    if request.form.get('update'):
+        return request.form['update'], True
+    return request.form.get('query'), False
+
+
+@app.route('/sparql', methods=['GET', 'POST'])
+@csrf.exempt
+@login_required
+def sparql():
+    """
+    SPARQL 1.1 Protocol endpoint on the graph of the user space. SELECT results are streamed as SPARQL JSON, CSV,
+    TSV or NDJSON, ASK results as SPARQL JSON, CONSTRUCT and DESCRIBE results as Turtle, N-Triples, RDF/XML or
+    JSON-LD, selected by the Accept header. Updates are committed like an Insert of the main page. Queries run on
+    the union of the named graphs of the user space, without the inferred triples if 'inferred' is false.
+    Tools authenticate with 'Authorization: Bearer <api token>' (see /token).
+    """
+    ui = current_user.id
+    statement, update = sparql_request()
+    if not statement:
+        abort(400, description="Parameter 'query' or 'update' missing")
+    if update != query_cache.is_update(statement):
+        abort(400, description="Update sent as query" if not update else "Query sent as update")
+
+    if update:
+        try:
+            with changing_user_space(ui) as graph:
+                update_user_graph(ui, graph, statement)
+        except Exception as pe:
+            logging.error(pe)
+            abort(400, description=f"Update failed: {pe}")
+        return Response(status=204)
+
+    try:
+        query_type = query_cache.prepare(user_graph(ui), statement).algebra.name
+    except Exception as pe:
+        logging.error(pe)
+        abort(400, description=f"Parsing error: {pe}")
+    inferred = inferred_param()
+
+    def run_query(graph):
+        return query_cache.query(graph_store.UnionView(graph, inferred), statement)
+
+    if query_type == 'SelectQuery':
+        result_format = result_export.negotiate(request.accept_mimetypes, result_export.FORMATS) or \
+            SPARQL_RESULT_FORMAT
+        variables, rows = reading_rows(ui, run_query)
+        return stream_response(result_export.serialize(result_format, variables, rows),
+                               result_export.FORMATS[result_format][0])
+    if query_type == 'AskQuery':
+        with reading_user_space(ui) as graph:
+            answer = run_query(graph).askAnswer
+        return stream_response(result_export.boolean_chunks(answer), result_export.FORMATS['json'][0])
+    result_format = result_export.negotiate(request.accept_mimetypes, result_export.GRAPH_FORMATS) or \
+        SPARQL_GRAPH_FORMAT
+    with reading_user_space(ui) as graph:
+        data = run_query(graph).serialize(format=result_format)
+    return Response(data, mimetype=result_export.GRAPH_FORMATS[result_format][0])
+
+
+@app.route('/token', methods=['POST'])
+@login_required
+def create_token():
+    """
+    Creates a new api token of the user replacing the previous one. Only its hash is saved, the token itself is
+    returned once.
+    """
+    ui = current_user.id
+    token = secrets.token_urlsafe(32)
+    with writing_user_space(ui):
+        api_tokens.pop(configs[ui]['api_token'], None)
+        configs[ui]['api_token'] = token_hash(token)
+        api_tokens[configs[ui]['api_token']] = ui
+        save_user_config(ui)
+    logging.info(f"New api token of {ui}")
+    return jsonify({'token': token, 'endpoint': url_for('sparql', _external=True)})
+
+
+@app.route('/memory')
+@login_required
+def memory():
+    """
+    Estimated memory of the user graphs loaded by this worker process: the graph of the user (0 if it is unloaded),
+    all graphs and the budget (see GRAPH_MEMORY_BUDGET)
+    """
+    sizes = graph_store.resident_sizes()
+    user_folder = path.abspath(path.join(USERS_SPACE, current_user.id))
+    return jsonify({'user': sizes.get(user_folder, 0), 'loaded': user_folder in sizes, 'graphs': len(sizes),
+                    'total': sum(sizes.values()), 'budget': GRAPH_MEMORY_BUDGET, 'pid': os.getpid()})
+
+
 if __name__ == '__main__':
     app.run('0.0.0.0', port=5000)
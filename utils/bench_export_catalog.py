@@ -0,0 +1,38 @@
+#
+#  Benchmark of the catalog export against the local stub tenant:
+#     python -m utils.bench_export_catalog --datasets 200 --latency 0.02
+#
+import argparse
+import logging
+import time
+
+from utils import export_catalog, stub_tenant
+
+
+def run(url, max_workers, container=stub_tenant.CONTAINER):
+    start_time = time.perf_counter()
+    datasets = export_catalog.export_catalog(url, 'default', stub_tenant.MD_API, 'user', 'password',
+                                             connection_id='STUB', container=container, max_workers=max_workers)
+    return time.perf_counter() - start_time, datasets
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(description='Benchmark catalog export')
+    parser.add_argument('--datasets', type=int, default=200, help='Number of datasets in container')
+    parser.add_argument('--latency', type=float, default=0.02, help='Delay of each response in seconds')
+    parser.add_argument('--throttle', type=int, default=0, help='Answer every n-th request with 429')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, export_catalog.MAX_WORKERS, 16])
+    args = parser.parse_args()
+
+    server, url = stub_tenant.start(num_datasets=args.datasets, latency=args.latency, throttle=args.throttle)
+    reference = None
+    for workers in args.workers:
+        server.requests = 0
+        run_time, datasets = run(url, workers)
+        names = [ds['metadata']['name'] for ds in datasets]
+        if reference is None:
+            reference = names
+        print(f"workers: {workers:3d}  datasets: {len(datasets):5d}  requests: {server.requests:6d}  "
+              f"time: {run_time:7.2f}s  same order: {names == reference}")
+    server.shutdown()
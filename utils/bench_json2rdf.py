@@ -0,0 +1,66 @@
+#
+#  Micro-benchmark of the catalog to RDF conversion over a synthetic catalog:
+#     python -m utils.bench_json2rdf --datasets 100 --columns 100
+#
+import argparse
+import gc
+import time
+
+from rdflib import Graph, Namespace
+
+from utils import di_json2rdf, stub_tenant
+
+
+def synthetic_catalog(num_datasets, num_columns):
+    catalog = list()
+    for ds in stub_tenant.synthetic_datasets(num_datasets):
+        qualified_name = ds['remoteObjectReference']['qualifiedName']
+        dataset = stub_tenant.synthetic_factsheet(qualified_name, num_columns)
+        dataset['tags'] = stub_tenant.synthetic_tags(qualified_name)
+        catalog.append(dataset)
+    return catalog
+
+
+def timed(func, repeat):
+    times = list()
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+
+def add_per_triple(catalog, instance):
+    g = Graph()
+    for dataset in catalog:
+        for triple in di_json2rdf.dataset_triples(dataset, instance):
+            g.add(triple)
+    return g
+
+
+def add_batch(catalog, instance):
+    g = Graph()
+    for dataset in catalog:
+        di_json2rdf.add_dataset(g, dataset, instance)
+    return g
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark catalog to RDF conversion')
+    parser.add_argument('--datasets', type=int, default=100, help='Number of datasets')
+    parser.add_argument('--columns', type=int, default=100, help='Number of columns per dataset')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    instance = Namespace('https://vsystem.ingress.stub/default/')
+    catalog = synthetic_catalog(args.datasets, args.columns)
+    print(f"Catalog: {args.datasets} datasets, {args.datasets * args.columns} columns")
+
+    run_time, triples = timed(lambda: [t for ds in catalog for t in di_json2rdf.dataset_triples(ds, instance)],
+                              args.repeat)
+    print(f"Conversion to triples:        {run_time:7.3f}s  ({len(triples)} triples)")
+    run_time, g = timed(lambda: add_per_triple(catalog, instance), args.repeat)
+    print(f"Conversion + Graph.add:       {run_time:7.3f}s  ({len(g)} triples)")
+    run_time, g = timed(lambda: add_batch(catalog, instance), args.repeat)
+    print(f"Conversion + add_dataset:     {run_time:7.3f}s  ({len(g)} triples)")
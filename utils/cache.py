@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+import time
+
+
+class TTLCache:
+    """
+    Thread-safe dict-like cache with a time-to-live per entry. Falsy values (negative results) can be kept for a
+    shorter time than positive ones.
+    """
+    def __init__(self, ttl=300, negative_ttl=None):
+        """
+        :param ttl: seconds a cached value stays valid
+        :param negative_ttl: seconds a falsy value stays valid (default: ttl)
+        """
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        ttl = self.ttl if value else self.negative_ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, key=None):
+        """
+        Remove one entry or, without key, all entries
+        :param key: cache key
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache. Counts hits and misses.
+    """
+    def __init__(self, maxsize=128, sizeof=None):
+        """
+        :param maxsize: maximal number of entries or, with sizeof, maximal total size of entries
+        :param sizeof: function returning the (estimated) size of a value
+        """
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 1
+        if size > self.maxsize:
+            return
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.maxsize:
+                self.size -= self._data.popitem(last=False)[1][1]
+
+    def invalidate(self, key=None):
+        """
+        Remove one entry or, without key, all entries
+        :param key: cache key
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+                self.size = 0
+            elif key in self._data:
+                self.size -= self._data.pop(key)[1]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._data), 'size': self.size,
+                'maxsize': self.maxsize}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,250 @@
+#
+#  Incremental import of catalog containers. A manifest per connection/container keeps for each dataset a hash of
+#  its container listing entry, the ETag/Last-Modified of its factsheet, tags and lineage, hashes of the fetched
+#  metadata and the lineage triples the dataset contributed. A re-import requests the factsheets of known datasets
+#  conditionally and only re-converts datasets whose metadata changed. Tags and lineage can change without changing
+#  the listing entry or the factsheet: with refresh_annotations they are requested (conditionally) for unchanged
+#  factsheets as well. The triples of datasets that are no longer in the container are retracted, lineage triples
+#  (about other datasets as well) when no dataset of the manifest contributes them any more.
+#
+import hashlib
+import json
+import logging
+import os
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from urllib.parse import urljoin
+
+from rdflib.util import from_n3
+
+from utils import export_catalog, di_json2rdf
+
+MANIFEST_FOLDER = 'manifests'
+ANNOTATIONS = {'tags': export_catalog.get_dataset_tags, 'lineage': export_catalog.get_dataset_lineage}
+
+
+#
+# MANIFEST
+#
+def manifest_file(user_folder, connection_id, container):
+    return import_manifest_file(user_folder, connection_id + container)
+
+
+def import_manifest_file(user_folder, import_name):
+    return path.join(user_folder, MANIFEST_FOLDER, urllib.parse.quote(import_name, safe='') + '.json')
+
+
+def load_manifest(filename):
+    if not path.isfile(filename):
+        return dict()
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def save_manifest(filename, manifest):
+    os.makedirs(path.dirname(filename), exist_ok=True)
+    with open(filename + '.tmp', 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+def clear_manifests(user_folder):
+    """
+    Removes all manifests of user, e.g. when the graph is newly created.
+    """
+    manifest_folder = path.join(user_folder, MANIFEST_FOLDER)
+    if path.isdir(manifest_folder):
+        for filename in os.listdir(manifest_folder):
+            os.remove(path.join(manifest_folder, filename))
+
+
+def content_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def lineage_entry(triples):
+    """
+    Lineage triples as stored in a manifest entry (sorted n3 terms)
+    """
+    return sorted({tuple(term.n3() for term in triple) for triple in triples})
+
+
+#
+# FETCH CHANGED DATASET
+#
+def fetch_annotations(connection, connection_id, qualified_name, validators, names=ANNOTATIONS):
+    """
+    Requests tags and lineage of a dataset, conditionally for the ones with validators of a previous response.
+    :param validators: dict of validators per annotation, updated with the values of the responses
+    :param names: annotations to request
+    :return: dict of annotations (NOT_MODIFIED if unchanged)
+    """
+    return {name: ANNOTATIONS[name](connection, connection_id, qualified_name, validators.setdefault(name, dict()))
+            for name in names}
+
+
+def fetch_dataset(connection, connection_id, ds, entry, refresh_annotations=False):
+    """
+    Fetches the metadata of a dataset unless it has not been changed since the manifest entry was written.
+    :param connection: connection
+    :param connection_id: connection id
+    :param ds: dataset of container listing
+    :param entry: manifest entry of dataset or None
+    :param refresh_annotations: check tags and lineage of an unchanged factsheet as well
+    :return: new manifest entry, dataset (None if unchanged or in case of errors)
+    """
+    qualified_name = ds['remoteObjectReference']['qualifiedName']
+    validators = {'etag': entry.get('etag'), 'last_modified': entry.get('last_modified')} if entry else dict()
+    annotation_validators = dict()
+    logging.info(f'Get dataset metadata: {qualified_name}')
+    dataset = export_catalog.get_dataset_factsheets(connection, connection_id, qualified_name, validators)
+    if not dataset:
+        return None, None
+    if dataset == export_catalog.NOT_MODIFIED:
+        if not refresh_annotations:
+            return dict(entry, listing=content_hash(ds)), None
+        annotation_validators = json.loads(json.dumps(entry.get('validators', dict())))
+        annotations = fetch_annotations(connection, connection_id, qualified_name, annotation_validators)
+        changed = [name for name, annotation in annotations.items() if annotation != export_catalog.NOT_MODIFIED
+                   and content_hash(annotation) != entry['annotations'].get(name)]
+        if not changed:
+            return dict(entry, listing=content_hash(ds), validators=annotation_validators), None
+        # tags or lineage changed: the factsheet and the unchanged annotation are needed for the conversion,
+        # requested unconditionally
+        validators = dict()
+        dataset = export_catalog.get_dataset_factsheets(connection, connection_id, qualified_name, validators)
+        if not dataset or dataset == export_catalog.NOT_MODIFIED:
+            return None, None
+        unchanged = [name for name, annotation in annotations.items() if annotation == export_catalog.NOT_MODIFIED]
+        for name in unchanged:
+            del annotation_validators[name]
+        annotations.update(fetch_annotations(connection, connection_id, qualified_name, annotation_validators,
+                                             unchanged))
+    else:
+        annotations = fetch_annotations(connection, connection_id, qualified_name, annotation_validators)
+    if export_catalog.NOT_MODIFIED in annotations.values():
+        return None, None
+    new_entry = {'listing': content_hash(ds), 'etag': validators.get('etag'),
+                 'last_modified': validators.get('last_modified'), 'validators': annotation_validators,
+                 'factsheet': content_hash(dataset),
+                 'annotations': {name: content_hash(annotation) for name, annotation in annotations.items()}}
+    if entry and new_entry['factsheet'] == entry['factsheet'] and new_entry['annotations'] == entry['annotations']:
+        return dict(new_entry, lineage=entry.get('lineage', list())), None
+
+    dataset['tags'] = annotations['tags']
+    if annotations['lineage']:
+        dataset['lineage'] = annotations['lineage']
+    return new_entry, dataset
+
+
+#
+# SYNC
+#
+def sync_catalog(graph, host, tenant, api_path, user, password, connection_id, container, instance, manifest,
+                 max_workers=export_catalog.MAX_WORKERS, progress=None, deductive_closure=True,
+                 refresh_annotations=False):
+    """
+    Imports a catalog container into graph in place, re-using the manifest of a previous import. Without
+    deductive_closure the triples of each dataset are added to graph as one batch as soon as it has been converted.
+    :param graph: graph
+    :param host: di system url
+    :param tenant: tenant
+    :param api_path: path of metadata api
+    :param user: user
+    :param password: password
+    :param connection_id: connection id
+    :param container: container
+    :param instance: namespace of instance
+    :param manifest: manifest of previous import (dict), updated in place
+    :param max_workers: number of parallel requests
+    :param progress: function called with the statistics after each fetched dataset, before the new triples
+    are added (with deductive_closure) and when all are added (may raise an exception to stop the import)
+    :param deductive_closure: expand the new triples for RDFS semantics (off if the caller maintains the closure)
+    :param refresh_annotations: check tags and lineage of datasets with unchanged factsheets as well
+    :return: statistics as dict or None if container has no datasets
+    """
+    connection = {'url': urljoin(host, api_path), 'auth': (tenant + '\\' + user, password)}
+    connection['session'] = export_catalog.get_session(connection, max_workers)
+
+    logging.info(f"Get datasets: {connection_id} - {container}")
+    datasets = export_catalog.get_datasets(connection, connection_id, container)
+    if not datasets:
+        logging.info(f"No Datasets for: {connection_id} - {container}")
+        return None
+    datasets = {ds['remoteObjectReference']['qualifiedName']: ds for ds in datasets
+                if export_catalog.valid_dataset(ds)}
+    stats = {'datasets': len(datasets), 'fetched': 0, 'processed': 0, 'changed': 0, 'deleted': 0,
+             'triples_removed': 0, 'triples_new': 0}
+    num_triples = len(graph)
+
+    # lineage triples contributed per triple by the datasets of the manifest
+    contributions = Counter(tuple(triple) for entry in manifest.values() for triple in entry.get('lineage', list()))
+
+    def remove_dataset(entry, lineage=()):
+        """
+        Removes the triples of the dataset of a manifest entry, replacing its lineage triples by lineage
+        """
+        contributions.subtract(tuple(triple) for triple in entry.get('lineage', list()))
+        contributions.update(tuple(triple) for triple in lineage)
+        retracted = [tuple(from_n3(term) for term in triple) for triple in entry.get('lineage', list())
+                     if contributions[tuple(triple)] <= 0]
+        return di_json2rdf.remove_dataset(graph, instance[entry['uri']], retracted)
+
+    # deleted datasets
+    for qualified_name in [qn for qn in manifest if qn not in datasets]:
+        stats['triples_removed'] += remove_dataset(manifest[qualified_name])
+        del manifest[qualified_name]
+        stats['deleted'] += 1
+
+    # new or changed datasets: fetched, converted, added and dropped one by one, so the memory needed is bounded by
+    # the datasets in flight (with deductive_closure by the new triples). Known datasets are checked as well (a
+    # conditional factsheet request, with refresh_annotations conditional tag and lineage requests), whether their
+    # listing entry changed or not.
+    outdated = list(datasets)
+    stats['fetched'] = len(outdated)
+
+    def changed_datasets():
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetched = export_catalog.ordered_map(executor, lambda qn: fetch_dataset(connection, connection_id,
+                                                                                    datasets[qn], manifest.get(qn),
+                                                                                    refresh_annotations),
+                                                 outdated, 2 * max_workers)
+            for qualified_name, (entry, dataset) in zip(outdated, fetched):
+                stats['processed'] += 1
+                if progress:
+                    progress(stats)
+                if not entry:
+                    continue
+                if dataset:
+                    entry['lineage'] = lineage_entry(di_json2rdf.lineage_triples(dataset, instance))
+                    if qualified_name in manifest:
+                        stats['triples_removed'] += remove_dataset(manifest[qualified_name], entry['lineage'])
+                    else:
+                        contributions.update(tuple(triple) for triple in entry['lineage'])
+                    entry['uri'] = urllib.parse.quote(di_json2rdf.get_dataset_path(dataset), safe='')
+                    stats['changed'] += 1
+                    yield dataset
+                else:
+                    entry['uri'] = manifest[qualified_name]['uri']
+                manifest[qualified_name] = entry
+
+    if deductive_closure:
+        g_new = di_json2rdf.to_rdf(changed_datasets(), instance)
+        stats['triples_new'] = len(g_new) if stats['changed'] else 0
+        if progress:
+            progress(stats)
+        if stats['changed']:
+            graph += g_new
+    else:
+        # converted triples go straight into graph, one batch per dataset
+        for dataset in changed_datasets():
+            triples = di_json2rdf.dataset_triples(dataset, instance)
+            stats['triples_new'] += len(triples)
+            graph.addN((s, p, o, graph) for s, p, o in triples)
+        if progress:
+            progress(stats)
+    stats['triples_added'] = len(graph) - num_triples + stats['triples_removed']
+    logging.info(f"Catalog sync {connection_id} - {container}: {stats}")
+    return stats
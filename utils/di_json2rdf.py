@@ -21,116 +21,226 @@ map_xsd_datatypes = {
 
 suffices = ['.csv', '.json', '.txt', '.xml', '.yaml', '.log', '.cfg', '.parquet', '.orc']
 
+dimd = Namespace("https://www.sap.com/products/data-intelligence#")
+
+# Literals shared by all datasets
+xsd_literals = {k: Literal(v) for k, v in map_xsd_datatypes.items()}
+datatype_literals = {k: Literal(k) for k in map_xsd_datatypes}
+NO_DESCRIPTION = Literal('No Description')
+TRUE = Literal(True)
+
+# Terms of dimd (attribute access of a Namespace creates a new URIRef each time)
+DIMD_COLUMN_CLASS = dimd.Column
+DIMD_COLUMN = dimd.column
+DIMD_PRIMARY_KEY = dimd.primaryKey
+DIMD_KEY = dimd.key
+DIMD_DATATYPE = dimd.datatype
+DIMD_TEMPLATE_DATA_TYPE = dimd.templateDataType
+DIMD_LENGTH = dimd.length
+DIMD_PRECISION = dimd.precision
+DIMD_SCALE = dimd.scale
+DIMD_TAG = dimd.tag
+DIMD_LINEAGE = dimd.lineage
+DIMD_COMPUTATION_TYPE = dimd.computationType
+DIMD_IMPACT = dimd.impact
+# lineage triples are about the input and output datasets, several datasets can contribute the same triple
+LINEAGE_PREDICATES = {DIMD_LINEAGE, DIMD_COMPUTATION_TYPE, DIMD_IMPACT}
+dimd_types = dict()
+
+
+def get_dataset_path(dataset):
+    dataset_path = urllib.parse.unquote(dataset['metadata']['uri'])
+    if '.' in dataset_path:
+        dataset_path, suffix = os.path.splitext(dataset_path)
+    if dataset_path[0] == '/':
+        dataset_path = dataset_path[1:]
+    if dataset_path[-1] == '/':
+        dataset_path = dataset_path[:-1]
+    return dataset_path
+
+
+def get_dataset_uri(dataset, instance):
+    return instance[urllib.parse.quote(get_dataset_path(dataset), safe='')]
+
+
+#
+# REMOVE DATASET
+#
+def remove_dataset(g, dataset_uri, lineage=()):
+    """
+    Removes the triples of a dataset and its columns from graph. The lineage triples of the dataset (about it and
+    about other datasets) are removed only as given: the caller knows which of them no other dataset contributes.
+    :param g: graph
+    :param dataset_uri: uri of dataset
+    :param lineage: lineage triples to remove
+    :return: number of removed triples
+    """
+    num_triples = len(g)
+    for column_uri in list(g.objects(dataset_uri, DIMD_COLUMN)):
+        g.remove((column_uri, None, None))
+    for predicate in set(g.predicates(dataset_uri)) - LINEAGE_PREDICATES:
+        g.remove((dataset_uri, predicate, None))
+    for triple in lineage:
+        g.remove(triple)
+    return num_triples - len(g)
+
+
+#
+# DATASET
+#
+def dataset_triples(dataset, instance):
+    """
+    Converts a catalog dataset (factsheet with tags and lineage) to triples. URIs of the dataset, its columns
+    and tags are created once per dataset.
+    :param dataset: dataset as dict
+    :param instance: namespace of instance
+    :return: list of triples
+    """
+    triples = list()
+    add = triples.append
+    uris = dict()
+
+    def uri(path):
+        if path not in uris:
+            uris[path] = instance[urllib.parse.quote(path, safe='')]
+        return uris[path]
+
+    dataset_path = get_dataset_path(dataset)
+    dataset_uri = uri(dataset_path)
+    dataset_type = dataset['metadata']['type'].capitalize()
+    add((dataset_uri, RDF.type, dimd_types.setdefault(dataset_type, dimd[dataset_type])))
+    add((dataset_uri, RDFS.label, Literal(dataset['metadata']['name'])))
+
+    # comment = descriptions
+    if "descriptions" in dataset['metadata']:
+        for d in dataset['metadata']['descriptions']:
+            if d['type'] == 'SHORT':
+                add((dataset_uri, RDFS.comment, Literal(d['value'])))
+    else:
+        add((dataset_uri, RDFS.comment, NO_DESCRIPTION))
+
+    # primary keys
+    if "uniqueKeys" in dataset["metadata"]:
+        for uk in dataset["metadata"]["uniqueKeys"]:
+            for pk in uk["attributeReferences"]:
+                column_uri = uri(dataset_path + '/' + pk)
+                add((dataset_uri, DIMD_PRIMARY_KEY, column_uri))
+                add((column_uri, DIMD_KEY, TRUE))
+
+    # COLUMNS
+    for column in dataset['columns']:
+        column_uri = uri(dataset_path + '/' + column['name'])
+        add((column_uri, RDFS.label, Literal(column['name'])))
+        add((dataset_uri, DIMD_COLUMN, column_uri))
+        add((column_uri, RDF.type, DIMD_COLUMN_CLASS))
+        add((column_uri, DIMD_DATATYPE, datatype_literals.get(column['type']) or Literal(column['type'])))
+        if column['type'] in xsd_literals:
+            add((column_uri, RDFS.range, xsd_literals[column['type']]))
+        else:
+            logging.warning(f"No XSD mapping for {column['type']}")
+        add((column_uri, DIMD_TEMPLATE_DATA_TYPE, Literal(column['templateType'])))
+        if 'length' in column:
+            add((column_uri, DIMD_LENGTH, Literal(column['length'])))
+        if 'precision' in column:
+            add((column_uri, DIMD_PRECISION, Literal(column['precision'])))
+        if 'scale' in column:
+            add((column_uri, DIMD_SCALE, Literal(column['scale'])))
+        if "descriptions" in column:
+            for d in column['descriptions']:
+                if d['type'] == 'SHORT':
+                    add((column_uri, RDFS.comment, Literal(d['value'])))
+                    break
+
+    # TAGS
+    if 'tags' in dataset and dataset['tags']:
+        if 'tagsOnDataset' in dataset['tags']:
+            for dtag in dataset['tags']['tagsOnDataset']:
+                hierarchy_path = f"/hierarchy/{dtag['hierarchyName']}"
+                for tag in dtag['tags']:
+                    add((dataset_uri, DIMD_TAG, uri(hierarchy_path + '/' + tag['tag']['path'])))
+        if 'tagsOnAttribute' in dataset['tags']:
+            for atag in dataset['tags']['tagsOnAttribute']:
+                column_uri = uri(dataset_path + '/' + atag['attributeQualifiedName'])
+                for tag in atag['tags']:
+                    hierarchy_path = '/hierarchy/' + tag['hierarchyName']
+                    for tag2 in tag['tags']:
+                        tag_path = hierarchy_path + '/' + tag2['tag']['path'].replace('.', '/')
+                        add((column_uri, DIMD_TAG, uri(tag_path)))
+                        if tag['hierarchyName'] == 'AlternativeLabels':
+                            add((column_uri, RDFS.label, Literal(tag2['tag']['name'])))
+
+    triples.extend(lineage_triples(dataset, instance, uri))
+    return triples
+
+
+def lineage_triples(dataset, instance, uri=None):
+    """
+    Converts the lineage of a catalog dataset to triples
+    :param dataset: dataset as dict
+    :param instance: namespace of instance
+    :param uri: function returning the uri of a path (the one of dataset_triples)
+    :return: list of triples
+    """
+    triples = list()
+    if 'lineage' not in dataset or not isinstance(dataset['lineage'], dict):
+        return triples
+    if not uri:
+        def uri(path):
+            return instance[urllib.parse.quote(path, safe='')]
+    add = triples.append
+    logging.info(f"Lineage of dataset: {dataset['metadata']['uri']}")
+    for pcn in dataset['lineage']['publicComputationNodes']:
+        for transform in pcn['transforms']:
+            for computation in transform['datasetComputation']:
+                if 'inputDatasets' not in computation or 'outputDatasets' not in computation:
+                    logging.info(f"No inputDatasets or outputDatasets in lineage for {dataset['metadata']['uri']}")
+                    continue
+                else:
+                    in_uris = [uri(ind['externalDatasetRef']) for ind in computation['inputDatasets']]
+                    out_uris = [uri(ind['externalDatasetRef']) for ind in computation['outputDatasets']]
+                computation_type = Literal(computation['computationType'])
+                for i in in_uris:
+                    for o in out_uris:
+                        add((i, DIMD_LINEAGE, o))
+                        add((i, DIMD_COMPUTATION_TYPE, computation_type))
+                        add((o, DIMD_IMPACT, i))
+    return triples
+
+
+def add_dataset(g, dataset, instance):
+    """
+    Converts a catalog dataset to triples and adds them in one batch to graph. The batch is passed directly to
+    the store, skipping the node checks of Graph.addN for the triples created here.
+    :param g: graph
+    :param dataset: dataset as dict
+    :param instance: namespace of instance
+    """
+    g.store.addN((s, p, o, g) for s, p, o in dataset_triples(dataset, instance))
+
 
 #
 # DATA INPUT
 #
-def to_rdf(data, instance, deductive_closure=True):
+def to_rdf(data, instance, deductive_closure=True, ontology='dimd.ttl'):
+    """
+    Converts catalog datasets to a graph
+    :param data: iterable of datasets, e.g. a generator of export_catalog.iter_catalog. Each dataset is dropped
+    after it has been added to the graph.
+    :param instance: namespace of instance
+    :param deductive_closure: expand graph (with the ontology) for RDFS semantics
+    :param ontology: ontology file parsed into the graph for the deductive closure (not parsed without it, the
+    caller layers the ontology)
+    :return: graph
+    """
     # create Graph
     g = Graph()
-    g.parse('dimd.ttl')
-    dimd = Namespace("https://www.sap.com/products/data-intelligence#")
+    if deductive_closure:
+        g.parse(ontology)
     g.bind("dimd", dimd)
     g.bind("instance", instance)
 
     for dataset in data:
-        dataset_path = urllib.parse.unquote(dataset['metadata']['uri'])
-        if '.' in dataset_path:
-            dataset_path, suffix = os.path.splitext(dataset_path)
-        if dataset_path[0] == '/':
-            dataset_path = dataset_path[1:]
-        if dataset_path[-1] == '/':
-            dataset_path = dataset_path[:-1]
-        dataset_uri = instance[urllib.parse.quote(dataset_path, safe='')]
-        dataset_type = dataset['metadata']['type'].capitalize()
-        g.add((dataset_uri, RDF.type, dimd[dataset_type]))
-        g.add((dataset_uri, RDFS.label, Literal(dataset['metadata']['name'])))
-
-        # comment = descriptions
-        if "descriptions" in dataset['metadata']:
-            for d in dataset['metadata']['descriptions']:
-                if d['type'] == 'SHORT':
-                    g.add((dataset_uri, RDFS.comment, Literal(d['value'])))
-        else:
-            g.add((dataset_uri, RDFS.comment, Literal('No Description')))
-
-        # primary keys
-        # unique_keys = list()
-        if "uniqueKeys" in dataset["metadata"]:
-            for uk in dataset["metadata"]["uniqueKeys"]:
-                for pk in uk["attributeReferences"]:
-                    column_path = urllib.parse.quote(dataset_path + '/' + column['name'], safe='')
-                    column_uri = instance[column_path]
-                    g.add((dataset_uri, dimd.primaryKey, column_uri))
-                    g.add((column_uri, dimd.key, Literal(True)))
-
-        # COLUMNS
-        for column in dataset['columns']:
-            column_path = urllib.parse.quote(dataset_path + '/' + column['name'], safe='')
-            column_uri = instance[column_path]
-            g.add((column_uri, RDFS.label, Literal(column['name'])))
-            g.add((dataset_uri, dimd.column, column_uri))
-            g.add((column_uri, RDF.type, dimd.Column))
-            g.add((column_uri, dimd.datatype, Literal(column['type'])))
-            if column['type'] in map_xsd_datatypes:
-                g.add((column_uri, RDFS.range, Literal(map_xsd_datatypes[column['type']])))
-            else:
-                logging.warning(f"No XSD mapping for {column['type']}")
-            g.add((column_uri, dimd.templateDataType, Literal(column['templateType'])))
-            if 'length' in column:
-                g.add((column_uri, dimd.length, Literal(column['length'])))
-            if 'precision' in column:
-                g.add((column_uri, dimd.precision, Literal(column['precision'])))
-            if 'scale' in column:
-                g.add((column_uri, dimd.scale, Literal(column['scale'])))
-            if "descriptions" in column:
-                for d in column['descriptions']:
-                    if d['type'] == 'SHORT':
-                        g.add((column_uri, RDFS.comment, Literal(d['value'])))
-                        break
-
-        # TAGS
-        if 'tags' in dataset:
-            if 'tagsOnDataset' in dataset['tags']:
-                for dtag in dataset['tags']['tagsOnDataset']:
-                    hierarchy_path = f"/hierarchy/{dtag['hierarchyName']}"
-                    for tag in dtag['tags']:
-                        tag_path = hierarchy_path + '/' + tag['tag']['path']
-                        tag_uri = instance[urllib.parse.quote(tag_path, safe='')]
-                        g.add((dataset_uri, dimd.tag, tag_uri))
-            if 'tagsOnAttribute' in dataset['tags']:
-                for atag in dataset['tags']['tagsOnAttribute']:
-                    column_uri = instance[urllib.parse.quote(dataset_path + '/' + atag['attributeQualifiedName'],
-                                                             safe='')]
-                    for tag in atag['tags']:
-                        hierarchy_path = '/hierarchy/' + tag['hierarchyName']
-                        for tag2 in tag['tags']:
-                            tag_path = hierarchy_path + '/' + tag2['tag']['path'].replace('.', '/')
-                            tag_uri = instance[urllib.parse.quote(tag_path, safe='')]
-                            g.add((column_uri, dimd.tag, tag_uri))
-                            if tag['hierarchyName'] == 'AlternativeLabels':
-                                g.add((column_uri, RDFS.label, Literal(tag2['tag']['name'])))
-
-        # LINEAGE
-        if 'lineage' in dataset and isinstance(dataset['lineage'], dict):
-            logging.info(f"Lineage of dataset: {dataset['metadata']['uri']}")
-            for pcn in dataset['lineage']['publicComputationNodes']:
-                for transform in pcn['transforms']:
-                    for computation in transform['datasetComputation']:
-                        if 'inputDatasets' not in computation or 'outputDatasets' not in computation:
-                            logging.info(
-                                f"No inputDatasets or outputDatasets in lineage for {dataset['metadata']['uri']}")
-                            continue
-                        else:
-                            in_uris = [instance[urllib.parse.quote(ind['externalDatasetRef'], safe='')]
-                                       for ind in computation['inputDatasets']]
-                            out_uris = [instance[urllib.parse.quote(ind['externalDatasetRef'], safe='')]
-                                        for ind in computation['outputDatasets']]
-                        for i in in_uris:
-                            for o in out_uris:
-                                g.add((i, dimd.lineage, o))
-                                g.add((i, dimd.computationType, Literal(computation['computationType'])))
-                                g.add((o, dimd.impact, i))
+        add_dataset(g, dataset, instance)
 
     # Expand graph for RDFS semantics
     if deductive_closure:
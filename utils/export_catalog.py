@@ -2,12 +2,72 @@ import os
 from urllib.parse import urljoin
 import urllib
 import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 
+MAX_WORKERS = 8  # parallel requests per export
+WINDOW = 2 * MAX_WORKERS  # datasets requested ahead of the consumer
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5  # sleeps 0.5, 1, 2, 4s between retries
+# 500 is not retried: the lineage export answers with 500 for datasets without lineage
+RETRY_STATUS = [429, 502, 503, 504]
+NOT_MODIFIED = 304
 
+sessions = dict()
+sessions_lock = threading.Lock()
+
+
+#
+# Session with connection pool and retries (one per tenant)
+#
+def get_session(connection, max_workers=MAX_WORKERS):
+    key = (connection['url'], connection['auth'][0])
+    with sessions_lock:
+        session, pool_size = sessions.get(key, (None, 0))
+        if pool_size < max_workers:
+            retries = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUS,
+                            allowed_methods=['GET'], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retries)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            sessions[key] = (session, max_workers)
+        session.auth = connection['auth']
+    return session
+
+
+def http(connection):
+    return connection.get('session', requests)
+
+
+#
+# Conditional requests
+#
+def conditional_headers(headers, validators):
+    """
+    Adds the If-None-Match/If-Modified-Since headers of the validators of a previous response to headers
+    """
+    if validators and validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def update_validators(validators, r):
+    if validators is not None:
+        validators['etag'] = r.headers.get('ETag')
+        validators['last_modified'] = r.headers.get('Last-Modified')
+
+
+#
 #  GET Datasets
 #
 def get_datasets(connection, connection_id, dataset_path):
@@ -16,7 +76,7 @@ def get_datasets(connection, connection_id, dataset_path):
     url = connection['url'] + restapi
     headers = {'X-Requested-With': 'XMLHttpRequest'}
     logging.info(f"Request URL: {url}")
-    r = requests.get(url, headers=headers, auth=connection['auth'])
+    r = http(connection).get(url, headers=headers, auth=connection['auth'])
 
     if r.status_code != 200:
         logging.error(f"Status code: {r.status_code}  - {r.text}")
@@ -26,70 +86,145 @@ def get_datasets(connection, connection_id, dataset_path):
 
 
 #
-#  GET Tags of datasets
+#  GET Factsheet of datasets
 #
-def get_dataset_factsheets(connection, connection_id, dataset_path):
+def get_dataset_factsheets(connection, connection_id, dataset_path, validators=None):
+    """
+    Get factsheet of dataset.
+    :param validators: dict with 'etag' and 'last_modified' of a previous response. Makes the request conditional
+    and is updated with the values of the response.
+    :return: factsheet, NOT_MODIFIED or None in case of errors
+    """
     qualified_name = urllib.parse.quote(dataset_path, safe='')  # quote to use as  URL component
     restapi = f"/catalog/connections/{connection_id}/datasets/{qualified_name}/factsheet"
     url = connection['url'] + restapi
-    headers = {'X-Requested-With': 'XMLHttpRequest'}
+    headers = conditional_headers({'X-Requested-With': 'XMLHttpRequest'}, validators)
     params = {"connectionId": connection_id, "qualifiedName": dataset_path}
-    r = requests.get(url, headers=headers, auth=connection['auth'], params=params)
+    r = http(connection).get(url, headers=headers, auth=connection['auth'], params=params)
 
+    if r.status_code == 304:
+        return NOT_MODIFIED
     if r.status_code != 200:
         logging.error(f"Status code: {r.status_code}  - {r.text}")
         return None
+    update_validators(validators, r)
     return json.loads(r.text)
 
 
 #
 #  GET Tags of datasets
 #
-def get_dataset_tags(connection, connection_id, dataset_path):
+def get_dataset_tags(connection, connection_id, dataset_path, validators=None):
+    """
+    Get tags of dataset.
+    :param validators: validators of a previous response (see get_dataset_factsheets)
+    :return: tags, NOT_MODIFIED or None in case of errors
+    """
     qualified_name = urllib.parse.quote(dataset_path, safe='')  # quote to use as  URL component
     restapi = f"/catalog/connections/{connection_id}/datasets/{qualified_name}/tags"
     url = connection['url'] + restapi
-    headers = {'X-Requested-With': 'XMLHttpRequest'}
+    headers = conditional_headers({'X-Requested-With': 'XMLHttpRequest'}, validators)
     params = {"connectionId": connection_id, "qualifiedName": dataset_path}
-    r = requests.get(url, headers=headers, auth=connection['auth'], params=params)
+    r = http(connection).get(url, headers=headers, auth=connection['auth'], params=params)
 
+    if r.status_code == 304:
+        return NOT_MODIFIED
     if r.status_code != 200:
         logging.error(f"Status code: {r.status_code}  - {r.text}")
         return None
+    update_validators(validators, r)
     return json.loads(r.text)
 
 
 #
 #  GET Lineage of datasets
 #
-def get_dataset_lineage(connection, connection_id, dataset_path):
+def get_dataset_lineage(connection, connection_id, dataset_path, validators=None):
+    """
+    Get lineage of dataset.
+    :param validators: validators of a previous response (see get_dataset_factsheets)
+    :return: lineage, NOT_MODIFIED or None if there is no lineage or in case of errors
+    """
     restapi = f"/catalog/lineage/export"
     url = connection['url'] + restapi
-    headers = {'X-Requested-With': 'XMLHttpRequest'}
+    headers = conditional_headers({'X-Requested-With': 'XMLHttpRequest'}, validators)
     params = {"connectionId": connection_id, "qualifiedNameFilter": dataset_path}
-    r = requests.get(url, headers=headers, auth=connection['auth'], params=params)
+    r = http(connection).get(url, headers=headers, auth=connection['auth'], params=params)
 
+    if r.status_code == 304:
+        return NOT_MODIFIED
     if r.status_code == 404:
         logging.warning(f"Status code: {r.status_code}  - No lineage found for: {dataset_path}")
         return None
     if r.status_code == 500:
         logging.error(f"Status code: {r.status_code}  - {r.text}")
         return None
+    update_validators(validators, r)
     return json.loads(r.text)
 
 
-def export_catalog(host, tenant, path, user, password, connection_id, container):
+def valid_dataset(ds):
+    # skip erroneous datasets
+    return not (ds['remoteObjectReference']['remoteObjectType'] == 'FILE.UNKNOWN' or
+                ('size' in ds['remoteObjectReference'] and ds['remoteObjectReference']['size'] == 0))
+
+
+#
+#  GET Factsheet, tags and lineage of dataset
+#
+def get_dataset(connection, connection_id, ds, tags=True, lineage=True):
+    if not valid_dataset(ds):
+        return None
+
+    qualified_name = ds['remoteObjectReference']['qualifiedName']
+    logging.info(f'Get dataset metadata: {qualified_name}')
+    dataset = get_dataset_factsheets(connection, connection_id, qualified_name)
+
+    # In case of Error (like imported data)
+    if not dataset:
+        return None
+
+    if tags:
+        dataset['tags'] = get_dataset_tags(connection, connection_id, qualified_name)
+
+    if lineage:
+        lineage_info = get_dataset_lineage(connection, connection_id, qualified_name)
+        if lineage_info:
+            dataset['lineage'] = lineage_info
+
+    return dataset
+
+
+def ordered_map(executor, func, items, window=WINDOW):
     """
-    Exports catalog datasets
+    Like executor.map, but submits at most window items ahead of the consumer. Only the results within the
+    window are held in memory. Results are yielded in the order of items.
+    """
+    futures = deque()
+    for item in items:
+        futures.append(executor.submit(func, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def iter_catalog(host, tenant, path, user, password, connection_id, container, max_workers=MAX_WORKERS):
+    """
+    Generator of the exported catalog datasets. The metadata of the datasets is requested in parallel over a
+    pooled session of the tenant, at most 2 * max_workers datasets ahead of the consumer. The order follows the
+    order of the datasets in the container.
     :param host: di system url
     :param tenant:
     :param user:
     :param password:
     :param connection_id:
-    :param container: 
-    :return: exported data as dict
+    :param container:
+    :param max_workers: number of parallel requests
+    :return: generator of datasets
     """
     connection = {'url': urljoin(host, path), 'auth': (tenant + '\\' + user, password)}
+    connection['session'] = get_session(connection, max_workers)
     tags = True
     lineage = True
 
@@ -99,35 +234,30 @@ def export_catalog(host, tenant, path, user, password, connection_id, container)
 
     if not datasets:
         logging.info(f"No Datasets for: {connection_id} - {container} -> shutdown pipeline")
-        return None
+        return
 
-    dataset_factsheets = list()
-    for i, ds in enumerate(datasets):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for dataset in ordered_map(executor, lambda ds: get_dataset(connection, connection_id, ds, tags, lineage),
+                                   datasets, 2 * max_workers):
+            if dataset:
+                yield dataset
 
-        # skip erroneous datasets
-        if ds['remoteObjectReference']['remoteObjectType'] == 'FILE.UNKNOWN' or \
-                ('size' in ds['remoteObjectReference'] and ds['remoteObjectReference']['size'] == 0):
-            continue
 
-        qualified_name = ds['remoteObjectReference']['qualifiedName']
-        logging.info(f'Get dataset metadata: {qualified_name}')
-        dataset = get_dataset_factsheets(connection, connection_id, qualified_name)
-
-        # In case of Error (like imported data)
-        if not dataset:
-            continue
-
-        if tags:
-            dataset['tags'] = get_dataset_tags(connection, connection_id, qualified_name)
-
-        if lineage:
-            lineage_info = get_dataset_lineage(connection, connection_id, qualified_name)
-            if lineage_info:
-                dataset['lineage'] = lineage_info
-
-        dataset_factsheets.append(dataset)
-
-    return dataset_factsheets
+def export_catalog(host, tenant, path, user, password, connection_id, container, max_workers=MAX_WORKERS):
+    """
+    Exports catalog datasets
+    :param host: di system url
+    :param tenant:
+    :param user:
+    :param password:
+    :param connection_id:
+    :param container: 
+    :param max_workers: number of parallel requests
+    :return: exported data as dict
+    """
+    dataset_factsheets = list(iter_catalog(host, tenant, path, user, password, connection_id, container,
+                                           max_workers))
+    return dataset_factsheets if dataset_factsheets else None
 
 
 if __name__ == '__main__':
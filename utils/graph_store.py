@@ -0,0 +1,585 @@
+#
+#  Storage of the graph of a user space. With the 'Memory' store the graph is loaded from the binary snapshot
+#  repo.snap at login and the journal of the changes since the snapshot is replayed. Changes are appended to the
+#  journal when committed; the journal is compacted into a new snapshot when it has grown to a fraction of the
+#  snapshot, or when the user saves. A persistent store ('SQLite' or, if berkeleydb is
+#  installed, 'BerkeleyDB') is opened in place without reading the triples; they are paged in from disk by the
+#  triple lookups. Turtle (repo.ttl) is only written for downloads. An existing repo.ttl of older versions is read
+#  when there is no snapshot yet, and migrated into a new persistent store.
+#  The graph is a ConjunctiveGraph of named graphs: the ontology (ONTOLOGY), one per import (import_graph), the
+#  triples added by updates (ASSERTED, the default graph) and the inferred triples (INFERRED). Queries run on the
+#  union of the named graphs; a UnionView leaves out the inferred triples.
+#  The ontology and its RDFS closure (ONTOLOGY_INFERRED) are loaded once per process into read-only graphs shared by
+#  all user graphs (shared_ontology). A UserGraph layers them under the named graphs of its store; they are never
+#  copied into the store, its snapshot or its journal.
+#  Several processes (e.g. gunicorn workers) can open the same user space: changes are made under its write_lock,
+#  and refresh_graph catches up with the changes saved by the other processes. Within a process the threads reading
+#  the graph (queries, exports) share its space_lock; the graph is changed only while holding it exclusively.
+#  The graphs stay open until unload_idle closes the least recently used ones not in use (see pinned) to keep the
+#  estimated memory of the open graphs (resident_sizes) within a budget; open_graph loads them again.
+#
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os import path
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # no locking across processes (single process deployment)
+    fcntl = None
+
+from rdflib import Graph, ConjunctiveGraph, URIRef, plugin
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID, ModificationException
+from rdflib.store import Store, VALID_STORE
+from rdflib.plugins.stores.memory import Memory
+from rdflib.plugins.stores.berkeleydb import has_bsddb
+from rdflib.paths import Path
+
+from utils import snapshot, journal, reasoner
+from utils.rwlock import RWLock
+
+REPO = 'repo.ttl'
+REPO_SNAPSHOT = 'repo.snap'
+REPO_JOURNAL = 'repo.journal'
+COMPACT_RATIO = 0.5  # journal compacted when larger than this fraction of the snapshot
+COMPACT_MIN_SIZE = 1024 * 1024  # bytes of journal never compacted automatically
+LOCK_FILE = 'lock'  # file of user space locked while the graph is changed
+TRIPLE_SIZE = 1400  # estimated bytes of a triple of a graph in memory (indexes and terms)
+MEMORY = 'Memory'
+SQLITE = 'SQLite'
+BERKELEYDB = 'BerkeleyDB'
+STORES = [MEMORY, SQLITE, BERKELEYDB]
+ASSERTED = DATASET_DEFAULT_GRAPH_ID  # named graph of the triples added by updates (default graph)
+ONTOLOGY = URIRef('urn:thhsparql:graph:ontology')  # named graph of the base files (dimd.ttl)
+ONTOLOGY_INFERRED = URIRef('urn:thhsparql:graph:ontology-inferred')  # named graph of the RDFS closure of the ontology
+INFERRED = URIRef('urn:thhsparql:graph:inferred')  # named graph of the inferred triples
+INFERRED_GRAPHS = (INFERRED, ONTOLOGY_INFERRED)  # named graphs left out by UnionView(graph, inferred=False)
+IMPORT_GRAPH = 'urn:thhsparql:graph:import:'  # prefix of the named graphs of imports
+
+plugin.register(SQLITE, Store, 'utils.sqlite_store', 'SQLiteStore')
+
+open_graphs = dict()  # store folder -> graph
+shared_ontologies = dict()  # tuple of base files -> {identifier: read-only graph}
+_ontology_lock = threading.Lock()
+_held_locks = threading.local()  # write locks held by the current thread: user folder -> depth
+_thread_locks = dict()  # user folder -> lock (without fcntl)
+_space_locks = dict()  # user folder -> readers-writer lock of the threads of this process
+_pins = dict()  # user folder -> number of threads using its graph (not closed by unload_idle)
+_last_used = dict()  # user folder -> time its graph has been used last
+_pool_lock = threading.Lock()
+
+
+def store_folder(user_folder, store):
+    return path.join(user_folder, 'store_' + store.lower())
+
+
+def is_persistent(graph):
+    return not isinstance(graph.store, Memory)
+
+
+def file_stat(filename):
+    """
+    :return: identity of the current version of a file (changed when it is replaced or written) or None
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+@contextmanager
+def write_lock(user_folder, blocking=True):
+    """
+    Exclusive lock of the graph of a user space, held while it is changed: an flock of LOCK_FILE in the user folder,
+    so it excludes the other threads and processes. Reentrant within a thread.
+    :param user_folder: folder of user space
+    :param blocking: wait for the lock (otherwise yields False if another thread or process holds it)
+    :return: context yielding True if the lock is held
+    """
+    held = _held_locks.__dict__.setdefault('folders', dict())
+    key = path.abspath(user_folder)
+    if key in held:
+        held[key] += 1
+        try:
+            yield True
+        finally:
+            held[key] -= 1
+        return
+    if fcntl is None:
+        lock = _thread_locks.setdefault(key, threading.Lock())
+        locked = lock.acquire(blocking)
+        fp = None
+    else:
+        fp = open(path.join(user_folder, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            locked = True
+        except BlockingIOError:
+            locked = False
+    try:
+        if locked:
+            held[key] = 1
+        yield locked
+    finally:
+        if locked:
+            del held[key]
+        if fp is not None:
+            fp.close()
+        elif locked:
+            lock.release()
+
+
+def space_lock(user_folder):
+    """
+    Readers-writer lock of the graph of a user space within this process: queries and exports hold it shared, a
+    change holds it exclusively while it modifies the graph (in addition to the write_lock, which it can hold longer,
+    e.g. while the changes of an import are fetched).
+    :param user_folder: folder of user space
+    :return: RWLock
+    """
+    key = path.abspath(user_folder)
+    lock = _space_locks.get(key)
+    return lock if lock is not None else _space_locks.setdefault(key, RWLock())
+
+
+@contextmanager
+def pinned(user_folder):
+    """
+    Context using the graph of a user space: unload_idle does not close it meanwhile
+    :param user_folder: folder of user space
+    """
+    key = path.abspath(user_folder)
+    with _pool_lock:
+        _pins[key] = _pins.get(key, 0) + 1
+        _last_used[key] = time.monotonic()
+    try:
+        yield
+    finally:
+        with _pool_lock:
+            _pins[key] -= 1
+            if not _pins[key]:
+                del _pins[key]
+
+
+def resident_size(graph):
+    """
+    :return: estimated bytes of memory of an open graph (without the shared ontology)
+    """
+    if hasattr(graph.store, 'resident_size'):
+        return graph.store.resident_size()
+    return len(graph.store) * TRIPLE_SIZE if isinstance(graph.store, Memory) else 0
+
+
+def resident_sizes():
+    """
+    :return: user folder -> estimated bytes of its open graph, least recently used first
+    """
+    sizes = {path.abspath(path.dirname(folder)): resident_size(graph) for folder, graph in list(open_graphs.items())}
+    return dict(sorted(sizes.items(), key=lambda item: _last_used.get(item[0], 0)))
+
+
+def unload_idle(budget, unloaded=None):
+    """
+    Closes the least recently used graphs that are not in use (see pinned) until the estimated memory of the open
+    graphs is within budget. Their changes are saved already; open_graph loads them again.
+    :param budget: bytes
+    :param unloaded: function called with the user folder of each closed graph (before it can be used again)
+    :return: estimated bytes of the open graphs
+    """
+    with _pool_lock:
+        sizes = resident_sizes()
+        total = sum(sizes.values())
+        for user_folder, size in sizes.items():
+            if total <= budget:
+                break
+            if _pins.get(user_folder):
+                continue
+            for folder in [folder for folder in open_graphs if path.abspath(path.dirname(folder)) == user_folder]:
+                open_graphs.pop(folder).close(commit_pending_transaction=True)
+            _last_used.pop(user_folder, None)
+            total -= size
+            logging.info(f"Graph of {user_folder} unloaded: {size} bytes (budget {budget}, open graphs {total})")
+            if unloaded:
+                unloaded(user_folder)
+    return total
+
+
+def import_graph(import_name):
+    """
+    :return: identifier of the named graph of an import (catalog container or file)
+    """
+    return URIRef(IMPORT_GRAPH + quote(import_name, safe=''))
+
+
+class ReadOnlyGraph(Graph):
+    """
+    Graph that cannot be changed, e.g. a shared ontology graph
+    """
+    def add(self, triple):
+        raise ModificationException()
+
+    def addN(self, quads):
+        raise ModificationException()
+
+    def remove(self, triple):
+        raise ModificationException()
+
+
+def shared_ontology(base_files):
+    """
+    Loads the ontology and its RDFS closure once per process
+    :param base_files: rdf files of the ontology
+    :return: {identifier: read-only graph} of ONTOLOGY and ONTOLOGY_INFERRED
+    """
+    key = tuple(base_files)
+    with _ontology_lock:
+        if key not in shared_ontologies:
+            start_time = time.perf_counter()
+            g = ConjunctiveGraph()
+            for filename in base_files:
+                g.get_context(ONTOLOGY).parse(filename)
+            reasoner.Reasoner(g, g.get_context(ONTOLOGY_INFERRED), reasoner.RDFS_PROFILE).closure()
+            shared_ontologies[key] = {identifier: ReadOnlyGraph(store=g.store, identifier=identifier,
+                                                                namespace_manager=g.namespace_manager)
+                                      for identifier in (ONTOLOGY, ONTOLOGY_INFERRED)}
+            logging.info(f"Shared ontology {list(base_files)}: {len(g)} triples "
+                         f"loaded in {time.perf_counter() - start_time:.2f}s")
+        return shared_ontologies[key]
+
+
+class UserGraph(ConjunctiveGraph):
+    """
+    Graph of a user space: the named graphs of its store layered over shared read-only base graphs (the ontology).
+    Lookups see the union of both, quads() only the quads of the store (so snapshots and copies leave out the base
+    graphs). Added triples go to the asserted graph. With inferred=False the triples only in the inferred graphs
+    are left out (triples that are inferred and asserted as well are kept).
+    """
+    def __init__(self, store='default', base_files=(), inferred=True):
+        super().__init__(store=store, identifier=ASSERTED)
+        self.base_files = tuple(base_files)
+        self.base_graphs = shared_ontology(base_files) if base_files else dict()
+        self.inferred = inferred
+
+    def bind_base_namespaces(self):
+        for base_graph in self.base_graphs.values():
+            for prefix, namespace in base_graph.namespaces():
+                self.bind(prefix, namespace, override=False)
+
+    def _visible(self, contexts):
+        return self.inferred or any(context.identifier not in INFERRED_GRAPHS for context in contexts)
+
+    def get_context(self, identifier, quoted=False, base=None):
+        if identifier in self.base_graphs:
+            return self.base_graphs[identifier]
+        return super().get_context(identifier, quoted, base)
+
+    def stored_triples(self):
+        """
+        Triples of the store (without the base graphs)
+        """
+        return (triple for triple, _ in self.store.triples((None, None, None), context=None))
+
+    def triples(self, triple_or_quad, context=None):
+        s, p, o, c = self._spoc(triple_or_quad)
+        context = self._graph(c if c is not None else context)
+        if context is not None and context.identifier in self.base_graphs:
+            yield from self.base_graphs[context.identifier].triples((s, p, o))
+            return
+        if (context is not None and context != self.default_context) or isinstance(p, Path):
+            yield from super().triples((s, p, o), context)
+            return
+        for triple, contexts in self.store.triples((s, p, o), context=None):
+            if self._visible(contexts):
+                yield triple
+        for identifier, base_graph in self.base_graphs.items():
+            if not self.inferred and identifier in INFERRED_GRAPHS:
+                continue
+            for triple in base_graph.triples((s, p, o)):
+                stored = next(self.store.triples(triple, context=None), None)
+                if stored is None or not self._visible(stored[1]):
+                    yield triple
+
+    def __len__(self):
+        if not self.inferred:
+            return sum(1 for _ in self.triples((None, None, None)))
+        num_base = sum(1 for base_graph in self.base_graphs.values() for triple in base_graph
+                       if next(self.store.triples(triple, context=None), None) is None)
+        return self.store.__len__(context=None) + num_base
+
+    def contexts(self, triple=None):
+        yield from super().contexts(triple)
+        for base_graph in self.base_graphs.values():
+            if triple is None or triple in base_graph:
+                yield base_graph
+
+
+class UnionView(UserGraph):
+    """
+    User graph on the store and base graphs of another user graph, optionally without the inferred triples
+    """
+    def __init__(self, graph, inferred=True):
+        super().__init__(graph.store, getattr(graph, 'base_files', ()), inferred)
+        self.namespace_manager = graph.namespace_manager
+
+
+def parse(graph, source, format=None):
+    """
+    Parses source into graph. For persistent stores the source is parsed in memory first and then added in
+    batches.
+    :param graph: graph
+    :param source: file name or file-like object
+    :param format: rdf format (default: guessed by rdflib)
+    """
+    if not is_persistent(graph):
+        graph.parse(source, format=format)
+        return
+    g = Graph()
+    g.parse(source, format=format)
+    copy_graph(g, graph)
+
+
+def default_graph(graph):
+    return graph.default_context if isinstance(graph, ConjunctiveGraph) else graph
+
+
+def copy_graph(source, target):
+    """
+    Adds the triples of source to target, into the same named graphs if both are ConjunctiveGraphs
+    """
+    if isinstance(source, ConjunctiveGraph) and isinstance(target, ConjunctiveGraph):
+        target.addN((s, p, o, c.identifier) for s, p, o, c in source.quads((None, None, None)))
+    else:
+        context = default_graph(target)
+        target.addN((s, p, o, context) for s, p, o in source)
+    for prefix, namespace in source.namespaces():
+        target.bind(prefix, namespace, override=False)
+
+
+def load_repo(graph, user_folder):
+    """
+    Loads the saved repository of a user space into graph: the snapshot or, if there is none, repo.ttl (into the
+    default graph)
+    :param graph: graph
+    :param user_folder: folder of user space
+    :return: file loaded or None
+    """
+    snapshot_file = path.join(user_folder, REPO_SNAPSHOT)
+    repo_file = path.join(user_folder, REPO)
+    if path.isfile(snapshot_file):
+        snapshot.load(graph, snapshot_file)
+        return snapshot_file
+    if path.isfile(repo_file):
+        default_graph(graph).parse(repo_file)
+        return repo_file
+    return None
+
+
+def new_graph(base_files=()):
+    """
+    Creates an in-memory graph that can replace the graph of a user space (see replace_graph)
+    :param base_files: rdf files of the shared ontology layered under the graph
+    :return: graph
+    """
+    g = UserGraph(journal.JournalMemory(), base_files)
+    g.bind_base_namespaces()
+    return g
+
+
+def drop_base_copies(graph):
+    """
+    Removes the copies of the base graphs from the store of a user graph (stored by older versions)
+    :return: number of triples removed
+    """
+    num_removed = 0
+    for identifier in graph.base_graphs:
+        context = Graph(store=graph.store, identifier=identifier)
+        num_triples = len(context)
+        if num_triples:
+            graph.store.remove((None, None, None), context)
+            num_removed += num_triples
+    if num_removed:
+        logging.info(f"{num_removed} triples of the stored ontology removed, the shared ontology is used instead")
+    return num_removed
+
+
+def open_graph(user_folder, store=MEMORY, base_files=()):
+    """
+    Opens the graph of a user space
+    :param user_folder: folder of user space
+    :param store: store (one of STORES)
+    :param base_files: rdf files of the shared ontology layered under the graph
+    :return: graph
+    """
+    if store == BERKELEYDB and not has_bsddb:
+        logging.warning(f"berkeleydb not installed: {SQLITE} store used instead of {BERKELEYDB}")
+        store = SQLITE
+    folder = store_folder(user_folder, store)
+    if folder in open_graphs:
+        return open_graphs[folder]
+    if store == MEMORY:
+        snapshot_file = path.join(user_folder, REPO_SNAPSHOT)
+        journal_file = path.join(user_folder, REPO_JOURNAL)
+        g = new_graph(base_files)
+        g.store.snapshot_stat = file_stat(snapshot_file)
+        repo_file = load_repo(g, user_folder)
+        _, journal_offset = journal.replay(g, journal_file)
+        if drop_base_copies(g) or repo_file != snapshot_file:
+            # from now on the snapshot is read, a repo.ttl written for a download is not read again
+            with write_lock(user_folder):
+                snapshot.save(g, snapshot_file)
+                open(journal_file, 'w').close()
+            g.store.snapshot_stat = file_stat(snapshot_file)
+            journal_offset = 0
+        g.store.open_journal(journal_file)
+        g.store.journal_offset = journal_offset
+        open_graphs[folder] = g
+        return g
+
+    g = UserGraph(store, base_files)
+    with write_lock(user_folder):
+        if g.open(folder, create=False) != VALID_STORE:
+            start_time = time.perf_counter()
+            g.open(folder, create=True)
+            g_init = ConjunctiveGraph(identifier=ASSERTED)
+            repo_file = load_repo(g_init, user_folder)
+            copy_graph(g_init, g)
+            g.commit()
+            logging.info(f"New {store} store {folder}: {len(g_init)} triples of {repo_file} "
+                         f"loaded in {time.perf_counter() - start_time:.2f}s")
+        g.bind_base_namespaces()
+        drop_base_copies(g)
+        g.commit()
+    open_graphs[folder] = g
+    return g
+
+
+def replace_graph(graph, new_graph, user_folder):
+    """
+    Replaces the content of the graph of a user space, e.g. by a graph created with new_graph. The new content is
+    saved.
+    :param graph: current graph
+    :param new_graph: new graph
+    :param user_folder: folder of user space
+    :return: graph to be used from now on
+    """
+    if new_graph is graph:
+        return graph
+    if not is_persistent(graph):
+        snapshot.save(new_graph, path.join(user_folder, REPO_SNAPSHOT))
+        graph.close()
+        open(path.join(user_folder, REPO_JOURNAL), 'w').close()
+        new_graph.store.snapshot_stat = file_stat(path.join(user_folder, REPO_SNAPSHOT))
+        new_graph.store.open_journal(path.join(user_folder, REPO_JOURNAL))
+        open_graphs[store_folder(user_folder, MEMORY)] = new_graph
+        return new_graph
+    graph.remove((None, None, None))
+    copy_graph(new_graph, graph)
+    graph.commit()
+    return graph
+
+
+def refresh_graph(graph, user_folder, wait=False):
+    """
+    Brings the graph of a user space up to date with the changes saved by other processes. A persistent store reads
+    them from disk anyway. A graph in memory replays the part of the journal written since it was loaded, or is
+    loaded again if the snapshot has been replaced. Unless wait is True nothing is done while another thread or
+    process changes the graph or while the journal would have to be replayed into a graph being read (it is caught
+    up with by the next call).
+    :param graph: graph opened with open_graph
+    :param user_folder: folder of user space
+    :param wait: wait for the writers and readers, e.g. before a change
+    :return: graph to be used from now on, True if it has changed
+    """
+    if is_persistent(graph):
+        return graph, hasattr(graph.store, 'changed') and graph.store.changed()
+    store = graph.store
+    if not isinstance(store, journal.JournalMemory):
+        return graph, False
+    journal_file = path.join(user_folder, REPO_JOURNAL)
+    with write_lock(user_folder, blocking=wait) as locked:
+        if not locked:
+            return graph, False
+        journal_size = path.getsize(journal_file) if path.isfile(journal_file) else 0
+        if file_stat(path.join(user_folder, REPO_SNAPSHOT)) != store.snapshot_stat or \
+                journal_size < store.journal_offset:
+            logging.info(f"Graph of {user_folder} replaced by another process: loaded again")
+            open_graphs.pop(store_folder(user_folder, MEMORY), None)
+            store.close_journal()
+            return open_graph(user_folder, MEMORY, graph.base_files), True
+        if journal_size == store.journal_offset:
+            return graph, False
+        with space_lock(user_folder).write(blocking=wait) as exclusive:
+            if not exclusive:
+                return graph, False
+            with store.paused_journal():
+                num_changes, store.journal_offset = journal.replay(graph, journal_file, store.journal_offset)
+        return graph, num_changes > 0
+
+
+def close_graph(user_folder, store=MEMORY):
+    """
+    Closes the graph of a user space opened with open_graph
+    """
+    graph = open_graphs.pop(store_folder(user_folder, store), None)
+    if graph is not None:
+        graph.close(commit_pending_transaction=True)
+
+
+def save_graph(graph, user_folder):
+    """
+    Saves the graph: commits the changes of a persistent store or writes the snapshot of a graph in memory and
+    truncates its journal
+    :param graph: graph
+    :param user_folder: folder of user space
+    """
+    if is_persistent(graph):
+        graph.commit()
+        if hasattr(graph.store, 'sync'):
+            graph.store.sync()
+    else:
+        snapshot.save(graph, path.join(user_folder, REPO_SNAPSHOT))
+        if isinstance(graph.store, journal.JournalMemory):
+            graph.store.snapshot_stat = file_stat(path.join(user_folder, REPO_SNAPSHOT))
+            graph.store.truncate_journal()
+
+
+def commit_graph(graph, user_folder):
+    """
+    Makes the changes of the graph durable: appended to the journal of a graph in memory (compacted into a new
+    snapshot if it has grown too large) or committed to a persistent store
+    :param graph: graph
+    :param user_folder: folder of user space
+    """
+    if is_persistent(graph) or not isinstance(graph.store, journal.JournalMemory):
+        save_graph(graph, user_folder)
+        return
+    graph.commit()
+    snapshot_file = path.join(user_folder, REPO_SNAPSHOT)
+    snapshot_size = os.path.getsize(snapshot_file) if path.isfile(snapshot_file) else 0
+    if graph.store.journal_size() > max(COMPACT_MIN_SIZE, COMPACT_RATIO * snapshot_size):
+        logging.info(f"Compact journal of {user_folder} ({graph.store.journal_size()} bytes)")
+        save_graph(graph, user_folder)
+
+
+def export_graph(graph, user_folder):
+    """
+    Serializes the union of the named graphs of graph without the inferred triples to repo.ttl for download
+    (whatever the store is)
+    :return: file name
+    """
+    repo_file = path.join(user_folder, REPO)
+    UnionView(graph, inferred=False).serialize(destination=repo_file, format='turtle')
+    return repo_file
+
+
+@atexit.register
+def close_graphs():
+    for folder, graph in open_graphs.items():
+        logging.info(f"Close store: {folder}")
+        graph.close(commit_pending_transaction=True)
+    open_graphs.clear()
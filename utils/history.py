@@ -1,69 +1,307 @@
-from datetime import datetime
+#
+#  History of queries or imports with back/forward navigation, kept as an append-only log of JSON lines: each
+#  append writes one line with the item, its time and metadata (e.g. the runtime of a query), so recording costs
+#  O(1) I/O whatever the size of the history. An item appended again moves to the end (found by a hash index, the
+#  older line becomes stale); the oldest items are dropped beyond max_index. The file is compacted (rewritten with
+#  the current entries) once the stale lines outnumber them. Files of older versions (one JSON dict of the items)
+#  are read as well and rewritten at the first compaction. refresh() reads the lines appended by other processes.
+#  Appends hold a shared flock of the file, a compaction an exclusive one, so no line of another process is lost.
+#     {"item": "SELECT ...", "time": 1760600000.0}
+#     {"item": "SELECT ...", "update": {"runtime": 0.012, "rows": 42}}
+#
 import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
 
-class History(list):
+try:
+    import fcntl
+except ImportError:  # no locking across processes (single process deployment)
+    fcntl = None
+
+COMPACT_MIN_LINES = 100  # stale lines (or stale entries in memory) never compacted
+
+
+def complete_line(raw_line):
+    """
+    :return: True if a last line without newline is complete (as written by older versions), False if it is still
+    being written
+    """
+    try:
+        json.loads(raw_line.decode('utf-8'))
+        return True
+    except ValueError:
+        return False
+
+
+class History:
     def __init__(self, filename=None, init_list=None, max_index=100):
-        super(History, self).__init__()
+        """
+        :param filename: file of the history (created by the first append if it does not exist)
+        :param init_list: items of a history without file
+        :param max_index: maximal number of items
+        """
         self.max_index = max_index
         self.filename = filename
-        if self.filename:
-            with open(self.filename) as fp:
-                d = json.load(fp)
-                self._list = list(d.values())
-            self.pointer = len(self._list) - 1
+        self._entries = list()  # entries in order of append, None if stale
+        self._index = dict()  # item -> position of its entry
+        self._start = 0  # position of the oldest entry
+        self._lines = 0  # lines of the file
+        self._offset = 0  # end of the lines of the file read or written
+        self._inode = None  # inode of the file (changed by a compaction)
+        self._held = None  # file of the inode kept open, so its number is not reused by another file
+        self._newline = False  # the file does not end with a newline (e.g. of older versions)
+        self.pointer = -1  # position of the current entry
+        self._lock = threading.Lock()  # appends of requests and updates of jobs
+        if self.filename and os.path.isfile(self.filename):
+            self._read()
         elif init_list:
-            self._list = init_list
-            self.pointer = len(self._list) - 1
-        else:
-            self._list = list()
-            self.pointer = -1
-
-    def append(self, item):
-        if item in self._list:
-            self._list.pop(self._list.index(item))
-        elif len(self._list) > self.max_index:
-            self._list.pop(0)
-        self._list.append(item)
-        self.pointer = len(self._list) - 1
-        self.save()
-
-    def save(self):
+            for item in init_list:
+                self._add({'item': item})
+        self.pointer = self._previous(len(self._entries))
+
+    def _read(self, offset=0):
+        fp = open(self.filename, 'rb')
+        inode = os.fstat(fp.fileno()).st_ino
+        if inode != self._inode and offset:
+            # replaced by a compaction of another process meanwhile
+            self._clear()
+            offset = 0
+        self._inode = inode
+        self._hold(fp)
+        tail = offset > 0
+        fp.seek(offset)
+        for raw_line in fp:
+            if not raw_line.endswith(b'\n'):
+                if tail or not complete_line(raw_line):
+                    # still being written by another process, read by the next refresh
+                    break
+                self._newline = True
+            offset += len(raw_line)
+            line = raw_line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning(f"History {self.filename}: invalid line ignored: {line[:80]}")
+                continue
+            self._lines += 1
+            if 'item' not in record:
+                # older versions: {"0": item, "1": item, ...}
+                for item in record.values():
+                    self._add({'item': item})
+            elif 'update' in record:
+                if record['item'] in self._index:
+                    self._entries[self._index[record['item']]].update(record['update'])
+            else:
+                self._add(record)
+        self._offset = offset
+
+    def refresh(self):
+        """
+        Reads the lines appended by other processes since the last read or write (the whole file if it has been
+        compacted meanwhile). The last item becomes the current one if there are any.
+        :return: True if the history has changed
+        """
+        if not self.filename:
+            return False
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return False
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return False
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._clear()
+        self._read(self._offset)
+        self.pointer = self._previous(len(self._entries))
+        return True
+
+    def _hold(self, fp):
+        if self._held:
+            self._held.close()
+        self._held = fp
+
+    def _clear(self):
+        self._entries, self._index, self._start, self._lines, self._offset = list(), dict(), 0, 0, 0
+        self._newline = False
+
+    @contextmanager
+    def _locked_file(self, exclusive=False):
+        """
+        Opens the file for appending with a shared or exclusive flock. Opened again if it has been replaced by a
+        compaction of another process while waiting for the lock.
+        """
+        while True:
+            fp = open(self.filename, 'ab', buffering=0)
+            try:
+                if fcntl is None:
+                    break
+                fcntl.flock(fp, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                if os.fstat(fp.fileno()).st_ino == os.stat(self.filename).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            fp.close()
+        try:
+            yield fp
+        finally:
+            fp.close()
+
+    def _add(self, entry):
+        position = self._index.pop(entry['item'], None)
+        if position is not None:
+            self._entries[position] = None
+        self._index[entry['item']] = len(self._entries)
+        self._entries.append(entry)
+        while len(self._index) > self.max_index:
+            while self._entries[self._start] is None:
+                self._start += 1
+            del self._index[self._entries[self._start]['item']]
+            self._entries[self._start] = None
+
+    def _write(self, record):
         if self.filename:
-            d = dict(zip([str(i) for i in range(0,len(self._list))], self._list))
-            with open(self.filename, 'w') as fp:
-                json.dump(d,fp)
+            data = (('\n' if self._newline else '') + json.dumps(record) + '\n').encode('utf-8')
+            with self._locked_file() as fp:
+                fp.write(data)
+                end = fp.tell()
+                inode = os.fstat(fp.fileno()).st_ino
+            if inode == self._inode and end - len(data) == self._offset:
+                # otherwise lines of other processes are in between, read with them by the next refresh
+                self._offset = end
+            self._newline = False
+            self._lines += 1
+        if max(self._lines, len(self._entries)) > 2 * len(self._index) + COMPACT_MIN_LINES:
+            self._compact()
+
+    def compact(self):
+        """
+        Rewrites the file with the current entries (including the lines appended by other processes) and drops the
+        stale entries
+        """
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        if not self.filename:
+            self._drop_stale()
+            return
+        with self._locked_file(exclusive=True) as fp:
+            self._refresh()
+            self._drop_stale()
+            tmp_file = f"{self.filename}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as tmp:
+                tmp.writelines(json.dumps(entry) + '\n' for entry in self._entries)
+            compacted = open(tmp_file, 'rb')
+            stat = os.fstat(fp.fileno())
+            if stat.st_ino != self._inode or stat.st_size != self._offset:
+                # appended without lock meanwhile (e.g. by an older version), compacted by the next append
+                compacted.close()
+                os.remove(tmp_file)
+                return
+            # size before other processes append to the new file (their lines are read by the next refresh)
+            stat = os.fstat(compacted.fileno())
+            os.replace(tmp_file, self.filename)
+        self._inode, self._offset = stat.st_ino, stat.st_size
+        self._hold(compacted)
+        self._lines = len(self._entries)
+        self._newline = False
+
+    def _drop_stale(self):
+        current = self.pointer_entry()
+        self._entries = [entry for entry in self._entries if entry is not None]
+        self._index = {entry['item']: position for position, entry in enumerate(self._entries)}
+        self._start = 0
+        self.pointer = self._index[current['item']] if current else -1
+
+    def append(self, item, **metadata):
+        """
+        Appends an item (moved to the end if it is in the history already) and makes it the current one
+        :param item: item, e.g. a query
+        :param metadata: metadata of the item, e.g. runtime=0.1
+        """
+        entry = dict(item=item, time=time.time(), **metadata)
+        with self._lock:
+            self._add(entry)
+            self.pointer = len(self._entries) - 1
+            self._write(entry)
+
+    def update(self, item, **metadata):
+        """
+        Adds metadata to an item of the history (without moving it), e.g. the runtime of a query when it is done
+        """
+        with self._lock:
+            if item not in self._index:
+                return
+            self._entries[self._index[item]].update(metadata)
+            self._write({'item': item, 'update': metadata})
+
+    def _previous(self, position):
+        position -= 1
+        while position >= self._start and self._entries[position] is None:
+            position -= 1
+        return position if position >= self._start else -1
+
+    def _next(self, position):
+        position += 1
+        while position < len(self._entries) and self._entries[position] is None:
+            position += 1
+        return position if position < len(self._entries) else -1
 
     def back(self):
         if self.pointer < 0:
             return None
-        if self.pointer > 0:
-            self.pointer -= 1
-        return self._list[self.pointer]
+        previous = self._previous(self.pointer)
+        if previous >= 0:
+            self.pointer = previous
+        return self._entries[self.pointer]['item']
 
     def forward(self):
         if self.pointer < 0:
             return None
-        if self.pointer < len(self._list) - 1:
-            self.pointer += 1
-        return self._list[self.pointer]
+        following = self._next(self.pointer)
+        if following >= 0:
+            self.pointer = following
+        return self._entries[self.pointer]['item']
 
     def last(self):
-        if self.pointer < 0:
-            return None
-        self.pointer = len(self._list) - 1
-        return self._list[self.pointer]
+        self.pointer = self._previous(len(self._entries))
+        return self.pointer_value()
+
+    def pointer_entry(self):
+        """
+        :return: current entry (item, time and metadata) or None
+        """
+        return self._entries[self.pointer] if self.pointer >= 0 else None
 
     def pointer_value(self):
-        if self.pointer < 0:
-            return None
-        return self._list[self.pointer]
+        entry = self.pointer_entry()
+        return entry['item'] if entry else None
 
     def pointer_str(self):
-        return f"{self.pointer}/{len(self._list) - 1}"
+        position = sum(1 for entry in self._entries[self._start:self.pointer] if entry is not None) \
+            if self.pointer >= 0 else -1
+        return f"{position}/{len(self) - 1}"
+
+    def __iter__(self):
+        return (entry['item'] for entry in self._entries[self._start:] if entry is not None)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, item):
+        return item in self._index
 
     def __str__(self):
-        str_list = [i for i in self._list]
-        return '\n'.join(str_list)
+        return '\n'.join(str(item) for item in self)
 
 
 if __name__ == '__main__':
@@ -80,4 +318,4 @@ if __name__ == '__main__':
     print(h.forward())
     print(h.forward())
     print(h.forward())
-    print(h.forward())
\ No newline at end of file
+    print(h.forward())
@@ -0,0 +1,443 @@
+#
+#  Background jobs: long running work (e.g. SPARQL queries) is submitted to a worker pool and identified by a job
+#  id. The web page polls the status of the job and fetches the result when it is done. A job can be cancelled:
+#  a queued job is not started, a running job stops at its next check(), e.g. at the next triple lookup of a
+#  CancellableGraph. The number of active jobs per user is limited.
+#  With a shared job folder the jobs are visible to all processes of a multi-process deployment (e.g. gunicorn
+#  workers): each process writes the state of its jobs as record <id>.json, the other processes read them as
+#  RemoteJobs and request a cancellation by the file <id>.cancel. The results stay in the process that has the job;
+#  another process requests one by the file <id>.fetch and reads it as JSON from <id>.result (see encode_result).
+#
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from rdflib.term import Identifier
+
+from utils import graph_store, result_export
+
+MAX_WORKERS = 4
+MAX_JOBS_PER_USER = 2
+JOB_TTL = 600  # seconds a finished job and its result are kept
+PUBLISH_INTERVAL = 1.0  # seconds between writes of the progress of a job to its record
+CANCEL_CHECK_INTERVAL = 0.5  # seconds between checks for a cancellation requested by another process
+REFRESH_INTERVAL = 0.2  # seconds a record read by another process is reused
+FETCH_INTERVAL = 0.1  # seconds between listings of the job folder for results requested by another process
+FETCH_TIMEOUT = 10  # seconds waited for a result requested from another process
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TERM_KEY = '$term'  # key of the JSON object of an rdf term in a result file
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLimitExceeded(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, user_id, kind, description, params=None):
+        """
+        :param user_id: user id of owner
+        :param kind: kind of job, e.g. 'query'
+        :param description: description shown to the user, e.g. the query
+        :param params: parameters needed to present the result
+        """
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.description = description
+        self.params = params or dict()
+        self.status = QUEUED
+        self._progress = ''
+        self.result = None
+        self.partial = None  # part of the result available while the job is running, e.g. rows fetched so far
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.publish = None  # function called with the job when its progress has changed
+        self.cancel_file = None  # file requesting the cancellation from another process
+        self._next_cancel_check = 0
+        self._cancel = threading.Event()
+
+    @property
+    def progress(self):
+        return self._progress
+
+    @progress.setter
+    def progress(self, progress):
+        self._progress = progress
+        if self.publish:
+            self.publish(self)
+
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        """
+        Raises JobCancelled if the job has been cancelled. Called by the job function at convenient points.
+        """
+        if self.cancel_file and time.monotonic() >= self._next_cancel_check:
+            self._next_cancel_check = time.monotonic() + CANCEL_CHECK_INTERVAL
+            if path.isfile(self.cancel_file):
+                self._cancel.set()
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def runtime(self):
+        if not self.started:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    def to_dict(self):
+        return {'id': self.id, 'kind': self.kind, 'description': self.description, 'status': self.status,
+                'progress': self.progress, 'error': self.error, 'submitted': self.submitted,
+                'runtime': round(self.runtime(), 3)}
+
+    def record(self):
+        """
+        State of the job shared with the other processes
+        """
+        return {'id': self.id, 'user_id': self.user_id, 'kind': self.kind, 'description': self.description,
+                'params': self.params, 'status': self.status, 'progress': self.progress, 'error': self.error,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished, 'pid': os.getpid(),
+                'has_result': self.result is not None}
+
+
+class RemoteJob(Job):
+    """
+    Job of another process read from its record in the shared job folder. Its state is read again when it is asked
+    whether it is active; its result is available when it is done (not while it is running).
+    """
+    def __init__(self, manager, record):
+        self.manager = manager
+        self._result = None
+        super().__init__(record['user_id'], record['kind'], record['description'], record['params'])
+        self.id = record['id']
+        self._refreshed = 0
+        self._load(record)
+
+    @property
+    def result(self):
+        if self._result is None and self.status == DONE:
+            self._result = self.manager.fetch_result(self.id)
+        return self._result
+
+    @result.setter
+    def result(self, result):
+        self._result = result
+
+    def _load(self, record):
+        self.status = record['status']
+        self._progress = record['progress']
+        self.error = record['error']
+        self.submitted, self.started, self.finished = record['submitted'], record['started'], record['finished']
+        if self.status in (QUEUED, RUNNING) and not process_alive(record['pid']):
+            self.status = FAILED
+            self.error = 'Worker process of the job has stopped'
+            self.finished = max(self.started or 0, self.submitted)
+        self._refreshed = time.monotonic()
+
+    def active(self):
+        if super().active() and time.monotonic() - self._refreshed >= REFRESH_INTERVAL:
+            record = self.manager.read_record(self.id)
+            if record:
+                self._load(record)
+        return super().active()
+
+
+def encode_result(result):
+    """
+    :return: result of a job as JSON value, its rdf terms (e.g. of the rows of a query) as {TERM_KEY: SPARQL JSON
+             binding}
+    """
+    if isinstance(result, Identifier):
+        return {TERM_KEY: result_export.json_term(result)}
+    if isinstance(result, (list, tuple)):
+        return [encode_result(value) for value in result]
+    if isinstance(result, dict):
+        return {key: encode_result(value) for key, value in result.items()}
+    return result
+
+
+def decode_result(value):
+    """
+    :return: result of a job encoded by encode_result (tuples as lists)
+    """
+    if isinstance(value, list):
+        return [decode_result(v) for v in value]
+    if isinstance(value, dict):
+        if TERM_KEY in value:
+            return result_export.json_to_term(value[TERM_KEY])
+        return {key: decode_result(v) for key, v in value.items()}
+    return value
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class CancellableGraph(graph_store.UnionView):
+    """
+    Union of the named graphs of a user graph (see UnionView). Each triple lookup checks whether the job has been
+    cancelled, so a query evaluated on it stops soon after the cancellation.
+    """
+    def __init__(self, graph, job, inferred=True):
+        super().__init__(graph, inferred)
+        self.job = job
+
+    def triples(self, triple_or_quad, context=None):
+        self.job.check()
+        return graph_store.UnionView.triples(self, triple_or_quad, context)
+
+
+class JobManager:
+    def __init__(self, max_workers=MAX_WORKERS, max_jobs_per_user=MAX_JOBS_PER_USER, ttl=JOB_TTL, folder=None):
+        """
+        :param max_workers: number of jobs run in parallel
+        :param max_jobs_per_user: number of queued or running jobs of a user
+        :param ttl: seconds a finished job is kept
+        :param folder: job folder shared with other processes (None: jobs are only visible to this process)
+        """
+        self.max_jobs_per_user = max_jobs_per_user
+        self.ttl = ttl
+        self.folder = folder
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.jobs = dict()
+        self._lock = threading.Lock()
+        self._published = dict()  # job id -> time of last write of its record
+        self._has_results = threading.Event()  # set while this process has results of jobs (see _serve_results)
+        if folder:
+            threading.Thread(target=self._serve_results, name='job-results', daemon=True).start()
+
+    #
+    # SHARED JOB FOLDER
+    #
+    def _file(self, job_id, extension):
+        return path.join(self.folder, job_id + extension)
+
+    def publish(self, job, force=False):
+        """
+        Writes the record of a job of this process (progress at most every PUBLISH_INTERVAL seconds)
+        """
+        if not self.folder:
+            return
+        now = time.monotonic()
+        if not force and now - self._published.get(job.id, 0) < PUBLISH_INTERVAL:
+            return
+        self._published[job.id] = now
+        tmp = f".{threading.get_ident()}.tmp"
+        with open(self._file(job.id, '.json' + tmp), 'w') as fp:
+            json.dump(job.record(), fp)
+        os.replace(self._file(job.id, '.json' + tmp), self._file(job.id, '.json'))
+
+    def read_record(self, job_id):
+        if not self.folder or not job_id.isalnum():
+            return None
+        try:
+            with open(self._file(job_id, '.json')) as fp:
+                return json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_result(self, job):
+        tmp = f".{threading.get_ident()}.tmp"
+        with open(self._file(job.id, '.result' + tmp), 'w', encoding='utf-8') as fp:
+            json.dump(encode_result(job.result), fp, ensure_ascii=False)
+        os.replace(self._file(job.id, '.result' + tmp), self._file(job.id, '.result'))
+
+    def read_result(self, job_id):
+        try:
+            with open(self._file(job_id, '.result'), encoding='utf-8') as fp:
+                return decode_result(json.load(fp))
+        except FileNotFoundError:
+            return None
+
+    def fetch_result(self, job_id):
+        """
+        Result of a job of another process: requested and waited for (at most FETCH_TIMEOUT seconds) unless it has
+        been written already
+        :return: result or None
+        """
+        result = self.read_result(job_id)
+        if result is not None:
+            return result
+        record = self.read_record(job_id)
+        if not record or not record.get('has_result') or not process_alive(record['pid']):
+            return None
+        open(self._file(job_id, '.fetch'), 'w').close()
+        deadline = time.monotonic() + FETCH_TIMEOUT
+        while result is None and time.monotonic() < deadline:
+            time.sleep(FETCH_INTERVAL)
+            result = self.read_result(job_id)
+        if result is None:
+            logging.warning(f"Result of job {job_id} not received from process {record['pid']}")
+        return result
+
+    def _serve_results(self):
+        """
+        Writes the results requested by other processes (runs in a daemon thread). While this process has results
+        the job folder is listed once per FETCH_INTERVAL, otherwise the thread waits for one.
+        """
+        while True:
+            self._has_results.wait()
+            time.sleep(FETCH_INTERVAL)
+            with self._lock:
+                done = {job.id: job for job in self.jobs.values() if job.status == DONE and job.result is not None}
+                if not done:
+                    self._has_results.clear()
+                    continue
+            for filename in os.listdir(self.folder):
+                job_id, extension = path.splitext(filename)
+                if extension == '.fetch' and job_id in done:
+                    self._write_result(done[job_id])
+                    os.remove(self._file(job_id, '.fetch'))
+
+    def remote_jobs(self, user_id=None):
+        """
+        Jobs of the other processes (of a user)
+        """
+        if not self.folder:
+            return list()
+        remote = list()
+        for filename in os.listdir(self.folder):
+            job_id, extension = path.splitext(filename)
+            if extension == '.json' and job_id not in self.jobs:
+                record = self.read_record(job_id)
+                if record and (user_id is None or record['user_id'] == user_id):
+                    remote.append(RemoteJob(self, record))
+        return remote
+
+    def submit(self, user_id, kind, description, func, *args, params=None, **kwargs):
+        """
+        Submits func(job, *args, **kwargs) as job. The return value of func becomes the result of the job.
+        :param user_id: user id
+        :param kind: kind of job
+        :param description: description
+        :param func: job function
+        :param params: parameters needed to present the result
+        :return: job
+        """
+        self.cleanup()
+        remote_active = [job for job in self.remote_jobs(user_id) if job.active()]
+        with self._lock:
+            active = [job for job in self.jobs.values() if job.user_id == user_id and job.active()] + remote_active
+            if len(active) >= self.max_jobs_per_user:
+                raise JobLimitExceeded(f"Only {self.max_jobs_per_user} jobs per user at a time. "
+                                       f"Wait for or cancel a running job.")
+            job = Job(user_id, kind, description, params)
+            if self.folder:
+                job.publish = self.publish
+                job.cancel_file = self._file(job.id, '.cancel')
+            self.jobs[job.id] = job
+            self.publish(job, force=True)
+            job.future = self.executor.submit(self._run, job, func, args, kwargs)
+        logging.info(f"Job {job.id} ({kind}) submitted by {user_id}")
+        return job
+
+    def add_result(self, user_id, kind, description, result, params=None):
+        """
+        Registers a result that is already available (e.g. cached) as done job, so it is presented like the result
+        of a job that has been run
+        :return: job
+        """
+        self.cleanup()
+        job = Job(user_id, kind, description, params)
+        job.result = result
+        job.status = DONE
+        job.started = job.finished = time.time()
+        with self._lock:
+            self.jobs[job.id] = job
+            self._has_results.set()
+        self.publish(job, force=True)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancelled():
+            job.status = CANCELLED
+            job.finished = time.time()
+            self.publish(job, force=True)
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        self.publish(job, force=True)
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = DONE
+            with self._lock:
+                self._has_results.set()
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            self.publish(job, force=True)
+        logging.info(f"Job {job.id} {job.status} after {job.runtime():.3f}s")
+
+    def get(self, job_id, user_id):
+        """
+        :return: job of user (of this or another process) or None
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            record = self.read_record(job_id)
+            job = RemoteJob(self, record) if record else None
+        return job if job and job.user_id == user_id else None
+
+    def user_jobs(self, user_id):
+        return sorted([job for job in self.jobs.values() if job.user_id == user_id] + self.remote_jobs(user_id),
+                      key=lambda job: job.submitted)
+
+    def cancel(self, job):
+        if isinstance(job, RemoteJob):
+            open(self._file(job.id, '.cancel'), 'w').close()
+            logging.info(f"Job {job.id} of another process cancelled")
+            return
+        job._cancel.set()
+        if job.status == QUEUED and job.future.cancel():
+            job.status = CANCELLED
+            job.finished = time.time()
+            self.publish(job, force=True)
+        logging.info(f"Job {job.id} cancelled ({job.status})")
+
+    def cleanup(self):
+        """
+        Removes finished jobs older than ttl (and their records in the shared job folder)
+        """
+        expired = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job.id for job in self.jobs.values() if job.finished and job.finished < expired]:
+                del self.jobs[job_id]
+                self._published.pop(job_id, None)
+        for job in self.remote_jobs() if self.folder else list():
+            if job.finished and job.finished < expired:
+                for extension in ('.json', '.result', '.cancel', '.fetch'):
+                    if path.isfile(self._file(job.id, extension)):
+                        os.remove(self._file(job.id, extension))
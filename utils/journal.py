@@ -0,0 +1,174 @@
+#
+#  Append-only journal of the changes of an in-memory graph. Each added or removed triple is appended as an
+#  N-Quads line (with the named graph it is added to or removed from) prefixed with '+' or '-' as it happens, so
+#  saving a change costs I/O in the size of the change instead of the size of the graph. At startup the journal is
+#  replayed on top of the last snapshot; compaction writes a new snapshot and truncates the journal. Lines without
+#  graph (N-Triples of older versions) belong to the default graph.
+#     + <https://example.com/s> <https://example.com/p> "o" <urn:x-rdflib:default> .
+#     - <https://example.com/s> <https://example.com/p> "o" <urn:x-rdflib:default> .
+#
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os import path
+
+from rdflib import Graph, ConjunctiveGraph
+from rdflib.plugins.parsers.nquads import NQuadsParser
+from rdflib.plugins.serializers.nquads import _nq_row
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib.plugins.stores.memory import Memory
+
+ADDED = '+'
+REMOVED = '-'
+
+
+def journal_line(op, triple, context=None):
+    return op + ' ' + (_nt_row(triple) if context is None else _nq_row(triple, context.identifier))
+
+
+class BNodeIds(dict):
+    """
+    Blank node context of the journal parser keeping the ids of the blank nodes of the graph
+    """
+    def get(self, key, default=None):
+        return key
+
+
+class JournalSink:
+    """
+    Sink of the journal parser keeping the last quad
+    """
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.context = None
+        self.last = None
+
+    def get_context(self, identifier):
+        self.context = identifier
+        return self
+
+    def add(self, triple):
+        self.last = triple
+
+
+def replay(graph, filename, offset=0):
+    """
+    Applies the changes of a journal to graph
+    :param graph: graph (the changes go to its named graphs if it is a ConjunctiveGraph)
+    :param filename: journal file
+    :param offset: position in the journal of the first change to apply, e.g. the end of the changes applied before
+    :return: number of changes, position after the last complete line
+    """
+    if not path.isfile(filename):
+        return 0, 0
+    start_time = time.perf_counter()
+    sink = JournalSink(graph.default_context.identifier if isinstance(graph, ConjunctiveGraph) else graph.identifier)
+    parser = NQuadsParser(sink=sink)
+    contexts = dict()
+    bnode_ids = BNodeIds()
+    num_changes = 0
+    with open(filename, 'rb') as fp:
+        fp.seek(offset)
+        for raw_line in fp:
+            if not raw_line.endswith(b'\n'):
+                # still being written by another process, applied by the next replay
+                break
+            offset += len(raw_line)
+            line = raw_line.decode('utf-8')
+            op, parser.line = line[0], line[1:-1]
+            if op not in (ADDED, REMOVED):
+                logging.warning(f"Journal {filename}: invalid line ignored: {line[:80]}")
+                continue
+            parser.parseline(bnode_context=bnode_ids)
+            context = contexts.get(sink.context)
+            if context is None:
+                context = contexts[sink.context] = Graph(store=graph.store, identifier=sink.context) \
+                    if isinstance(graph, ConjunctiveGraph) else graph
+            if op == ADDED:
+                context.add(sink.last)
+            else:
+                context.remove(sink.last)
+            num_changes += 1
+    logging.info(f"Journal replayed: {filename} ({num_changes} changes) in {time.perf_counter() - start_time:.2f}s")
+    return num_changes, offset
+
+
+class JournalMemory(Memory):
+    """
+    Memory store writing its changes to a journal once open_journal has been called. Changes become durable with
+    commit(). journal_offset is the end of the journal the store is up to date with, snapshot_stat identifies the
+    snapshot it has been loaded from (changes of other processes are detected by them, see graph_store).
+    """
+    def __init__(self, configuration=None, identifier=None):
+        super().__init__(configuration, identifier)
+        self.journal = None
+        self.journal_offset = 0
+        self.snapshot_stat = None
+        self._journal_lock = threading.Lock()
+
+    def open_journal(self, filename):
+        self.journal = open(filename, 'a', encoding='utf-8')
+        self.journal_offset = self.journal.tell()
+
+    @contextmanager
+    def paused_journal(self):
+        """
+        Changes made in the context are not written to the journal, e.g. changes replayed from it
+        """
+        with self._journal_lock:
+            journal, self.journal = self.journal, None
+        try:
+            yield
+        finally:
+            self.journal = journal
+
+    def close_journal(self):
+        with self._journal_lock:
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+    def truncate_journal(self):
+        with self._journal_lock:
+            if self.journal:
+                self.journal.seek(0)
+                self.journal.truncate()
+                self._sync()
+                self.journal_offset = 0
+
+    def journal_size(self):
+        return self.journal.tell() if self.journal else 0
+
+    def _sync(self):
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def add(self, triple, context, quoted=False):
+        super().add(triple, context, quoted)
+        if self.journal:
+            with self._journal_lock:
+                self.journal.write(journal_line(ADDED, triple, context))
+
+    def remove(self, triple_pattern, context=None):
+        if self.journal:
+            # without context the triples are removed from all graphs they are in
+            removed = [journal_line(REMOVED, triple, c)
+                       for triple, contexts in self.triples(triple_pattern, context)
+                       for c in ([context] if context is not None else list(contexts))]
+        super().remove(triple_pattern, context)
+        if self.journal and removed:
+            with self._journal_lock:
+                self.journal.writelines(removed)
+
+    def commit(self):
+        with self._journal_lock:
+            if self.journal:
+                self._sync()
+                self.journal_offset = self.journal.tell()
+
+    def close(self, commit_pending_transaction=False):
+        if commit_pending_transaction:
+            self.commit()
+        self.close_journal()
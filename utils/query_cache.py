@@ -0,0 +1,64 @@
+#
+#  Cache of prepared (parsed and algebra-translated) SPARQL queries and updates. Parsing with pyparsing dominates
+#  the runtime of small queries, so stored queries, query history and query templates are parsed once and then
+#  executed with initBindings.
+#
+import re
+
+from rdflib.plugins.sparql.processor import prepareQuery, prepareUpdate
+
+from utils import cache
+
+QUERY_CACHE_SIZE = 256
+
+prepared_queries = cache.LRUCache(maxsize=QUERY_CACHE_SIZE)
+
+
+def is_update(statement):
+    return re.match(r'\s*(PREFIX\s+\S*\s*<[^>]*>\s*|BASE\s+<[^>]*>\s*)*'
+                    r'(INSERT|DELETE|LOAD|CLEAR|CREATE|DROP|COPY|MOVE|ADD|WITH)\b', statement, re.IGNORECASE) is not None
+
+
+def prepare(graph, statement):
+    """
+    Returns prepared query or update of statement from cache. The prefixes bound in graph are part of the key
+    because they are resolved when the statement is prepared.
+    :param graph: graph the statement is run on
+    :param statement: SPARQL query or update
+    :return: prepared query or update
+    """
+    namespaces = tuple(graph.namespaces())
+    key = (statement, namespaces)
+    prepared = prepared_queries.get(key)
+    if prepared is None:
+        if is_update(statement):
+            prepared = prepareUpdate(statement, initNs=dict(namespaces))
+        else:
+            prepared = prepareQuery(statement, initNs=dict(namespaces))
+        prepared_queries.set(key, prepared)
+    return prepared
+
+
+def query(graph, statement, bindings=None):
+    """
+    Runs query on graph using the prepared query cache
+    :param graph: graph
+    :param statement: SPARQL query
+    :param bindings: dict of variable name -> term
+    :return: query result
+    """
+    return graph.query(prepare(graph, statement), initBindings=bindings)
+
+
+def update(graph, statement, bindings=None):
+    """
+    Runs update on graph using the prepared query cache
+    :param graph: graph
+    :param statement: SPARQL update
+    :param bindings: dict of variable name -> term
+    """
+    return graph.update(prepare(graph, statement), initBindings=bindings)
+
+
+def stats():
+    return prepared_queries.stats()
@@ -0,0 +1,447 @@
+#
+#  Incremental materialization of the RDFS or OWL-RL closure of a graph. The inferred triples are added to a named
+#  graph of the (conjunctive) graph, so asserted and inferred triples can be told apart.
+#  New triples are propagated semi-naively: a rule is only evaluated with a new triple in one of its body atoms,
+#  joined with the graph, so adding triples costs time in the size of their consequences instead of the size of the
+#  graph. Removed triples are retracted with DRed (delete and rederive): the inferred triples depending on them are
+#  deleted, then those with another derivation are derived again.
+#     r = Reasoner(graph, graph.get_context(INFERRED), OWLRL)
+#     r.closure()            # all triples of graph
+#     r.add(new_triples)     # after new_triples have been added to graph
+#     r.remove(old_triples)  # after old_triples have been removed from graph
+#
+import logging
+import time
+from collections import deque
+
+from rdflib import Graph, ConjunctiveGraph
+from rdflib.namespace import RDF, RDFS, OWL
+from rdflib.term import URIRef, Literal, Variable
+
+RDFS_PROFILE = 'RDFS'
+OWLRL_PROFILE = 'OWL-RL'
+PROGRESS_INTERVAL = 10000  # processed triples between progress calls
+
+PREFIXES = {'rdf': RDF, 'rdfs': RDFS, 'owl': OWL}
+
+# name -> (body, head): atoms separated by ' . ', '?x' is a variable, 'a' is rdf:type
+RDFS_RULES = {
+    'rdf1': ('?x ?p ?y', '?p a rdf:Property'),
+    'rdfs2': ('?p rdfs:domain ?c . ?x ?p ?y', '?x a ?c'),
+    'rdfs3': ('?p rdfs:range ?c . ?x ?p ?y', '?y a ?c'),
+    'rdfs4a': ('?x ?p ?y', '?x a rdfs:Resource'),
+    'rdfs4b': ('?x ?p ?y', '?y a rdfs:Resource'),
+    'rdfs5': ('?p rdfs:subPropertyOf ?q . ?q rdfs:subPropertyOf ?r', '?p rdfs:subPropertyOf ?r'),
+    'rdfs6': ('?p a rdf:Property', '?p rdfs:subPropertyOf ?p'),
+    'rdfs7': ('?p rdfs:subPropertyOf ?q . ?x ?p ?y', '?x ?q ?y'),
+    'rdfs8': ('?c a rdfs:Class', '?c rdfs:subClassOf rdfs:Resource'),
+    'rdfs9': ('?c rdfs:subClassOf ?d . ?x a ?c', '?x a ?d'),
+    'rdfs10': ('?c a rdfs:Class', '?c rdfs:subClassOf ?c'),
+    'rdfs11': ('?c rdfs:subClassOf ?d . ?d rdfs:subClassOf ?e', '?c rdfs:subClassOf ?e'),
+    'rdfs12': ('?p a rdfs:ContainerMembershipProperty', '?p rdfs:subPropertyOf rdfs:member'),
+    'rdfs13': ('?d a rdfs:Datatype', '?d rdfs:subClassOf rdfs:Literal'),
+}
+
+# OWL 2 RL rules of properties, equality, class and property equivalence, restrictions and schema. Deliberately
+# omitted (tests/test_reasoner.py compares the closure with owlrl):
+#   - the axiomatic triples (e.g. owl:Thing a owl:Class) and their consequences, rdfs1 and the datatype rules dt-*,
+#     which only add triples about the vocabulary or literals
+#   - eq-ref (every resource owl:sameAs itself), which doubles the size of the closure without information
+#   - the rules of lists and cardinalities: prp-spo2, prp-key, cls-int1/2, cls-uni, cls-oo, cls-maxc2,
+#     cls-maxqc3/4, scm-int, scm-uni
+#   - the consistency checks, which derive no triples: eq-diff1-3, prp-irp, prp-asyp, prp-pdw, prp-adp, prp-npa1/2,
+#     cls-nothing2, cls-com, cls-maxc1, cls-maxqc1/2, cax-dw, cax-adc, dt-not-type
+OWLRL_RULES = {
+    'prp-symp': ('?p a owl:SymmetricProperty . ?x ?p ?y', '?y ?p ?x'),
+    'prp-trp': ('?p a owl:TransitiveProperty . ?x ?p ?y . ?y ?p ?z', '?x ?p ?z'),
+    'prp-inv1': ('?p owl:inverseOf ?q . ?x ?p ?y', '?y ?q ?x'),
+    'prp-inv2': ('?p owl:inverseOf ?q . ?x ?q ?y', '?y ?p ?x'),
+    'prp-eqp1': ('?p owl:equivalentProperty ?q . ?x ?p ?y', '?x ?q ?y'),
+    'prp-eqp2': ('?p owl:equivalentProperty ?q . ?x ?q ?y', '?x ?p ?y'),
+    'prp-fp': ('?p a owl:FunctionalProperty . ?x ?p ?y1 . ?x ?p ?y2', '?y1 owl:sameAs ?y2'),
+    'prp-ifp': ('?p a owl:InverseFunctionalProperty . ?x1 ?p ?y . ?x2 ?p ?y', '?x1 owl:sameAs ?x2'),
+    'eq-sym': ('?x owl:sameAs ?y', '?y owl:sameAs ?x'),
+    'eq-trans': ('?x owl:sameAs ?y . ?y owl:sameAs ?z', '?x owl:sameAs ?z'),
+    'eq-rep-s': ('?s owl:sameAs ?s2 . ?s ?p ?o', '?s2 ?p ?o'),
+    'eq-rep-p': ('?p owl:sameAs ?p2 . ?s ?p ?o', '?s ?p2 ?o'),
+    'eq-rep-o': ('?o owl:sameAs ?o2 . ?s ?p ?o', '?s ?p ?o2'),
+    'cax-eqc1': ('?c owl:equivalentClass ?d . ?x a ?c', '?x a ?d'),
+    'cax-eqc2': ('?c owl:equivalentClass ?d . ?x a ?d', '?x a ?c'),
+    'cls-hv1': ('?x owl:hasValue ?y . ?x owl:onProperty ?p . ?u a ?x', '?u ?p ?y'),
+    'cls-hv2': ('?x owl:hasValue ?y . ?x owl:onProperty ?p . ?u ?p ?y', '?u a ?x'),
+    'cls-svf1': ('?x owl:someValuesFrom ?y . ?x owl:onProperty ?p . ?u ?p ?v . ?v a ?y', '?u a ?x'),
+    'cls-svf2': ('?x owl:someValuesFrom owl:Thing . ?x owl:onProperty ?p . ?u ?p ?v', '?u a ?x'),
+    'cls-avf': ('?x owl:allValuesFrom ?y . ?x owl:onProperty ?p . ?u a ?x . ?u ?p ?v', '?v a ?y'),
+    'scm-eqc1': ('?c owl:equivalentClass ?d', '?c rdfs:subClassOf ?d . ?d rdfs:subClassOf ?c'),
+    'scm-eqc2': ('?c rdfs:subClassOf ?d . ?d rdfs:subClassOf ?c', '?c owl:equivalentClass ?d'),
+    'scm-eqp1': ('?p owl:equivalentProperty ?q', '?p rdfs:subPropertyOf ?q . ?q rdfs:subPropertyOf ?p'),
+    'scm-eqp2': ('?p rdfs:subPropertyOf ?q . ?q rdfs:subPropertyOf ?p', '?p owl:equivalentProperty ?q'),
+    'scm-dom1': ('?p rdfs:domain ?c . ?c rdfs:subClassOf ?d', '?p rdfs:domain ?d'),
+    'scm-dom2': ('?q rdfs:domain ?c . ?p rdfs:subPropertyOf ?q', '?p rdfs:domain ?c'),
+    'scm-rng1': ('?p rdfs:range ?c . ?c rdfs:subClassOf ?d', '?p rdfs:range ?d'),
+    'scm-rng2': ('?q rdfs:range ?c . ?p rdfs:subPropertyOf ?q', '?p rdfs:range ?c'),
+    'scm-cls': ('?c a owl:Class', '?c rdfs:subClassOf ?c . ?c owl:equivalentClass ?c . '
+                '?c rdfs:subClassOf owl:Thing . owl:Nothing rdfs:subClassOf ?c'),
+    'scm-op': ('?p a owl:ObjectProperty', '?p rdfs:subPropertyOf ?p . ?p owl:equivalentProperty ?p'),
+    'scm-dp': ('?p a owl:DatatypeProperty', '?p rdfs:subPropertyOf ?p . ?p owl:equivalentProperty ?p'),
+    'scm-hv': ('?c1 owl:hasValue ?i . ?c1 owl:onProperty ?p1 . ?c2 owl:hasValue ?i . ?c2 owl:onProperty ?p2 . '
+               '?p1 rdfs:subPropertyOf ?p2', '?c1 rdfs:subClassOf ?c2'),
+    'scm-svf1': ('?c1 owl:someValuesFrom ?y1 . ?c1 owl:onProperty ?p . ?c2 owl:someValuesFrom ?y2 . '
+                 '?c2 owl:onProperty ?p . ?y1 rdfs:subClassOf ?y2', '?c1 rdfs:subClassOf ?c2'),
+    'scm-svf2': ('?c1 owl:someValuesFrom ?y . ?c1 owl:onProperty ?p1 . ?c2 owl:someValuesFrom ?y . '
+                 '?c2 owl:onProperty ?p2 . ?p1 rdfs:subPropertyOf ?p2', '?c1 rdfs:subClassOf ?c2'),
+    'scm-avf1': ('?c1 owl:allValuesFrom ?y1 . ?c1 owl:onProperty ?p . ?c2 owl:allValuesFrom ?y2 . '
+                 '?c2 owl:onProperty ?p . ?y1 rdfs:subClassOf ?y2', '?c1 rdfs:subClassOf ?c2'),
+    'scm-avf2': ('?c1 owl:allValuesFrom ?y . ?c1 owl:onProperty ?p1 . ?c2 owl:allValuesFrom ?y . '
+                 '?c2 owl:onProperty ?p2 . ?p1 rdfs:subPropertyOf ?p2', '?c2 rdfs:subClassOf ?c1'),
+}
+
+
+class Rule:
+    def __init__(self, name, body, head):
+        """
+        :param name: name of rule, e.g. 'rdfs9'
+        :param body: atoms of body, e.g. '?c rdfs:subClassOf ?d . ?x a ?c'
+        :param head: atoms of head, e.g. '?x a ?d'
+        """
+        self.name = name
+        self.body = parse_atoms(body)
+        self.head = parse_atoms(head)
+
+
+def parse_term(token):
+    if token.startswith('?'):
+        return Variable(token[1:])
+    if token == 'a':
+        return RDF.type
+    prefix, local = token.split(':')
+    return PREFIXES[prefix][local]
+
+
+def parse_atoms(text):
+    return [tuple(parse_term(token) for token in atom.split()) for atom in text.split(' . ')]
+
+
+PROFILES = {RDFS_PROFILE: [Rule(name, *rule) for name, rule in RDFS_RULES.items()],
+            OWLRL_PROFILE: [Rule(name, *rule) for name, rule in {**RDFS_RULES, **OWLRL_RULES}.items()]}
+
+
+#
+# MATCHING
+#
+def unify(atom, triple, bindings):
+    """
+    :return: bindings extended by the variables of atom matching triple or None if atom does not match
+    """
+    bindings = dict(bindings)
+    for term, value in zip(atom, triple):
+        if isinstance(term, Variable):
+            if bindings.setdefault(term, value) != value:
+                return None
+        elif term != value:
+            return None
+    return bindings
+
+
+def substitute(atom, bindings):
+    return tuple(bindings.get(term, term) if isinstance(term, Variable) else term for term in atom)
+
+
+def num_bound(atom):
+    return sum(1 for term in atom if not isinstance(term, Variable))
+
+
+def solutions(atoms, bindings, graphs, accept=None):
+    """
+    Joins atoms with the triples of graphs, most selective atom first
+    :param atoms: atoms to be matched
+    :param bindings: variable bindings so far
+    :param graphs: graphs matched
+    :param accept: function returning False for triples not to be matched
+    :return: generator of bindings
+    """
+    if not atoms:
+        yield bindings
+        return
+    atoms = [substitute(atom, bindings) for atom in atoms]
+    i = max(range(len(atoms)), key=lambda k: num_bound(atoms[k]))
+    pattern = tuple(None if isinstance(term, Variable) else term for term in atoms[i])
+    rest = atoms[:i] + atoms[i + 1:]
+    for graph in graphs:
+        for triple in graph.triples(pattern):
+            if accept and not accept(triple):
+                continue
+            extended = unify(atoms[i], triple, bindings)
+            if extended is not None:
+                yield from solutions(rest, extended, graphs, accept)
+
+
+def valid(triple):
+    """
+    False for the instances of rule heads that are no rdf triples (literal subject, predicate not an uri) or trivial
+    """
+    s, p, o = triple
+    return not isinstance(s, Literal) and isinstance(p, URIRef) and not (p == OWL.sameAs and s == o)
+
+
+class ChangeRecorder(Graph):
+    """
+    Graph wrapping another graph (e.g. for a SPARQL update or a parser) that records the triples actually added
+    and removed through it. Triples are added to the default graph of a ConjunctiveGraph, also if they are in
+    another named graph already.
+    """
+    def __init__(self, graph):
+        super().__init__(store=graph.store, identifier=graph.identifier, namespace_manager=graph.namespace_manager)
+        self.graph = graph
+        self.target = graph.default_context if isinstance(graph, ConjunctiveGraph) else graph
+        self.added = list()
+        self.removed = list()
+
+    def triples(self, triple):
+        return self.graph.triples(triple)
+
+    def add(self, triple):
+        if triple not in self:
+            self.added.append(triple)
+            self.target.add(triple)
+        elif self.target is not self.graph and triple not in self.target:
+            self.target.add(triple)
+        return self
+
+    def addN(self, quads):
+        """
+        Adds the triples of quads to the target graph in one batch
+        """
+        batch = list()
+        for triple in dict.fromkeys((s, p, o) for s, p, o, _ in quads):
+            if triple not in self:
+                self.added.append(triple)
+                batch.append(triple)
+            elif self.target is not self.graph and triple not in self.target:
+                batch.append(triple)
+        self.target.addN((s, p, o, self.target) for s, p, o in batch)
+        return self
+
+    def remove(self, triple):
+        self.removed.extend(list(self.triples(triple)))
+        self.graph.remove(triple)
+        return self
+
+
+class StagedChanges(ChangeRecorder):
+    """
+    ChangeRecorder keeping the changes apart from the wrapped graph until apply() is called: reading through it
+    sees the graph with the changes, the wrapped graph stays unchanged meanwhile (e.g. for the queries run while an
+    import is fetched). added and removed are recorded by apply().
+    """
+    def __init__(self, graph):
+        super().__init__(graph)
+        self._staged = Graph()  # triples to add that are not in graph
+        self._target_added = set()  # triples of graph to add to the target graph as well
+        self._removed = set()  # triples of graph to remove
+
+    def triples(self, triple):
+        for t in self.graph.triples(triple):
+            if t not in self._removed:
+                yield t
+        yield from self._staged.triples(triple)
+
+    def __len__(self):
+        return len(self.graph) - len(self._removed) + len(self._staged)
+
+    def add(self, triple):
+        if triple in self._removed:
+            self._removed.discard(triple)
+        elif triple not in self:
+            self._staged.add(triple)
+        elif self.target is not self.graph and triple not in self.target:
+            self._target_added.add(triple)
+        return self
+
+    def addN(self, quads):
+        for s, p, o, _ in quads:
+            self.add((s, p, o))
+        return self
+
+    def remove(self, triple):
+        for t in list(self.triples(triple)):
+            if t in self._staged:
+                self._staged.remove(t)
+            else:
+                self._removed.add(t)
+            self._target_added.discard(t)
+        return self
+
+    def apply(self):
+        """
+        Applies the staged changes to the wrapped graph
+        """
+        self.removed = list(self._removed)
+        self.added = list(self._staged)
+        for triple in self.removed:
+            self.graph.remove(triple)
+        self.target.addN((s, p, o, self.target) for s, p, o in self.added + list(self._target_added))
+        self._staged = Graph()
+        self._target_added = set()
+        self._removed = set()
+        return self
+
+
+#
+# REASONER
+#
+class Reasoner:
+    def __init__(self, graph, inferred, profile=RDFS_PROFILE, progress=None):
+        """
+        :param graph: ConjunctiveGraph of asserted and inferred triples
+        :param inferred: named graph of graph the inferred triples are added to
+        :param profile: RDFS_PROFILE or OWLRL_PROFILE
+        :param progress: function called with the statistics every PROGRESS_INTERVAL processed triples (may raise an
+        exception to stop)
+        """
+        self.graph = graph
+        self.inferred = inferred
+        self.rules = PROFILES[profile]
+        self.progress = progress
+        self.stats = {'processed': 0, 'inferred': 0, 'retracted': 0, 'rederived': 0}
+        # rules by body atom: predicate -> [(rule, index of atom)], atoms with a variable predicate under None
+        self.triggers = dict()
+        for rule in self.rules:
+            for i, atom in enumerate(rule.body):
+                key = None if isinstance(atom[1], Variable) else atom[1]
+                self.triggers.setdefault(key, list()).append((rule, i))
+
+    def consequences(self, triple, graphs):
+        """
+        Instances of rule heads with triple matching a body atom and the other body atoms matching triples of graphs
+        """
+        for rule, i in self.triggers.get(triple[1], list()) + self.triggers.get(None, list()):
+            bindings = unify(rule.body[i], triple, dict())
+            if bindings is None:
+                continue
+            for solution in solutions(rule.body[:i] + rule.body[i + 1:], bindings, graphs):
+                for atom in rule.head:
+                    head = substitute(atom, solution)
+                    if valid(head):
+                        yield head
+
+    def derivable(self, triple, accept=None):
+        """
+        True if a rule derives triple from the triples of the graph
+        :param accept: function returning False for triples not to be used
+        """
+        for rule in self.rules:
+            for atom in rule.head:
+                bindings = unify(atom, triple, dict())
+                if bindings is not None and \
+                        next(solutions(rule.body, bindings, [self.graph], accept), None) is not None:
+                    return True
+        return False
+
+    def asserted(self, triple):
+        """
+        True if triple is in a named graph of graph other than the inferred triples
+        """
+        return any(context.identifier != self.inferred.identifier for context in self.graph.contexts(triple))
+
+    def _processed(self):
+        self.stats['processed'] += 1
+        if self.progress and self.stats['processed'] % PROGRESS_INTERVAL == 0:
+            self.progress(self.stats)
+
+    def propagate(self, triples):
+        """
+        Adds the consequences of triples (in graph) to inferred, semi-naively until nothing new is inferred
+        :return: number of inferred triples
+        """
+        num_inferred = self.stats['inferred']
+        queue = deque(triples)
+        while queue:
+            triple = queue.popleft()
+            for head in self.consequences(triple, [self.graph]):
+                if head not in self.graph:
+                    self.inferred.add(head)
+                    self.stats['inferred'] += 1
+                    queue.append(head)
+            self._processed()
+        return self.stats['inferred'] - num_inferred
+
+    def closure(self, triples=None):
+        """
+        Materializes the closure of all triples of graph
+        :param triples: triples of graph to propagate (default: all), e.g. without triples whose closure is in graph
+        already
+        :return: number of inferred triples
+        """
+        start_time = time.perf_counter()
+        num_inferred = self.propagate(list(self.graph if triples is None else triples))
+        logging.info(f"Closure: {num_inferred} triples inferred from {self.stats['processed']} triples "
+                     f"in {time.perf_counter() - start_time:.2f}s")
+        return num_inferred
+
+    def add(self, triples):
+        """
+        Propagates asserted triples that have been added to graph. Inferred triples among them stay in inferred as
+        well, they are only retracted when they are neither asserted nor derivable any more.
+        :return: number of inferred triples
+        """
+        start_time = time.perf_counter()
+        triples = list(triples)
+        num_inferred = self.propagate(triples)
+        logging.info(f"Added {len(triples)} triples: {num_inferred} triples inferred "
+                     f"in {time.perf_counter() - start_time:.2f}s")
+        return num_inferred
+
+    def remove(self, triples):
+        """
+        Retracts the consequences of triples that have been removed from graph (DRed): the inferred triples derived
+        from them are deleted, those with another derivation are derived again.
+        :return: number of retracted inferred triples
+        """
+        start_time = time.perf_counter()
+        # a removed triple only left in inferred may have lost its derivation while it was asserted: it is deleted
+        # and rederived like the others
+        for triple in triples:
+            if triple in self.inferred and not self.asserted(triple):
+                self.inferred.remove(triple)
+        triples = [triple for triple in triples if triple not in self.graph]
+        deleted = Graph()
+        for triple in triples:
+            deleted.add(triple)
+
+        # overdelete: inferred triples with a derivation using a deleted triple, unless they are derived from
+        # well-founded triples (asserted or kept before), e.g. 'rdf:type a rdf:Property' of any remaining rdf:type
+        # triple. Otherwise such widely shared triples would drag most of the closure into the rederivation.
+        overdeleted = list()
+        kept = set()
+
+        def well_founded(t):
+            return t in kept or self.asserted(t)
+
+        queue = deque(triples)
+        while queue:
+            triple = queue.popleft()
+            for head in self.consequences(triple, [self.graph, deleted]):
+                if head in deleted or head in kept or head not in self.inferred or self.asserted(head):
+                    continue
+                if self.derivable(head, accept=well_founded):
+                    kept.add(head)
+                    continue
+                deleted.add(head)
+                overdeleted.append(head)
+                queue.append(head)
+            self._processed()
+        for triple in overdeleted:
+            self.inferred.remove(triple)
+
+        # rederive: deleted triples still derivable from the remaining triples and their consequences
+        rederived = [triple for triple in triples + overdeleted if self.derivable(triple)]
+        for triple in rederived:
+            self.inferred.add(triple)
+        self.propagate(rederived)
+        num_retracted = sum(1 for triple in overdeleted if triple not in self.graph)
+        self.stats['retracted'] += num_retracted
+        self.stats['rederived'] += len(overdeleted) - num_retracted
+        logging.info(f"Removed {len(triples)} triples: {len(overdeleted)} inferred triples deleted, "
+                     f"{len(overdeleted) - num_retracted} of them rederived in {time.perf_counter() - start_time:.2f}s")
+        return num_retracted
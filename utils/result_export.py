@@ -0,0 +1,164 @@
+#
+#  Serialization of SELECT results as a stream of text chunks in the SPARQL 1.1 result formats CSV, TSV and JSON,
+#  and as NDJSON (one JSON object of bindings per row). Rows are serialized as they are fetched, so an export
+#  never holds the whole result in memory. The chunks can be gzip compressed on the fly. ASK results are
+#  serialized as SPARQL JSON, CONSTRUCT and DESCRIBE results by the rdflib serializers of GRAPH_FORMATS.
+#     for chunk in gzip_chunks(buffered(serialize('csv', vars, rows))): ...
+#
+import csv
+import io
+import json
+import zlib
+
+from rdflib.plugins.serializers.nt import _quoteLiteral
+from rdflib.term import BNode, Literal, URIRef
+
+CHUNK_SIZE = 64 * 1024  # characters collected before a chunk is sent
+GZIP_LEVEL = 6
+
+
+# TERMS
+def json_term(term):
+    if isinstance(term, Literal):
+        binding = {'type': 'literal', 'value': str(term)}
+        if term.datatype is not None:
+            binding['datatype'] = str(term.datatype)
+        if term.language is not None:
+            binding['xml:lang'] = term.language
+        return binding
+    if isinstance(term, BNode):
+        return {'type': 'bnode', 'value': str(term)}
+    return {'type': 'uri', 'value': str(term)}
+
+
+def json_to_term(binding):
+    """
+    :return: term of a binding of the SPARQL JSON result format (inverse of json_term)
+    """
+    if binding['type'] == 'literal':
+        datatype = binding.get('datatype')
+        return Literal(binding['value'], lang=binding.get('xml:lang'), datatype=URIRef(datatype) if datatype else None)
+    if binding['type'] == 'bnode':
+        return BNode(binding['value'])
+    return URIRef(binding['value'])
+
+
+def tsv_term(term):
+    if term is None:
+        return ''
+    if isinstance(term, Literal):
+        return _quoteLiteral(term).replace('\t', '\\t')
+    if isinstance(term, BNode):
+        return '_:' + term
+    return '<' + term + '>'
+
+
+def bindings(variables, row):
+    return {var: json_term(term) for var, term in zip(variables, row) if term is not None}
+
+
+# FORMATS
+def csv_chunks(variables, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\r\n')
+    writer.writerow(variables)
+    for row in rows:
+        writer.writerow(['' if term is None else str(term) for term in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def tsv_chunks(variables, rows):
+    yield '\t'.join('?' + var for var in variables) + '\n'
+    for row in rows:
+        yield '\t'.join(tsv_term(term) for term in row) + '\n'
+
+
+def json_chunks(variables, rows):
+    yield '{"head": {"vars": ' + json.dumps(variables) + '}, "results": {"bindings": ['
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps(bindings(variables, row), ensure_ascii=False)
+        separator = ',\n'
+    yield '\n]}}\n'
+
+
+def ndjson_chunks(variables, rows):
+    for row in rows:
+        yield json.dumps(bindings(variables, row), ensure_ascii=False) + '\n'
+
+
+# name -> (mimetype, file extension, serializer)
+FORMATS = {'csv': ('text/csv', 'csv', csv_chunks),
+           'tsv': ('text/tab-separated-values', 'tsv', tsv_chunks),
+           'json': ('application/sparql-results+json', 'srj', json_chunks),
+           'ndjson': ('application/x-ndjson', 'ndjson', ndjson_chunks)}
+
+
+# name -> (mimetype, file extension) of the rdflib serializer of CONSTRUCT and DESCRIBE results
+GRAPH_FORMATS = {'turtle': ('text/turtle', 'ttl'),
+                 'nt': ('application/n-triples', 'nt'),
+                 'xml': ('application/rdf+xml', 'rdf'),
+                 'json-ld': ('application/ld+json', 'jsonld')}
+
+
+def negotiate(accept_mimetypes, formats):
+    """
+    Selects a format by the Accept header of a request
+    :param accept_mimetypes: accepted mimetypes of request (request.accept_mimetypes)
+    :param formats: FORMATS or GRAPH_FORMATS
+    :return: name of format or None if no format is accepted explicitly
+    """
+    mimetype = accept_mimetypes.best_match([spec[0] for spec in formats.values()])
+    for name, spec in formats.items():
+        if spec[0] == mimetype:
+            return name
+    return None
+
+
+def serialize(result_format, variables, rows):
+    """
+    Serializes a SELECT result row by row
+    :param result_format: one of FORMATS
+    :param variables: variable names
+    :param rows: iterable of rows (tuples of terms, None if unbound)
+    :return: generator of text chunks
+    """
+    return FORMATS[result_format][2]([str(var) for var in variables], rows)
+
+
+def boolean_chunks(value):
+    """
+    Serializes an ASK result as SPARQL JSON
+    """
+    yield json.dumps({'head': {}, 'boolean': bool(value)}) + '\n'
+
+
+# STREAMING
+def buffered(chunks, size=CHUNK_SIZE):
+    """
+    Joins small chunks into chunks of about size characters
+    """
+    parts, length = list(), 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(parts)
+            parts, length = list(), 0
+    if parts:
+        yield ''.join(parts)
+
+
+def gzip_chunks(chunks, level=GZIP_LEVEL):
+    """
+    Encodes text chunks as utf-8 and compresses them into a gzip stream
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
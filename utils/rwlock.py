@@ -0,0 +1,76 @@
+#
+#  Readers-writer lock of the threads of a process: many readers or one writer. A waiting writer goes first (new
+#  readers wait until it is done), so a stream of queries does not starve a change. Both locks are reentrant, and
+#  the writer can read.
+#     lock = RWLock()
+#     with lock.read(): ...
+#     with lock.write() as locked: ...
+#
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = dict()  # thread id -> depth
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers[me] -= 1
+                if not self._readers[me]:
+                    del self._readers[me]
+                    self._cond.notify_all()
+
+    def acquire_write(self, blocking=True):
+        """
+        :param blocking: wait for the readers and the writer (otherwise return False if there are any)
+        :return: True if the lock is held
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return True
+            if me in self._readers:
+                raise RuntimeError("Read lock cannot be upgraded to write lock")
+            if not blocking and (self._writer is not None or self._readers):
+                return False
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+            return True
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def write(self, blocking=True):
+        locked = self.acquire_write(blocking)
+        try:
+            yield locked
+        finally:
+            if locked:
+                self.release_write()
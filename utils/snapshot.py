@@ -0,0 +1,152 @@
+#
+#  Binary snapshot of a graph with its named graphs: a dictionary of the distinct terms followed by the quads as an
+#  array of term ids.
+#     header:  magic, id typecode, number of terms, length of term dictionary, number of quads
+#     terms:   utf-8 json {'namespaces': [[prefix, uri], ..], 'kinds': 'UUBL..', 'terms': [value or [value,
+#              datatype, lang], ..]}
+#     quads:   4 ids per quad (subject, predicate, object, graph; little endian), aligned to the id size
+#  The snapshot is memory-mapped on load, the id array is read in place without copying it. Snapshots of older
+#  versions (THHSNAP1) hold 3 ids per triple and are loaded into the default graph.
+#     python -m utils.snapshot repo.trig repo.snap
+#
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from rdflib import Graph, ConjunctiveGraph
+from rdflib.term import URIRef, BNode, Literal
+
+MAGIC = b'THHSNAP2'
+MAGIC_TRIPLES = b'THHSNAP1'  # snapshot of older versions without named graphs
+HEADER = struct.Struct('<8scxxxxxxxQQQ')
+URI, BNODE, LITERAL = 'U', 'B', 'L'
+
+
+def encode_term(term):
+    if isinstance(term, Literal):
+        return LITERAL, [str(term), term.datatype, term.language]
+    if isinstance(term, BNode):
+        return BNODE, str(term)
+    return URI, str(term)
+
+
+def decode_terms(kinds, values):
+    terms = list()
+    for kind, value in zip(kinds, values):
+        if kind == URI:
+            terms.append(URIRef(value))
+        elif kind == LITERAL:
+            terms.append(Literal(value[0], lang=value[2], datatype=URIRef(value[1]) if value[1] else None))
+        else:
+            terms.append(BNode(value))
+    return terms
+
+
+def quads(graph):
+    if isinstance(graph, ConjunctiveGraph):
+        return ((s, p, o, c.identifier) for s, p, o, c in graph.quads((None, None, None)))
+    return ((s, p, o, graph.identifier) for s, p, o in graph)
+
+
+def save(graph, filename):
+    """
+    Writes a binary snapshot of graph (atomically replaced)
+    :param graph: graph (with its named graphs if it is a ConjunctiveGraph)
+    :param filename: snapshot file
+    :return: number of quads
+    """
+    start_time = time.perf_counter()
+    ids = dict()
+    quad_ids = array('Q')
+    for quad in quads(graph):
+        for term in quad:
+            term_id = ids.get(term)
+            if term_id is None:
+                term_id = ids[term] = len(ids)
+            quad_ids.append(term_id)
+    typecode = 'I' if len(ids) < 2 ** 32 else 'Q'
+    if typecode == 'I':
+        quad_ids = array('I', quad_ids)
+    if sys.byteorder == 'big':
+        quad_ids.byteswap()
+    kinds, values = list(), list()
+    for term in ids:
+        kind, value = encode_term(term)
+        kinds.append(kind)
+        values.append(value)
+    terms = json.dumps({'namespaces': [[prefix, str(uri)] for prefix, uri in graph.namespaces()],
+                        'kinds': ''.join(kinds), 'terms': values}, ensure_ascii=False).encode('utf-8')
+    padding = -(HEADER.size + len(terms)) % quad_ids.itemsize
+
+    with open(filename + '.tmp', 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, typecode.encode('ascii'), len(ids), len(terms), len(quad_ids) // 4))
+        fp.write(terms)
+        fp.write(b'\0' * padding)
+        quad_ids.tofile(fp)
+    os.replace(filename + '.tmp', filename)
+    logging.info(f"Snapshot saved: {filename} ({len(quad_ids) // 4} quads, {len(ids)} terms) "
+                 f"in {time.perf_counter() - start_time:.2f}s")
+    return len(quad_ids) // 4
+
+
+def load(graph, filename):
+    """
+    Adds the triples and namespaces of a snapshot to graph
+    :param graph: graph (the triples go to its named graphs if it is a ConjunctiveGraph)
+    :param filename: snapshot file
+    :return: number of quads of snapshot
+    """
+    start_time = time.perf_counter()
+    with open(filename, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, typecode, num_terms, terms_length, num_quads = HEADER.unpack_from(mm)
+        if magic not in (MAGIC, MAGIC_TRIPLES):
+            raise ValueError(f"Not a graph snapshot: {filename}")
+        width = 4 if magic == MAGIC else 3
+        typecode = typecode.decode('ascii')
+        offset = HEADER.size + terms_length
+        offset += -offset % array(typecode).itemsize
+        dictionary = json.loads(mm[HEADER.size:HEADER.size + terms_length].decode('utf-8'))
+        terms = decode_terms(dictionary['kinds'], dictionary['terms'])
+        for prefix, uri in dictionary['namespaces']:
+            graph.bind(prefix, uri, override=False)
+        default = graph.default_context if isinstance(graph, ConjunctiveGraph) else graph
+        with memoryview(mm) as buffer:
+            quad_ids = buffer[offset:offset + width * num_quads * array(typecode).itemsize].cast(typecode)
+            if sys.byteorder == 'big':
+                quad_ids = array(typecode, quad_ids)
+                quad_ids.byteswap()
+            ids = iter(quad_ids)
+            if width == 4:
+                contexts = {c: Graph(store=graph.store, identifier=terms[c]) if isinstance(graph, ConjunctiveGraph) else graph
+                            for c in set(quad_ids[3::4])}
+                graph.store.addN((terms[s], terms[p], terms[o], contexts[c]) for s, p, o, c in zip(ids, ids, ids, ids))
+            else:
+                graph.store.addN((terms[s], terms[p], terms[o], default) for s, p, o in zip(ids, ids, ids))
+            if isinstance(quad_ids, memoryview):
+                quad_ids.release()
+    logging.info(f"Snapshot loaded: {filename} ({num_quads} quads, {num_terms} terms) "
+                 f"in {time.perf_counter() - start_time:.2f}s")
+    return num_quads
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Convert rdf file to graph snapshot and back')
+    parser.add_argument('source', help='rdf file or snapshot (.snap)')
+    parser.add_argument('target', help='snapshot (.snap) or rdf file (.trig or .nq keep the named graphs)')
+    args = parser.parse_args()
+    g = ConjunctiveGraph()
+    if args.source.endswith('.snap'):
+        load(g, args.source)
+    else:
+        g.parse(args.source)
+    if args.target.endswith('.snap'):
+        save(g, args.target)
+    else:
+        g.serialize(destination=args.target)
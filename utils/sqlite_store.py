@@ -0,0 +1,359 @@
+#
+#  rdflib store keeping a graph with named graphs in a local SQLite database. Terms are dictionary encoded in table
+#  'terms' and quads are stored as term ids in a clustered (s, p, o, g) table with covering (p, o, s, g),
+#  (o, s, p, g) and (g, s, p, o) indices. Opening a store reads no triples: each triple pattern pages through the
+#  index whose prefix is bound; a pattern on the union of the graphs groups the quads of a triple.
+#     ConjunctiveGraph(store='SQLite').open(folder, create=True)
+#
+import logging
+import os
+import sqlite3
+import threading
+from itertools import islice
+from os import path
+
+from rdflib import Graph
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+from rdflib.store import Store, VALID_STORE, NO_STORE
+from rdflib.term import URIRef, BNode, Literal
+
+DB_FILE = 'graph.sqlite'
+PAGE_SIZE = 1000  # triples fetched per index lookup
+BATCH_SIZE = 10000  # triples inserted per statement of addN
+TERM_CACHE_SIZE = 200000  # cached term <-> id mappings
+TERM_SIZE = 250  # estimated bytes of a cached term <-> id mapping
+CONNECTION_SIZE = 2 * 1024 * 1024  # estimated bytes of an open connection (page cache)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL,
+                                  datatype TEXT NOT NULL, lang TEXT NOT NULL, UNIQUE (kind, value, datatype, lang));
+CREATE TABLE IF NOT EXISTS quads (g INTEGER NOT NULL, s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL,
+                                  PRIMARY KEY (s, p, o, g)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS quads_pos ON quads (p, o, s, g);
+CREATE INDEX IF NOT EXISTS quads_osp ON quads (o, s, p, g);
+CREATE INDEX IF NOT EXISTS quads_gspo ON quads (g, s, p, o);
+CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, uri TEXT NOT NULL UNIQUE);
+"""
+
+# column order of the index used for the bound positions of a triple pattern (the graph is the last column)
+INDEX_ORDER = {(): 'spo', ('s',): 'spo', ('s', 'p'): 'spo', ('s', 'p', 'o'): 'spo', ('p',): 'pos',
+               ('p', 'o'): 'pos', ('o',): 'osp', ('s', 'o'): 'osp'}
+DEFAULT_CONTEXT = DATASET_DEFAULT_GRAPH_ID  # graph of triples added without context and of migrated triple tables
+
+
+def encode(term):
+    if isinstance(term, Literal):
+        return 'L', str(term), str(term.datatype or ''), term.language or ''
+    if isinstance(term, BNode):
+        return 'B', str(term), '', ''
+    return 'U', str(term), '', ''
+
+
+def decode(kind, value, datatype, lang):
+    if kind == 'L':
+        return Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+    if kind == 'B':
+        return BNode(value)
+    return URIRef(value)
+
+
+class SQLiteStore(Store):
+    """
+    Persistent, context aware rdflib store in a SQLite database. Changes are written in a transaction that is made
+    durable by commit() or close(commit_pending_transaction=True).
+    """
+    context_aware = True
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        self.connection = None
+        self.identifier = identifier
+        self._lock = threading.RLock()
+        self._ids = dict()
+        self._terms = dict()
+        self._namespaces = dict()
+        self._prefixes = dict()
+        self._graphs = dict()
+        self._data_version = None
+        super().__init__(configuration)
+
+    #
+    # OPEN/CLOSE
+    #
+    def open(self, configuration, create=True):
+        """
+        Opens the database in folder configuration
+        :param configuration: folder of store
+        :param create: create the store if it does not exist
+        :return: VALID_STORE or NO_STORE
+        """
+        db_file = path.join(configuration, DB_FILE)
+        if not path.isfile(db_file):
+            if not create:
+                return NO_STORE
+            os.makedirs(configuration, exist_ok=True)
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+        self._load_namespaces()
+        self._data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+        logging.info(f"Opened SQLite store: {db_file}")
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        with self._lock:
+            if self.connection is None:
+                return
+            if commit_pending_transaction:
+                self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def resident_size(self):
+        """
+        :return: estimated bytes of memory of the open store (connection and term caches)
+        """
+        if self.connection is None:
+            return 0
+        return CONNECTION_SIZE + (len(self._ids) + len(self._terms)) * TERM_SIZE
+
+    def destroy(self, configuration):
+        self.close()
+        for suffix in ['', '-wal', '-shm']:
+            if path.isfile(path.join(configuration, DB_FILE + suffix)):
+                os.remove(path.join(configuration, DB_FILE + suffix))
+
+    def commit(self):
+        with self._lock:
+            self.connection.commit()
+
+    def rollback(self):
+        with self._lock:
+            self.connection.rollback()
+            self._ids.clear()
+            self._terms.clear()
+            self._load_namespaces()
+
+    def changed(self):
+        """
+        True if another connection (e.g. of another process) has committed changes since the last call
+        """
+        with self._lock:
+            data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+            changed, self._data_version = data_version != self._data_version, data_version
+            if changed:
+                self._load_namespaces()
+        return changed
+
+    def _migrate(self):
+        """
+        Moves the triples of the table 'spo' of older versions into the default graph
+        """
+        if self.connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='spo'").fetchone():
+            with self._lock:
+                graph_id = self._term_id(DEFAULT_CONTEXT, create=True)
+                num_triples = self.connection.execute('INSERT OR IGNORE INTO quads SELECT ?, s, p, o FROM spo',
+                                                      (graph_id,)).rowcount
+                self.connection.execute('DROP TABLE spo')
+                self.connection.commit()
+            logging.info(f"Migrated {num_triples} triples into graph {DEFAULT_CONTEXT}")
+
+    #
+    # TERM DICTIONARY
+    #
+    def _term_id(self, term, create=False):
+        key = encode(term)
+        term_id = self._ids.get(key)
+        if term_id is None:
+            row = self.connection.execute('SELECT id FROM terms WHERE kind=? AND value=? AND datatype=? AND lang=?',
+                                          key).fetchone()
+            if row:
+                term_id = row[0]
+            elif create:
+                term_id = self.connection.execute('INSERT INTO terms (kind, value, datatype, lang) VALUES (?,?,?,?)',
+                                                  key).lastrowid
+            else:
+                return None
+            if len(self._ids) >= TERM_CACHE_SIZE:
+                self._ids.clear()
+            self._ids[key] = term_id
+        return term_id
+
+    def _terms_of(self, ids):
+        missing = list({i for i in ids if i not in self._terms})
+        if missing:
+            if len(self._terms) + len(missing) > TERM_CACHE_SIZE:
+                self._terms.clear()
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self.connection.execute(f"SELECT id, kind, value, datatype, lang FROM terms "
+                                               f"WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                for term_id, kind, value, datatype, lang in rows:
+                    self._terms[term_id] = decode(kind, value, datatype, lang)
+        return self._terms
+
+    def _context_id(self, context, create=False):
+        return self._term_id(DEFAULT_CONTEXT if context is None else context.identifier, create)
+
+    def _graph(self, identifier):
+        graph = self._graphs.get(identifier)
+        if graph is None:
+            graph = self._graphs[identifier] = Graph(store=self, identifier=identifier)
+        return graph
+
+    def _pattern(self, triple_pattern, context=None):
+        """
+        :return: dict of bound position (g for the context) -> term id or None if a bound term is not in the store
+        """
+        bound = dict()
+        if context is not None:
+            bound['g'] = self._context_id(context)
+            if bound['g'] is None:
+                return None
+        for position, term in zip('spo', triple_pattern):
+            if term is not None:
+                term_id = self._term_id(term)
+                if term_id is None:
+                    return None
+                bound[position] = term_id
+        return bound
+
+    #
+    # TRIPLES
+    #
+    def add(self, triple, context, quoted=False):
+        Store.add(self, triple, context, quoted)
+        with self._lock:
+            self.connection.execute('INSERT OR IGNORE INTO quads VALUES (?,?,?,?)',
+                                    [self._context_id(context, create=True)] +
+                                    [self._term_id(term, create=True) for term in triple])
+
+    def addN(self, quads):
+        """
+        Adds quads in batches without dispatching TripleAddedEvents
+        """
+        quads = iter(quads)
+        while True:
+            batch = list(islice(quads, BATCH_SIZE))
+            if not batch:
+                break
+            with self._lock:
+                self.connection.executemany('INSERT OR IGNORE INTO quads VALUES (?,?,?,?)',
+                                            [[self._context_id(quad[3], create=True)] +
+                                             [self._term_id(term, create=True) for term in quad[:3]]
+                                             for quad in batch])
+
+    def remove(self, triple_pattern, context=None):
+        with self._lock:
+            bound = self._pattern(triple_pattern, context)
+            if bound is None:
+                return
+            where = ' AND '.join(f"{position}=?" for position in bound) or '1'
+            self.connection.execute(f"DELETE FROM quads WHERE {where}", list(bound.values()))
+
+    def triples(self, triple_pattern, context=None):
+        """
+        Triples matching triple_pattern in context or, if context is None, in the union of all graphs with the
+        graphs they are in
+        """
+        with self._lock:
+            bound = self._pattern(triple_pattern, context)
+        if bound is None:
+            return
+        order = INDEX_ORDER[tuple(position for position in 'spo' if position in bound)]
+        if list(bound) == ['g']:
+            order = 'gspo'
+        fixed = [position for position in order if position in bound]
+        free = [position for position in order if position not in bound]
+        params = [bound[position] for position in fixed]
+        where = [f"{position}=?" for position in fixed]
+        if 'g' in bound and 'g' not in order:
+            params.append(bound['g'])
+            where.append('g=?')
+        after = None
+        while True:
+            conditions = where + ([f"({','.join(free)}) > ({','.join('?' * len(free))})"] if after else [])
+            if context is None:
+                sql = f"SELECT s, p, o, group_concat(g) FROM quads WHERE {' AND '.join(conditions) or '1'} " \
+                      f"GROUP BY {','.join(order)}"
+            else:
+                sql = f"SELECT s, p, o, g FROM quads WHERE {' AND '.join(conditions) or '1'}"
+            if free:
+                sql += f" ORDER BY {','.join(free)} LIMIT {PAGE_SIZE}"
+            with self._lock:
+                rows = self.connection.execute(sql, params + (after or [])).fetchall()
+                if context is None:
+                    rows = [(s, p, o, [int(g) for g in graphs.split(',')]) for s, p, o, graphs in rows]
+                    terms = self._terms_of([term_id for row in rows for term_id in row[:3] + tuple(row[3])])
+                    page = [((terms[s], terms[p], terms[o]), [self._graph(terms[g]) for g in graphs])
+                            for s, p, o, graphs in rows]
+                else:
+                    terms = self._terms_of([term_id for row in rows for term_id in row[:3]])
+                    page = [((terms[s], terms[p], terms[o]), [context]) for s, p, o, _ in rows]
+            for triple, graphs in page:
+                yield triple, iter(graphs)
+            if not free or len(rows) < PAGE_SIZE:
+                return
+            last = dict(zip('spo', rows[-1][:3]))
+            after = [last[position] for position in free]
+
+    def __len__(self, context=None):
+        with self._lock:
+            if context is None:
+                return self.connection.execute('SELECT COUNT(*) FROM (SELECT DISTINCT s, p, o FROM quads)') \
+                    .fetchone()[0]
+            graph_id = self._context_id(context)
+            if graph_id is None:
+                return 0
+            return self.connection.execute('SELECT COUNT(*) FROM quads WHERE g=?', (graph_id,)).fetchone()[0]
+
+    def contexts(self, triple=None):
+        """
+        Graphs containing triple or, if triple is None, all graphs
+        """
+        with self._lock:
+            if triple is None:
+                rows = self.connection.execute('SELECT DISTINCT g FROM quads').fetchall()
+            else:
+                bound = self._pattern(triple)
+                if bound is None or len(bound) < 3:
+                    return
+                rows = self.connection.execute('SELECT g FROM quads WHERE s=? AND p=? AND o=?',
+                                               [bound[position] for position in 'spo']).fetchall()
+            terms = self._terms_of([row[0] for row in rows])
+            graphs = [self._graph(terms[row[0]]) for row in rows]
+        yield from graphs
+
+    #
+    # NAMESPACES
+    #
+    def _load_namespaces(self):
+        self._namespaces = dict(self.connection.execute('SELECT prefix, uri FROM namespaces'))
+        self._prefixes = {uri: prefix for prefix, uri in self._namespaces.items()}
+
+    def bind(self, prefix, namespace, override=True):
+        prefix, namespace = str(prefix), str(namespace)
+        if self._namespaces.get(prefix) == namespace:
+            return
+        with self._lock:
+            if override:
+                self.connection.execute('DELETE FROM namespaces WHERE prefix=? OR uri=?', (prefix, namespace))
+                self.connection.execute('INSERT INTO namespaces VALUES (?,?)', (prefix, namespace))
+            else:
+                self.connection.execute('INSERT OR IGNORE INTO namespaces VALUES (?,?)', (prefix, namespace))
+            self._load_namespaces()
+
+    def namespace(self, prefix):
+        uri = self._namespaces.get(prefix)
+        return URIRef(uri) if uri is not None else None
+
+    def prefix(self, namespace):
+        return self._prefixes.get(str(namespace))
+
+    def namespaces(self):
+        for prefix, uri in list(self._namespaces.items()):
+            yield prefix, URIRef(uri)
@@ -0,0 +1,176 @@
+#
+#  Local stand-in for the metadata api of a SAP Data Intelligence tenant. Used for testing the login
+#  without a real tenant:
+#     python -m utils.stub_tenant --port 8090
+#  and login with host http://localhost:8090, tenant 'default', user 'user', password 'password'
+#  The catalog api serves a synthetic container '/TABLES' with generated tables.
+#
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import parse_qs, unquote, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MD_API = '/app/datahub-app-metadata/api/v1'
+MD_API_RUNTIME = '/app/datahub-app-metadata/api/v1/version'
+CONTAINER = '/TABLES'
+
+
+#
+# Synthetic catalog
+#
+def synthetic_datasets(num_datasets, container=CONTAINER):
+    return [{'remoteObjectReference': {'qualifiedName': f"{container}/TABLE_{i}", 'name': f"TABLE_{i}",
+                                       'remoteObjectType': 'TABLE'}} for i in range(num_datasets)]
+
+
+def synthetic_factsheet(qualified_name, num_columns):
+    name = qualified_name.split('/')[-1]
+    columns = [{'name': f"COLUMN_{i}", 'type': 'STRING', 'templateType': 'string', 'length': 20,
+                'descriptions': [{'type': 'SHORT', 'value': f"Column {i} of {name}"}]} for i in range(num_columns)]
+    return {'metadata': {'uri': qualified_name, 'name': name, 'type': 'TABLE',
+                         'descriptions': [{'type': 'SHORT', 'value': f"Table {name}"}],
+                         'uniqueKeys': [{'attributeReferences': ['COLUMN_0']}]},
+            'columns': columns}
+
+
+def synthetic_tags(qualified_name):
+    return {'tagsOnDataset': [{'hierarchyName': 'Area', 'tags': [{'tag': {'path': 'Finance'}}]}],
+            'tagsOnAttribute': [{'attributeQualifiedName': 'COLUMN_0',
+                                 'tags': [{'hierarchyName': 'AlternativeLabels',
+                                           'tags': [{'tag': {'path': 'ID', 'name': 'ID'}}]}]}]}
+
+
+def synthetic_lineage(qualified_name):
+    """
+    Lineage of a dataset (None: no lineage), e.g. computation(inputs, outputs, computation_type)
+    """
+    return None
+
+
+def computation(inputs, outputs, computation_type='TRANSFORM'):
+    return {'publicComputationNodes': [{'transforms': [{'datasetComputation': [
+        {'inputDatasets': [{'externalDatasetRef': qn} for qn in inputs],
+         'outputDatasets': [{'externalDatasetRef': qn} for qn in outputs],
+         'computationType': computation_type}]}]}]}
+
+
+class StubTenantHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+
+    def authorized(self):
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('Basic '):
+            return False
+        credentials = base64.b64decode(auth[6:]).decode('utf-8')
+        return credentials == self.server.credentials
+
+    def send_json(self, status, data, etag=False):
+        body = json.dumps(data).encode('utf-8')
+        if etag:
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            throttled = self.server.throttle and self.server.requests % self.server.throttle == 0
+        time.sleep(self.server.latency)
+        url_path = urlparse(self.path).path
+        catalog = re.match(MD_API + r'/catalog/connections/[^/]+/(containers|datasets)/([^/]+)/?(\w*)$', url_path)
+        if not self.authorized():
+            self.send_json(401, {'message': 'Unauthorized'})
+        elif throttled:
+            self.send_json(429, {'message': 'Too many requests'})
+        elif url_path == MD_API_RUNTIME:
+            self.send_json(200, {'version': 'stub'})
+        elif url_path == MD_API + '/catalog/lineage/export':
+            lineage = synthetic_lineage(parse_qs(urlparse(self.path).query).get('qualifiedNameFilter', [''])[0])
+            if lineage:
+                self.send_json(200, lineage, etag=True)
+            else:
+                self.send_json(404, {'message': 'No lineage'})
+        elif catalog and catalog.group(1) == 'containers':
+            self.send_json(200, {'datasets': synthetic_datasets(self.server.num_datasets, unquote(catalog.group(2)))})
+        elif catalog and catalog.group(3) == 'factsheet':
+            self.send_json(200, synthetic_factsheet(unquote(catalog.group(2)), self.server.num_columns), etag=True)
+        elif catalog and catalog.group(3) == 'tags':
+            self.send_json(200, synthetic_tags(unquote(catalog.group(2))), etag=True)
+        else:
+            self.send_json(404, {'message': f'Not found: {self.path}'})
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def create_server(port=0, tenant='default', user='user', password='password', num_datasets=10, num_columns=10,
+                  latency=0, throttle=0, handler=StubTenantHandler):
+    """
+    Creates stub tenant server
+    :param port: port (0: any free port)
+    :param tenant: tenant
+    :param user: user
+    :param password: password
+    :param num_datasets: number of datasets in a container
+    :param num_columns: number of columns of a dataset
+    :param latency: seconds each response is delayed
+    :param throttle: every n-th request is answered with 429 (0: never)
+    :param handler: request handler class
+    :return: server
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.credentials = tenant + '\\' + user + ':' + password
+    server.num_datasets = num_datasets
+    server.num_columns = num_columns
+    server.latency = latency
+    server.throttle = throttle
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def start(**kwargs):
+    """
+    Starts stub tenant in a background thread
+    :param kwargs: arguments of create_server
+    :return: server, base url
+    """
+    server = create_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description='Stub SAP Data Intelligence tenant')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--tenant', default='default')
+    parser.add_argument('--user', default='user')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--datasets', type=int, default=10, help='Number of datasets in a container')
+    parser.add_argument('--columns', type=int, default=10, help='Number of columns of a dataset')
+    parser.add_argument('--latency', type=float, default=0, help='Delay of each response in seconds')
+    args = parser.parse_args()
+    server = create_server(args.port, args.tenant, args.user, args.password, num_datasets=args.datasets,
+                           num_columns=args.columns, latency=args.latency)
+    logging.info(f"Stub tenant: http://127.0.0.1:{args.port}")
+    server.serve_forever()
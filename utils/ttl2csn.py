@@ -15,6 +15,8 @@ from rdflib.namespace import RDF, RDFS, XSD
 
 from tabulate import tabulate
 
+from utils import query_cache
+
 
 # Global variables
 class Colors:
@@ -75,14 +77,35 @@ def build_query(query_dict, variables=None):
     return query_str
 
 
-def query(graph, statement):
+def bind_query(query_dict, variables):
+    """
+    Query template with variables bound as initBindings instead of replaced in the text. The query text stays the
+    same for all values and is parsed only once (prepared query cache). Variables that are not used as <VARIABLE>
+    in the template are replaced in the text.
+    :param query_dict: dict of query
+    :param variables: dict of replacements
+    :return: query string, bindings
+    """
+    query_str = query_dict['query']
+    bindings = dict()
+    for k, v in variables.items():
+        if f"<{k}>" in query_str:
+            query_str = query_str.replace(f"<{k}>", '?' + k)
+            bindings[k] = URIRef(v)
+        else:
+            query_str = query_str.replace(k, v)
+    return query_str, bindings
+
+
+def query(graph, statement, bindings=None):
     """
     Sends query to graph and converts the result into list of dict. Result string produced as well
     :param graph: graph
     :param statement: query statement
+    :param bindings: dict of variable bindings
     :return: list of dict, str
     """
-    query_result = graph.query(statement)
+    query_result = query_cache.query(graph, statement, bindings)
     if len(query_result.vars) > 1:
         results = [{str(v): r[v] for v in query_result.vars} for r in query_result]
         str_results = tabulate([[v for v in r.values()]for r in results], headers=query_result.vars)
@@ -93,8 +116,70 @@ def query(graph, statement):
     return results, str_results
 
 
-def ttl2json(g, query_file, name, table_ref=None):
+def add_attribute(tables, table_label, col_label, pred, obj):
+    table_attribute = tables[table_label]['elements'][col_label]
+    match pred:
+        case dimd.length:
+            try:
+                table_attribute['length'] = int(obj)
+            except ValueError as ve:
+                if obj:
+                    table_attribute['length'] = 1
+        case dimd.datatype:
+            dt = str(obj)
+            if dt not in map_cds_datatypes:
+                raise ValueError(f"Datatype \'{dt}\' not in map_cds_datatypes!")
+            table_attribute['type'] = map_cds_datatypes[dt]
+        case dimd.precision:
+            table_attribute['precision'] = int(obj)
+        case dimd.scale:
+            table_attribute['scale'] = int(obj)
+        case dimd.foreignReference:
+            target_table = re.match(r".*\/(\w+)\/\w+$", str(obj)).group(1)
+            target_column = re.match(r".*\/(\w+)$", str(obj)).group(1)
+            target_ref = '_' + target_table
+            table_attribute['@ObjectModel.foreignKey.association'] = {'=': target_ref}
+            if target_ref not in tables[table_label]['elements']:
+                tables[table_label]['elements'][target_ref] = {
+                    "@EndUserText.label": f"{table_label} to {target_table}",
+                    "target": target_table,
+                    "type": "cds.Association",
+                    "on": list()}
+            if len(tables[table_label]['elements'][target_ref]['on']) > 0:
+                tables[table_label]['elements'][target_ref]['on'].append('and')
+            tables[table_label]['elements'][target_ref]['on'].extend([
+                {"ref": [col_label]}, '=', {"ref": [target_ref, target_column]}])
+
+
+def label_comment(g, url):
+    """
+    Label/comment combinations of a resource in the order of a SPARQL pattern ?url rdfs:label ?label;
+    rdfs:comment ?comment
+    """
+    return [(label, comment) for label in g.objects(url, RDFS.label) for comment in g.objects(url, RDFS.comment)]
+
 
+def tables_from_graph(g):
+    """
+    Collects tables, columns and column attributes in one pass over the graph indices. Same result as the
+    queries GET_TABLES, GET_TABLE_COLUMNS and GET_COLUMN_ATTRIBUTES without parsing and running a query for each
+    table and column.
+    """
+    tables = dict()
+    for table_url in g.subjects(RDF.type, dimd.Table):
+        for table_label, table_comment in label_comment(g, table_url):
+            table_label = str(table_label)
+            tables[table_label] = {"kind": 'entity', "@EndUserText.label": str(table_comment), "elements": dict()}
+            for col_url in g.objects(table_url, dimd.column):
+                for col_label, col_comment in label_comment(g, col_url):
+                    col_label = str(col_label)
+                    tables[table_label]['elements'][col_label] = {"@EndUserText.label": str(col_comment)}
+                    for pred, obj in g.predicate_objects(col_url):
+                        add_attribute(tables, table_label, col_label, pred, obj)
+    return tables
+
+
+def tables_from_queries(g, query_file):
     queries = read_query_csv(query_file)
     # 1. Get all tables
     query_statement = queries['GET_TABLES']
@@ -106,50 +191,35 @@ def ttl2json(g, query_file, name, table_ref=None):
     for table in tables_list:
         table_label = str(table['label'])
         tables[table_label] = {"kind": 'entity', "@EndUserText.label": str(table['comment']), "elements": dict()}
-        query_statement = build_query(queries['GET_TABLE_COLUMNS'], {"TABLE": str(table['url'])})
+        query_statement, bindings = bind_query(queries['GET_TABLE_COLUMNS'], {"TABLE": str(table['url'])})
         # logging.debug(f"Columns query: {query_statement}")
-        columns, print_str = query(g, query_statement)
+        columns, print_str = query(g, query_statement, bindings)
         # print(print_str)
         for col in columns:
             col_label = str(col['label'])
             tables[table_label]['elements'][col_label] = {"@EndUserText.label": str(col['comment'])}
-            query_statement = build_query(queries['GET_COLUMN_ATTRIBUTES'], {"COLUMN": str(col['url'])})
+            query_statement, bindings = bind_query(queries['GET_COLUMN_ATTRIBUTES'], {"COLUMN": str(col['url'])})
             # logging.debug(f"Attributes query: {query_statement}")
-            attributes, print_str = query(g, query_statement)
+            attributes, print_str = query(g, query_statement, bindings)
             # print(print_str)
             for att in attributes:
-                table_attribute = tables[table_label]['elements'][col_label]
-                match att['pred']:
-                    case dimd.length:
-                        try:
-                            table_attribute['length'] = int(att['obj'])
-                        except ValueError as ve:
-                            if att['obj']:
-                                table_attribute['length'] = 1
-                    case dimd.datatype:
-                        dt = str(att['obj'])
-                        if dt not in map_cds_datatypes:
-                            raise ValueError(f"Datatype \'{dt}\' not in map_cds_datatypes!")
-                        table_attribute['type'] = map_cds_datatypes[dt]
-                    case dimd.precision:
-                        table_attribute['precision'] = int(att['obj'])
-                    case dimd.scale:
-                        table_attribute['scale'] = int(att['obj'])
-                    case dimd.foreignReference:
-                        target_table = re.match(r".*\/(\w+)\/\w+$", str(att['obj'])).group(1)
-                        target_column = re.match(r".*\/(\w+)$", str(att['obj'])).group(1)
-                        target_ref = '_' + target_table
-                        table_attribute['@ObjectModel.foreignKey.association'] = {'=': target_ref}
-                        if target_ref not in tables[table_label]['elements']:
-                            tables[table_label]['elements'][target_ref] = {
-                                "@EndUserText.label": f"{table_label} to {target_table}",
-                                "target": target_table,
-                                "type": "cds.Association",
-                                "on": list()}
-                        if len(tables[table_label]['elements'][target_ref]['on']) > 0:
-                            tables[table_label]['elements'][target_ref]['on'].append('and')
-                        tables[table_label]['elements'][target_ref]['on'].extend([
-                            {"ref": [col_label]}, '=', {"ref": [target_ref, target_column]}])
+                add_attribute(tables, table_label, col_label, att['pred'], att['obj'])
+    return tables
+
+
+def ttl2json(g, query_file, name, table_ref=None):
+    """
+    Converts the tables of graph to CSN
+    :param g: graph
+    :param query_file: csv file with custom queries GET_TABLES, GET_TABLE_COLUMNS and GET_COLUMN_ATTRIBUTES.
+    None: tables, columns and attributes are collected in one pass over the graph.
+    :param name: name of model
+    :return: CSN as json string
+    """
+    if query_file:
+        tables = tables_from_queries(g, query_file)
+    else:
+        tables = tables_from_graph(g)
 
     # Add metadata
     csn_dict = {